@@ -1,72 +1,114 @@
 import argparse
-import ctypes
-import os
-from pathlib import Path
-
-import gi
-
-# Setup GTK stuff. This is quite annoying but it needs to go here.
-binary_dir = str(Path(__file__).parent / "bin")
-os.environ["GI_TYPELIB_PATH"] = binary_dir
-ctypes.CDLL(binary_dir + "/libgtk4-layer-shell.so")
-gi.require_version("Gtk", "4.0")
-gi.require_version("Gdk", "4.0")
-gi.require_version("Gsk", "4.0")
-gi.require_version("Graphene", "1.0")
-gi.require_version("Gtk4LayerShell", "1.0")
-
+import contextlib
 import importlib
 import sys
+import typing
+from pathlib import Path
 
 from desktop_thingies import constants
-from desktop_thingies.client import Client
-from desktop_thingies.physics_object import Texture, Rectangle, Circle
+
+if typing.TYPE_CHECKING:
+    from desktop_thingies.particles import Particles
+    from desktop_thingies.physics_object import Circle, Rectangle, Texture
+    from desktop_thingies.simulation import Simulation
 
 __all__ = (
     "Texture",
     "Rectangle",
     "Circle",
+    "Particles",
+    "Simulation",
 )
 
+# Importing the objects pulls in pymunk, so it is put off until a config actually
+# uses them. This keeps `desktop-thingies --help` fast.
+_LAZY_ATTRIBUTES = {
+    "Texture": "desktop_thingies.physics_object",
+    "Rectangle": "desktop_thingies.physics_object",
+    "Circle": "desktop_thingies.physics_object",
+    "Particles": "desktop_thingies.particles",
+    "Simulation": "desktop_thingies.simulation",
+}
+
+
+def __getattr__(name: str) -> typing.Any:
+    if (module := _LAZY_ATTRIBUTES.get(name)) is not None:
+        return getattr(importlib.import_module(module), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
+
 
 def main():
+    # The benchmark has its own options and doesn't need a config.
+    if sys.argv[1:2] == ["bench"]:
+        from desktop_thingies import bench
+
+        bench.main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
-        prog="desktop-thingies", description="Add objects to your desktop."
+        prog="desktop-thingies",
+        description="Add objects to your desktop.",
+        epilog="Run `desktop-thingies bench --help` to benchmark the physics and "
+        "drawing.",
     )
 
     parser.add_argument(
         "-c", "--config", help="The python file to use as the config file."
     )
 
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Measure frame timings and show them on screen.",
+    )
+    parser.add_argument(
+        "--stats-output",
+        help="Also write stats as JSON lines to this file, or to a unix socket "
+        "given as 'unix:PATH'. Implies --stats.",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Print how long each phase of starting up took.",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="TRACE",
+        help="Record the objects and pointer input of the first window to this "
+        "file, replay it with `python -m desktop_thingies.replay TRACE`.",
+    )
+
     args = parser.parse_args()
 
-    config = args.config
-    if not config:
-        if config_path := os.environ.get("XDG_CONFIG_HOME"):
-            config = Path(config) / "desktop-thingies" / "config.py"
-        else:
-            config = (
-                Path(os.environ["HOME"]) / ".config" / "desktop-thingies" / "config.py"
-            )
-    else:
-        config = Path(args.config)
-
-    sys.path.append(str(config.parent))
+    from desktop_thingies.startup import StartupProfile
+
+    startup = StartupProfile() if args.profile_startup else None
+
+    from desktop_thingies import config
+
+    path = Path(args.config) if args.config else config.default_path()
     try:
-        config = importlib.import_module(config.name.removesuffix(".py"))
-    except ImportError:
-        print(f"Config file '{str(config)}' not found.")
+        with startup.phase("config") if startup else contextlib.nullcontext():
+            options = config.client_options(config.load(path))
+    except FileNotFoundError:
+        print(f"Config file '{str(path)}' not found.")
         exit(1)
 
+    # The client loads GTK and the layer shell library, which is only needed once
+    # we are actually going to open a window. Textures from the config are
+    # decoded in the background meanwhile.
+    with startup.phase("imports") if startup else contextlib.nullcontext():
+        from desktop_thingies.client import Client
+
     Client(
-        objects=config.objects,
-        monitor=getattr(config, "monitor", None),
-        target_framerate=getattr(config, "framerate", None),
-        gravity=getattr(config, "gravity", (0,0)),
-        wall_elasticity=getattr(config, "wall_elasticity", 0.5),
-        wall_friction=getattr(config, "wall_friction", 0.5),
-        top_offset=getattr(config, "top_offset", 0),
-        bottom_offset=getattr(config, "bottom_offset", 0),
-        left_offset=getattr(config, "left_offset", 0),
-        right_offset=getattr(config, "right_offset", 0),
+        **options,
+        config_path=path,
+        stats=args.stats or args.stats_output is not None,
+        stats_output=args.stats_output,
+        startup=startup,
+        record=Path(args.record) if args.record else None,
     ).start()
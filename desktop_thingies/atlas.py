@@ -0,0 +1,158 @@
+import dataclasses
+import threading
+import typing
+
+import numpy as np
+
+from desktop_thingies.textures import TextureImage
+
+if typing.TYPE_CHECKING:
+    from gi.repository import Gdk  # type: ignore
+
+# Every decoded image is packed into a few large pages, so drawing many different
+# sprites uses a handful of textures instead of one each.
+#
+# Images are packed in rows ("shelves") from the top of a page down. Pages start
+# small and grow as rows are added, so a page only takes as much memory as the
+# images in it.
+#
+# Adding an image means the page has to be uploaded again, so images are added
+# before any node is drawn with them: every object's images are packed when it
+# is first laid out, and nodes are rebuilt when `generation` changed since.
+
+PAGE_WIDTH = 2048
+MAX_PAGE_HEIGHT = 4096
+# Every image is surrounded by a copy of its edge pixels, so filtering at the edge
+# of an image doesn't blend in its neighbours.
+GUTTER = 1
+
+
+@dataclasses.dataclass
+class _Page:
+    pixels: np.ndarray
+    """RGBA8 pixels, `(height, width, 4)`."""
+    shelf_y: int = 0
+    shelf_height: int = 0
+    shelf_x: int = 0
+    version: int = 0
+    """Bumped every time an image is added, so the uploaded texture is replaced."""
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    def place(self, width: int, height: int) -> tuple[int, int] | None:
+        """Find room for a `width` by `height` box, growing the page if needed."""
+        if width > self.width:
+            return None
+        x, y, shelf_height = self.shelf_x, self.shelf_y, self.shelf_height
+        if x + width > self.width:
+            # Start a new row under the current one.
+            x, y, shelf_height = 0, y + shelf_height, 0
+        if y + height > MAX_PAGE_HEIGHT and y > 0:
+            return None
+
+        if y + height > self.height:
+            grown = np.zeros((y + height, self.width, 4), dtype=np.uint8)
+            grown[: self.height] = self.pixels
+            self.pixels = grown
+
+        self.shelf_x = x + width
+        self.shelf_y = y
+        self.shelf_height = max(shelf_height, height)
+        return x, y
+
+
+@dataclasses.dataclass(frozen=True)
+class Region:
+    """Where an image is in the atlas."""
+
+    page: int
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+_pages: list[_Page] = []
+_regions: dict[tuple[str, float], Region] = {}
+_gdk_textures: dict[int, tuple[int, "Gdk.Texture"]] = {}
+_generation = 0
+_lock = threading.Lock()
+
+
+def generation() -> int:
+    """A number that changes every time an image is added to any page."""
+    return _generation
+
+
+def version(page: int) -> int:
+    """A number that changes every time an image is added to `page`."""
+    return _pages[page].version
+
+
+def add(image: TextureImage) -> Region:
+    """Copy an image into the atlas, unless it is already in it."""
+    global _generation
+
+    with _lock:
+        if (region := _regions.get(image.key)) is not None:
+            return region
+
+        pixels = np.frombuffer(image.data, dtype=np.uint8).reshape(
+            image.height, image.width, 4
+        )
+        padded = np.pad(
+            pixels, ((GUTTER, GUTTER), (GUTTER, GUTTER), (0, 0)), mode="edge"
+        )
+        height, width = padded.shape[:2]
+
+        for index, page in enumerate(_pages):
+            if (spot := page.place(width, height)) is not None:
+                break
+        else:
+            # Images wider than a page get a page of their own.
+            page = _Page(np.zeros((0, max(PAGE_WIDTH, width), 4), dtype=np.uint8))
+            _pages.append(page)
+            index = len(_pages) - 1
+            spot = page.place(width, height)
+            assert spot is not None
+
+        x, y = spot
+        page.pixels[y : y + height, x : x + width] = padded
+        page.version += 1
+        _generation += 1
+
+        region = Region(index, x + GUTTER, y + GUTTER, image.width, image.height)
+        _regions[image.key] = region
+        return region
+
+
+def gdk_texture(page: int) -> "Gdk.Texture":
+    """Upload a page, or get the texture it was uploaded as if it didn't change
+    since.
+
+    Only the latest upload is kept here. Nodes built with an older one keep it
+    alive until they are rebuilt.
+    """
+    from gi.repository import Gdk, GLib  # type: ignore
+
+    with _lock:
+        atlas_page = _pages[page]
+        uploaded = _gdk_textures.get(page)
+        if uploaded is not None and uploaded[0] == atlas_page.version:
+            return uploaded[1]
+
+        texture = Gdk.MemoryTexture.new(
+            atlas_page.width,
+            atlas_page.height,
+            Gdk.MemoryFormat.R8G8B8A8,
+            GLib.Bytes.new(atlas_page.pixels.tobytes()),
+            atlas_page.width * 4,
+        )
+        _gdk_textures[page] = (atlas_page.version, texture)
+        return texture
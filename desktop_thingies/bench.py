@@ -0,0 +1,500 @@
+"""Benchmark the physics and the drawing of generated scenes.
+
+Run `desktop-thingies bench` (or `python -m desktop_thingies.bench`) to step
+scenes of 10 to 5000 objects with the default settings. `--scenario` picks what
+happens in the scene:
+
+- "pile": circles, rectangles and textures falling into a pile
+- "drift": objects drifting and bumping into each other without gravity
+- "fling": a pile where one object is dragged around and flung over and over
+- "particles": like "pile", but with `Particles` of the same sizes instead of objects
+
+`--threads`, `--spatial-hash` and `--iterations` compare the options for large
+scenes and `--render` also draws every frame offscreen with GSK's software renderer,
+so it works without a GPU. No window is opened.
+
+Every scene runs in a fresh process, so the peak memory use of one scene doesn't
+hide that of the next. `--output` writes the results as JSON and `--baseline`
+compares them against such a file.
+"""
+
+import argparse
+import dataclasses
+import json
+import math
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+import typing
+from pathlib import Path
+
+import numpy as np
+
+from desktop_thingies import atlas, textures
+from desktop_thingies.particles import Particles
+from desktop_thingies.physics_object import Circle, PhysicsObject, Rectangle, Texture
+from desktop_thingies.simulation import Grab, MoveMouse, Release, Simulation
+from desktop_thingies.state import SimState
+
+COUNTS = (10, 50, 100, 500, 1000, 2000, 5000)
+SCENARIOS = ("pile", "drift", "fling", "particles")
+WIDTH = 1920
+HEIGHT = 1080
+# How much of the screen the objects cover, no matter how many there are.
+COVERAGE = 0.4
+GRAVITY = (0, 200)
+# The size of the generated sprite textures are drawn with, in pixels.
+SPRITE_SIZE = 128
+# How fast objects start out in the "drift" scenario, in pixels per second.
+DRIFT_SPEED = 200
+# Every this many steps the "fling" scenario picks an object up, drags it around
+# for half the time and throws it.
+FLING_PERIOD = 90
+# Results are flagged when they are this much worse than the baseline.
+TOLERANCE = 0.1
+
+
+@dataclasses.dataclass
+class Result:
+    scenario: str
+    count: int
+    threads: int
+    spatial_hash: bool
+    iterations: int
+    rendered: bool
+    steps_per_second: float
+    """How many physics steps ran per second of stepping, without drawing."""
+    step_ms_mean: float
+    step_ms_p50: float
+    step_ms_p95: float
+    draw_ms_mean: float | None
+    """How long laying out and rendering a frame took, with `--render`."""
+    draw_ms_p95: float | None
+    peak_rss_mb: float
+    awake: int
+    """How many bodies were still awake at the end. Particles are only asleep
+    once all of them are."""
+
+    def key(self) -> tuple:
+        """What has to match for two results to be compared."""
+        return (
+            self.scenario,
+            self.count,
+            self.threads,
+            self.spatial_hash,
+            self.iterations,
+            self.rendered,
+        )
+
+    def row(self) -> str:
+        draw = "-" if self.draw_ms_mean is None else f"{self.draw_ms_mean:.3f}"
+        draw_p95 = "-" if self.draw_ms_p95 is None else f"{self.draw_ms_p95:.3f}"
+        return (
+            f"{self.scenario:>8}  {self.count:>6}  {self.steps_per_second:>9.1f}"
+            f"  {self.step_ms_mean:>9.3f}  {self.step_ms_p50:>9.3f}"
+            f"  {self.step_ms_p95:>9.3f}  {draw:>9}  {draw_p95:>9}"
+            f"  {self.peak_rss_mb:>8.1f}  {self.awake:>6}"
+        )
+
+
+HEADER = (
+    f"{'scenario':>8}  {'count':>6}  {'steps/s':>9}  {'mean ms':>9}  {'p50 ms':>9}"
+    f"  {'p95 ms':>9}  {'draw ms':>9}  {'draw p95':>9}  {'rss MB':>8}  {'awake':>6}"
+)
+
+# Compared against the baseline, and whether higher is better.
+METRICS = {
+    "steps_per_second": True,
+    "step_ms_mean": False,
+    "step_ms_p95": False,
+    "draw_ms_mean": False,
+    "draw_ms_p95": False,
+    "peak_rss_mb": False,
+}
+
+
+def sprite_path() -> Path:
+    """A generated sprite with a soft edge, so the benchmark doesn't depend on the
+    example images being around."""
+    path = textures.cache_dir("bench") / f"sprite-{SPRITE_SIZE}.png"
+    if path.exists():
+        return path
+
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGBA", (SPRITE_SIZE, SPRITE_SIZE))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse(
+        (4, SPRITE_SIZE // 6, SPRITE_SIZE - 4, SPRITE_SIZE - 4), fill=(230, 90, 80, 255)
+    )
+    draw.rectangle(
+        (SPRITE_SIZE // 3, 2, SPRITE_SIZE * 2 // 3, SPRITE_SIZE // 2),
+        fill=(250, 220, 120, 255),
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    image.save(path)
+    return path
+
+
+def make_objects(
+    count: int, rng: random.Random, with_textures: bool = False
+) -> list[PhysicsObject]:
+    """Circles, rectangles and optionally textures of mixed sizes that together
+    cover `COVERAGE` of the screen."""
+    size = math.sqrt(COVERAGE * WIDTH * HEIGHT / count)
+    kinds = 3 if with_textures else 2
+    sprite = str(sprite_path()) if with_textures else ""
+    objects: list[PhysicsObject] = []
+    for _ in range(count):
+        scale = rng.uniform(0.5, 1.2)
+        kind = rng.randrange(kinds)
+        if kind == 0:
+            objects.append(Circle(radius=size * scale / 2))
+        elif kind == 1:
+            objects.append(
+                Rectangle(width=size * scale, height=size * scale * rng.uniform(0.5, 1))
+            )
+        else:
+            # Round the scale so the same few decoded images are shared.
+            texture_scale = round(size * scale / SPRITE_SIZE, 1) or 0.1
+            objects.append(Texture(texture=sprite, scale=texture_scale))
+    return objects
+
+
+def make_particles(count: int) -> Particles:
+    """Particles in the size range of the circles of `make_objects`."""
+    size = math.sqrt(COVERAGE * WIDTH * HEIGHT / count)
+    return Particles(
+        count=count,
+        size=(size * 0.5, size * 1.2),
+        colors=("#e65a50", "#fadc78", "#5a8ce6"),
+    )
+
+
+class _OffscreenRenderer:
+    """Draw frames the way a window does, into a texture with the cairo renderer."""
+
+    def __init__(self) -> None:
+        # GTK has to be set up before anything is imported from `gi.repository`.
+        from desktop_thingies import gtk_setup  # noqa: F401
+
+        # isort: split
+        from gi.repository import Graphene, Gsk, Gtk  # type: ignore
+
+        from desktop_thingies.layout import FrameLayout
+
+        # Objects build their nodes with `Gtk.Snapshot`. Without a display GTK
+        # can't be initialized, but snapshots work anyway.
+        Gtk.init_check()
+        self.renderer = Gsk.CairoRenderer.new()
+        self.renderer.realize(None)
+        self.viewport = Graphene.Rect().init(0, 0, WIDTH, HEIGHT)
+        self.layout = FrameLayout(width=WIDTH, height=HEIGHT)
+        self.atlas_generation = atlas.generation()
+
+    def draw(self, state: SimState):
+        from gi.repository import Gsk  # type: ignore
+
+        objects = state.objects
+        if objects is not self.layout.objects:
+            for obj in self.layout.follow(objects):
+                obj._prepare_drawing()
+                obj._render_node = None
+        if self.atlas_generation != atlas.generation():
+            self.atlas_generation = atlas.generation()
+            self.layout.damage.invalidate()
+        if objects:
+            transforms, dirty = self.layout.update(state, 1)
+            for i in np.flatnonzero(dirty).tolist():
+                objects[i]._render_node = objects[i].transformed_node(
+                    *transforms[i].tolist()
+                )
+        particle_nodes = [
+            node
+            for particles in state.particles
+            if (node := particles.particles.render_node(particles, 1)) is not None
+        ]
+        root = Gsk.ContainerNode.new(
+            particle_nodes + [obj._render_node for obj in objects]
+        )
+        self.renderer.render_texture(root, self.viewport)
+
+    def close(self):
+        self.renderer.unrealize()
+
+
+@dataclasses.dataclass
+class _Fling:
+    """Drag an object around in a circle and throw it, every `FLING_PERIOD` steps."""
+
+    simulation: Simulation
+    holding: PhysicsObject | None = None
+
+    def before_step(self, step: int):
+        phase = step % FLING_PERIOD
+        center_x, center_y = WIDTH / 2, HEIGHT / 2
+        if phase == 0 and self.simulation.physics_objects:
+            self.holding = self.simulation.physics_objects[
+                (step // FLING_PERIOD) % len(self.simulation.physics_objects)
+            ]
+            self.simulation.send(MoveMouse(center_x, center_y))
+            self.simulation.send(Grab(self.holding))
+        elif self.holding is None:
+            return
+        elif phase < FLING_PERIOD // 2:
+            angle = phase / (FLING_PERIOD // 2) * math.tau
+            self.simulation.send(
+                MoveMouse(
+                    center_x + math.cos(angle) * 300, center_y + math.sin(angle) * 300
+                )
+            )
+        else:
+            self.simulation.send(MoveMouse(WIDTH - 10, 10))
+            self.simulation.send(Release())
+            self.holding = None
+
+
+def peak_rss_mb() -> float:
+    """The most memory this process has used, in megabytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run(
+    count: int,
+    *,
+    scenario: str = "pile",
+    threads: int = 1,
+    spatial_hash: bool = False,
+    iterations: int = 10,
+    steps: int = 300,
+    warmup: int = 60,
+    seed: int = 0,
+    render: bool = False,
+) -> Result:
+    """Step a scene of `count` objects and time every step.
+
+    The first `warmup` steps are not measured, they untangle the objects that
+    were placed on top of each other.
+    """
+    rng = random.Random(seed)
+    # `Simulation.setup` places objects with the global random module.
+    random.seed(seed)
+
+    particles = scenario == "particles"
+    simulation = Simulation(
+        width=WIDTH,
+        height=HEIGHT,
+        physics_objects=(
+            []
+            if particles
+            else make_objects(count, rng, with_textures=scenario != "drift")
+        ),
+        particles=[make_particles(count)] if particles else [],
+        gravity=(0, 0) if scenario == "drift" else GRAVITY,
+        threads=threads,
+        spatial_hash=spatial_hash,
+        iterations=iterations,
+    )
+    simulation.setup()
+    for obj in simulation.loading:
+        if obj._loading is not None:
+            obj._loading.result()
+
+    dt = 1 / 60
+    # Adds the textures that were loading.
+    simulation.step(dt)
+    if scenario == "drift":
+        for obj in simulation.physics_objects:
+            angle = rng.uniform(0, math.tau)
+            speed = DRIFT_SPEED * rng.uniform(0.5, 1) / 10
+            obj._body.velocity = (math.cos(angle) * speed, math.sin(angle) * speed)
+    fling = _Fling(simulation) if scenario == "fling" else None
+    renderer = _OffscreenRenderer() if render else None
+
+    for i in range(warmup):
+        if fling is not None:
+            fling.before_step(i)
+        simulation.step(dt)
+
+    step_timings = np.empty(steps)
+    draw_timings = np.empty(steps)
+    for i in range(steps):
+        if fling is not None:
+            fling.before_step(warmup + i)
+        start = time.perf_counter()
+        simulation.step(dt)
+        step_timings[i] = time.perf_counter() - start
+
+        if renderer is not None:
+            start = time.perf_counter()
+            renderer.draw(simulation.state)
+            draw_timings[i] = time.perf_counter() - start
+
+    if renderer is not None:
+        renderer.close()
+
+    step_ms = step_timings * 1000
+    awake = simulation.state.awake_count() + sum(
+        len(state.positions) for state in simulation.state.particles if not state.asleep
+    )
+    draw_ms = draw_timings * 1000
+    return Result(
+        scenario=scenario,
+        count=count,
+        threads=threads,
+        spatial_hash=spatial_hash,
+        iterations=iterations,
+        rendered=render,
+        steps_per_second=round(steps / float(step_timings.sum()), 1),
+        step_ms_mean=round(float(step_ms.mean()), 4),
+        step_ms_p50=round(float(np.percentile(step_ms, 50)), 4),
+        step_ms_p95=round(float(np.percentile(step_ms, 95)), 4),
+        draw_ms_mean=round(float(draw_ms.mean()), 4) if render else None,
+        draw_ms_p95=round(float(np.percentile(draw_ms, 95)), 4) if render else None,
+        peak_rss_mb=round(peak_rss_mb(), 1),
+        awake=awake,
+    )
+
+
+def _run_isolated(count: int, options: dict[str, typing.Any]) -> Result:
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(run, (count,), options)
+
+
+def compare(
+    results: list[Result], baseline: list[Result], tolerance: float = TOLERANCE
+) -> list[str]:
+    """Describe how `results` changed against `baseline`. Returns the changes that
+    are worse by more than `tolerance`."""
+    previous = {result.key(): result for result in baseline}
+    regressions = []
+    for result in results:
+        if (old := previous.get(result.key())) is None:
+            continue
+        changes = []
+        for metric, higher_is_better in METRICS.items():
+            new_value = getattr(result, metric)
+            old_value = getattr(old, metric)
+            if new_value is None or old_value is None or old_value == 0:
+                continue
+            change = new_value / old_value - 1
+            changes.append(f"{metric} {change:+.1%}")
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(
+                    f"{result.scenario} {result.count}: "
+                    f"{metric} {old_value} -> {new_value}"
+                )
+        print(f"{result.scenario:>8}  {result.count:>6}  {', '.join(changes)}")
+    return regressions
+
+
+def load_results(path: Path) -> list[Result]:
+    return [Result(**result) for result in json.loads(path.read_text())["results"]]
+
+
+def main(argv: typing.Sequence[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog="desktop-thingies bench",
+        description="Time physics steps and drawing for growing numbers of objects.",
+    )
+    parser.add_argument("--counts", type=int, nargs="+", default=list(COUNTS))
+    parser.add_argument(
+        "--scenario", choices=SCENARIOS, nargs="+", default=["pile"], dest="scenarios"
+    )
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--spatial-hash", action="store_true")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--render",
+        action="store_true",
+        help="Also draw every frame offscreen with the software renderer.",
+    )
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Run every scene in this process, peak memory then only goes up.",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print one JSON object per scene."
+    )
+    parser.add_argument(
+        "--output", type=Path, help="Write all results to this file as JSON."
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="Compare against results written with --output before. Exits with 1 "
+        "if anything got worse by more than --tolerance.",
+    )
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if args.render:
+        try:
+            import gi  # noqa: F401
+        except ImportError:
+            print("--render needs PyGObject and GTK 4.", file=sys.stderr)
+            exit(1)
+
+    options = dict(
+        threads=args.threads,
+        spatial_hash=args.spatial_hash,
+        iterations=args.iterations,
+        steps=args.steps,
+        seed=args.seed,
+        render=args.render,
+    )
+
+    if not args.json:
+        print(
+            f"threads={args.threads} spatial_hash={args.spatial_hash} "
+            f"iterations={args.iterations} render={args.render}"
+        )
+        print(HEADER)
+
+    results = []
+    for scenario in args.scenarios:
+        for count in args.counts:
+            if args.in_process:
+                result = run(count, scenario=scenario, **options)
+            else:
+                result = _run_isolated(count, dict(options, scenario=scenario))
+            results.append(result)
+            if args.json:
+                print(json.dumps(dataclasses.asdict(result)), flush=True)
+            else:
+                print(result.row(), flush=True)
+
+    if args.output is not None:
+        args.output.write_text(
+            json.dumps(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "processor": platform.processor(),
+                    "results": [dataclasses.asdict(result) for result in results],
+                },
+                indent=2,
+            )
+        )
+
+    if args.baseline is not None:
+        print(f"\nCompared to {args.baseline}:")
+        regressions = compare(results, load_results(args.baseline), args.tolerance)
+        if regressions:
+            print("\nWorse than the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,52 @@
+import concurrent.futures
+import contextlib
 import dataclasses
 import random
-import typing
-import threading
+import sys
 import time
-import math
+import traceback
+import typing
 from collections.abc import Callable
-from copy import deepcopy
-
-import gi
-import pymunk
-
-from desktop_thingies.constants import SIMULATION_SCALE
+from pathlib import Path
+
+# GTK has to be set up before anything is imported from `gi.repository`.
+from desktop_thingies import gtk_setup  # noqa: F401
+
+# isort: split
+import cairo
+import numpy as np
+from gi.repository import Gdk, Gio, GLib, Graphene, Gsk, Gtk, Pango  # type: ignore
+from gi.repository import Gtk4LayerShell as LayerShell  # type: ignore
+
+from desktop_thingies import atlas, config, snapshot
+from desktop_thingies.constants import MAX_STEPS_PER_FRAME
+from desktop_thingies.governor import PHYSICS_SHARE, Governor
+from desktop_thingies.layout import FrameLayout
+from desktop_thingies.pacing import (
+    RESIDUAL_ANGULAR_SPEED,
+    RESIDUAL_SPEED,
+    THROTTLED_FRAMERATE,
+    Pace,
+    WakeupCounter,
+)
+from desktop_thingies.particles import Particles
 from desktop_thingies.physics_object import PhysicsObject
-
-from gi.repository import Gdk, Gsk, Graphene, Gtk, GLib, Gtk4LayerShell as LayerShell  # type: ignore
+from desktop_thingies.replay import Recorder
+from desktop_thingies.simulation import (
+    AddObject,
+    Grab,
+    MoveMouse,
+    Release,
+    SetObjects,
+    SetParticles,
+    SetWorld,
+    Simulation,
+    Spin,
+)
+from desktop_thingies.startup import StartupProfile
+from desktop_thingies.state import SimState
+from desktop_thingies.stats import FrameStats, StatsWriter
+from desktop_thingies.worker import RemoteSimulation
 
 THEME = """
 window.background {
@@ -27,38 +60,15 @@ class Vec2(typing.NamedTuple):
     height: int
 
 
-def add_box(
-    space: pymunk.Space,
-    friction: float,
-    elasticity: float,
-    p0: tuple[int, int],
-    p1: tuple[int, int],
-    d: int = 4,
-):
-    WALL_WIDTH = 1000
-    WALL_OFFSET = 0
-    x0, y0 = p0
-    x1, y1 = p1
-    ps = [
-        (x0 - WALL_WIDTH - WALL_OFFSET, y0 - WALL_WIDTH - WALL_OFFSET),
-        (x1 + WALL_WIDTH + WALL_OFFSET, y0 - WALL_WIDTH - WALL_OFFSET),
-        (x1 + WALL_WIDTH + WALL_OFFSET, y1 + WALL_WIDTH + WALL_OFFSET),
-        (x0 - WALL_WIDTH - WALL_OFFSET, y1 + WALL_WIDTH + WALL_OFFSET),
-    ]
-    for i in range(4):
-        segment = pymunk.Segment(space.static_body, ps[i], ps[(i + 1) % 4], WALL_WIDTH)
-        segment.elasticity = friction
-        segment.friction = elasticity
-        space.add(segment)
-
-
-def clamp(n: float, max: float):
-    if n < 0:
-        if n < -max:
-            return -max
-    if n > max:
-        return max
-    return n
+# How often the bodies are saved while things are moving, in seconds. They are
+# also saved whenever everything falls asleep and on exit.
+CHECKPOINT_SECONDS = 30
+# Editors write files in several steps, wait this long for them to finish before
+# reloading the config.
+RELOAD_DELAY_MS = 200
+# The input region reaches this many pixels further than objects can be picked up
+# from, so it only has to be updated once an object moved further than that.
+INPUT_REGION_TOLERANCE = 16
 
 
 class Canvas(Gtk.Widget):
@@ -81,30 +91,60 @@ class PhysicsSpace:
     canvas: Canvas
     target_framerate: int | None
 
-    physics_space: pymunk.Space
-    physics_objects: list[PhysicsObject]
-    gravity: tuple[float, float] = (0, 0)
-    wall_friction: float = 0.5
-    wall_elasticity: float = 0.5
-    top_offset: int = 0
-    bottom_offset: int = 0
-    left_offset: int = 0
-    right_offset: int = 0
-
-
-    holding_body: pymunk.Body | None = None
-    is_initialized: bool = False
-
-    mouse_position: tuple[int, int] = (0, 0)
-    sim_lock: threading.Semaphore = dataclasses.field(
-        default_factory=threading.BoundedSemaphore
-    )
+    simulation: Simulation | RemoteSimulation
+
+    layout: FrameLayout = dataclasses.field(init=False)
+
+    pacing: typing.Literal["fixed", "adaptive"] = "adaptive"
+    """With "adaptive" pacing the space ticks less often while objects only move
+    slowly. With "fixed" it ticks every frame until everything sleeps."""
+    wakeups: WakeupCounter = dataclasses.field(default_factory=WakeupCounter)
+
+    executor: concurrent.futures.Executor | None = None
+    """Step the physics on this executor instead of the GTK main thread."""
+    on_frame: Callable[["PhysicsSpace"], None] | None = None
+    """Called on the main thread after the physics of each frame has run."""
+    stats: FrameStats | None = None
+    """Collect frame timings and draw them over the objects."""
+    governor: Governor | None = None
+    """Adapt solver iterations and substeps to how long steps take."""
+    snapshot_path: Path | None = None
+    """Save the bodies to this file now and then and put them back from it on
+    start."""
+    recorder: Recorder | None = None
+    """Record the scene, pointer input and frames for replaying them later."""
 
     SCALE = 10
-    has_saved = False
 
-    sim_sleep = False
-    sim_frame = 0
+    # The state that was last written to `snapshot_path` and when.
+    _saved_state: SimState | None = None
+    _saved_time = 0.0
+
+    # Seconds of real time that have not been simulated yet.
+    _accumulator = 0.0
+    # Frame clock timestamp of the previous tick, in seconds.
+    _last_frame_time = None
+    _pace = Pace.IDLE
+    _throttle_source: int | None = None
+    _step_future: concurrent.futures.Future | None = None
+    # How long the last `_prepare_frame` took, added to the draw time.
+    _prepare_time = 0.0
+
+    # The latest pointer position that hasn't been handled yet.
+    _pending_motion: tuple[float, float] | None = None
+    _cursor: str | None = None
+    # The object the user is holding, as far as the input handlers know. The
+    # simulation finds out when it applies the next `Grab` or `Release`.
+    _holding: PhysicsObject | None = None
+
+    # What the input region was last set from: the whole surface, or the objects
+    # and where they were.
+    _input_full = False
+    _input_objects: tuple[PhysicsObject, ...] | None = None
+    _input_positions = None
+
+    # The atlas generation the current nodes were built with.
+    _atlas_generation = 0
 
     def __post_init__(self):
         geometry = self.monitor.get_geometry()
@@ -112,231 +152,433 @@ class PhysicsSpace:
             geometry.width,
             geometry.height,
         )
+        self.layout = FrameLayout(width=geometry.width, height=geometry.height)
+        self._frame_nodes: list[Gsk.RenderNode] = []
+        self._particle_nodes: list[Gsk.RenderNode] = []
+
+    @property
+    def step(self) -> float:
+        if self.target_framerate:
+            step = 1 / self.target_framerate
+        else:
+            # Follow the monitor's refresh rate, which GDK reports in millihertz.
+            refresh_rate = self.monitor.get_refresh_rate() / 1000
+            step = 1 / (refresh_rate or 60)
+        if self._pace is Pace.THROTTLED:
+            # Ticks only come at `THROTTLED_FRAMERATE` then. Take longer steps, so
+            # even a tick that comes late runs no more than `MAX_STEPS_PER_FRAME`.
+            step = max(step, 2 / (THROTTLED_FRAMERATE * MAX_STEPS_PER_FRAME))
+        return step
+
+    @property
+    def has_saved(self) -> bool:
+        """Whether the current state of the bodies is saved."""
+        return self.simulation.state is self._saved_state
+
+    def save_snapshot(self):
+        if self.snapshot_path is None or self.has_saved:
+            return
+        state = self.simulation.state
+        # Until every object is loaded and in a published state, saving would drop
+        # the missing bodies from the snapshot and lose where they were.
+        if self.simulation.loading or not state.objects:
+            return
+        snapshot.save(self.snapshot_path, state, *self.geometry)
+        self._saved_state = state
+        self._saved_time = time.monotonic()
+
+    @property
+    def _is_updating(self) -> bool:
+        return self._pace is not Pace.IDLE
+
+    def _prepare_frame(self) -> bool:
+        """Work out where everything is drawn in the next frame.
+
+        Only objects that moved get a new render node. Returns whether anything
+        changed and the canvas has to be redrawn.
+        """
+        # How far we are between the last two physics states.
+        if self._is_updating:
+            alpha = min(self._accumulator / self.step, 1)
+        else:
+            alpha = 1
+
+        # The state is never changed after it is published, so it can be read
+        # while the next step runs.
+        state = self.simulation.state
+
+        # Each `Particles` is one node, which is the same as last frame while none
+        # of them moved.
+        particle_nodes = [
+            node
+            for particles in state.particles
+            if (node := particles.particles.render_node(particles, alpha)) is not None
+        ]
+        particles_changed = len(particle_nodes) != len(self._particle_nodes) or any(
+            a is not b for a, b in zip(particle_nodes, self._particle_nodes)
+        )
+        self._particle_nodes = particle_nodes
+
+        if state.objects is not self.layout.objects:
+            for obj in self.layout.follow(state.objects):
+                obj._prepare_drawing()
+                obj._render_node = None
+        if self._atlas_generation != atlas.generation():
+            # Images were added to the atlas, rebuild the nodes drawn with the
+            # pages from before.
+            self._atlas_generation = atlas.generation()
+            self.layout.damage.invalidate()
+        objects = state.objects
+
+        if not objects:
+            changed = bool(self._frame_nodes)
+            self._frame_nodes = []
+            return changed or particles_changed
+
+        transforms, dirty = self.layout.update(state, alpha)
+        if not dirty.any():
+            return particles_changed
+
+        for i in np.flatnonzero(dirty).tolist():
+            obj = objects[i]
+            obj._render_node = obj.transformed_node(*transforms[i].tolist())
+
+        self._frame_nodes = [obj._render_node for obj in objects]
+        return True
 
     def _draw(self, snapshot: Gtk.Snapshot):
-        self.sim_lock.acquire()
-        for obj in self.physics_objects:
-            snapshot.save()
-
-            angle = math.degrees(obj._body.angle)
-
-            x_strech = max(1, (abs(obj._body.velocity.x) - 70) / 1000 * .8 + 1)
-            y_strech = max(1, (abs(obj._body.velocity.y) - 70) / 1000 * .8 + 1)
-            x_strech -= (y_strech - 1) / 2
-            y_strech -= (x_strech - 1) / 2
-
-            x_diff = abs(obj._body.velocity.x - obj._last_velocity_x)
-            y_diff = abs(obj._body.velocity.y - obj._last_velocity_y)
-
-            STRECH_TIME = 4
-            if (obj._strech_time > 0):
-                x_strech = 1 - (1 - obj._strech_scale_x) * (obj._strech_time / STRECH_TIME)
-                y_strech = 1 - (1 - obj._strech_scale_y) * (obj._strech_time / STRECH_TIME)
-            elif (
-                (abs(obj._last_velocity_x) > 0.1 and math.copysign(1, obj._body.velocity.x / obj._last_velocity_x) == -1 or abs(obj._body.velocity.x - obj._last_velocity_x) > 10)
-                or (abs(obj._last_velocity_y) > 0.1 and math.copysign(1, obj._body.velocity.y / obj._last_velocity_y) == -1  or abs(obj._body.velocity.y - obj._last_velocity_y) > 10)
-            ):
-                STRETCH_MIN = 0.9
-                x_strech = max(STRETCH_MIN, 1 - (max(x_diff - 10, 1) / 800) ** 1.8)
-                y_strech = max(STRETCH_MIN, 1 - (max(y_diff - 10, 1) / 800) ** 1.8)
-
-                x_strech += (1 - y_strech) 
-                y_strech += (1 - x_strech)
-
-                obj._strech_scale_x = x_strech
-                obj._strech_scale_y = y_strech
-                obj._strech_time = STRECH_TIME + 1
-
-            if x_strech > 1.5:
-                x_strech = 1.5
-            if y_strech > 1.5:
-                y_strech = 1.5
-
-            if (self.holding_body == obj._body):
-                x_strech = 1.05
-                y_strech = 1.05
-
-            if abs(obj._body.angular_velocity) > 10:
-                y_strech += abs(obj._body.angular_velocity) / 500
-
-            pos = obj._body.position
-
-            snapshot.translate(
-                Graphene.Point().init(
-                    pos.x * SIMULATION_SCALE, pos.y * SIMULATION_SCALE
-                )
+        start = time.perf_counter()
+
+        # Nodes of objects that didn't move are the same as last frame, which lets
+        # GSK skip repainting them. Particles are drawn behind the objects.
+        for node in self._particle_nodes:
+            snapshot.append_node(node)
+        for node in self._frame_nodes:
+            if node is not None:
+                snapshot.append_node(node)
+
+        if self.stats is not None:
+            self.stats.record(
+                "draw", self._prepare_time + time.perf_counter() - start
             )
-            snapshot.transform(Gsk.Transform.new().scale(x_strech, y_strech))
-
-            snapshot.rotate(angle)
-
-            obj.render_onto(snapshot)
-
-            snapshot.restore()
-
-            obj._last_velocity_x = obj._body.velocity.x
-            obj._last_velocity_y = obj._body.velocity.y
-            obj._strech_time -= 1
-
-        self.sim_lock.release()
-
-    def check_hovered_object(self, x, y) -> pymunk.Body | None:
-        if self.holding_body:
-            self.canvas.set_cursor_from_name("grabbing")
-            return self.holding_body
-        self.sim_lock.acquire()
-        for obj in self.physics_objects:
-            if (
-                obj._physics_shape.point_query(
-                    (x / SIMULATION_SCALE, y / SIMULATION_SCALE)
-                ).distance
-                <= obj.pickup_distance / SIMULATION_SCALE
-            ):
-                self.canvas.set_cursor_from_name("grab")
-                self.sim_lock.release()
-                return obj
-        self.canvas.set_cursor_from_name("default")
-        self.sim_lock.release()
-        return None
+            self._prepare_time = 0.0
+            self._draw_stats(snapshot)
+
+    def _draw_stats(self, snapshot: Gtk.Snapshot):
+        assert self.stats
+        layout = self.canvas.create_pango_layout(self.stats.overlay_text())
+        layout.set_font_description(Pango.FontDescription.from_string("monospace 10"))
+        _, extents = layout.get_pixel_extents()
+
+        background = Gdk.RGBA()
+        background.parse("rgba(0, 0, 0, 0.6)")
+        foreground = Gdk.RGBA()
+        foreground.parse("#ffffff")
+
+        snapshot.append_color(
+            background,
+            Graphene.Rect().init(8, 8, extents.width + 16, extents.height + 16),
+        )
+        snapshot.save()
+        snapshot.translate(Graphene.Point().init(16, 16))
+        snapshot.append_layout(layout, foreground)
+        snapshot.restore()
+
+    def _update_input_region(self):
+        """Only take pointer input where an object can be picked up from.
+
+        Clicks everywhere else go to the desktop below, and moving the pointer
+        over it doesn't wake us up. While an object is held the whole surface
+        takes input, so it can be dragged anywhere.
+        """
+        surface = self.window.get_surface()
+        if surface is None:
+            return
 
-    def _on_mouse_click(self, gesture, data, x, y):
-        self.sim_sleep = False
-        if self.holding_body != None:
+        if self._holding is not None:
+            if not self._input_full:
+                surface.set_input_region(
+                    cairo.Region(cairo.RectangleInt(0, 0, *self.geometry))
+                )
+                self._input_full = True
             return
-        self.holding_body = getattr(self.check_hovered_object(x, y), "_body", None)
-        if self.holding_body:
-            self.canvas.set_cursor_from_name("grabbing")
-            frame_clock = self.window.get_frame_clock()
-            frame_clock.begin_updating()
 
-    def _on_mouse_release(self, gesture, data, x, y):
-        if self.holding_body != None:
-            self.sim_lock.acquire()
-            distance = (
-                clamp(
-                    self.mouse_position[0] / SIMULATION_SCALE
-                    - self.holding_body.position[0],
-                    1000,
-                ),
-                clamp(
-                    self.mouse_position[1] / SIMULATION_SCALE
-                    - self.holding_body.position[1],
-                    1000,
-                ),
+        state = self.simulation.state
+        if (
+            not self._input_full
+            and state.objects is self._input_objects
+            and (
+                not state.objects
+                or np.abs(state.positions - self._input_positions).max()
+                <= INPUT_REGION_TOLERANCE
             )
+        ):
+            return
 
-            self.holding_body.apply_impulse_at_world_point(
-                (distance[0] * (1 / 0.3) * 4, distance[1] * (1 / 0.3) * 4),
-                self.holding_body.position,
+        boxes = state.pickup_boxes(INPUT_REGION_TOLERANCE)
+        x0 = np.clip(np.floor(boxes[:, 0]), 0, self.geometry.width).astype(int)
+        y0 = np.clip(np.floor(boxes[:, 1]), 0, self.geometry.height).astype(int)
+        x1 = np.clip(np.ceil(boxes[:, 2]), 0, self.geometry.width).astype(int)
+        y1 = np.clip(np.ceil(boxes[:, 3]), 0, self.geometry.height).astype(int)
+        surface.set_input_region(
+            cairo.Region(
+                [
+                    cairo.RectangleInt(x, y, width, height)
+                    for x, y, width, height in zip(
+                        x0.tolist(),
+                        y0.tolist(),
+                        (x1 - x0).tolist(),
+                        (y1 - y0).tolist(),
+                    )
+                    if width > 0 and height > 0
+                ]
             )
-            self.sim_lock.release()
-            self.holding_body = None
+        )
+        self._input_full = False
+        self._input_objects = state.objects
+        # The state's arrays can be shared memory that the worker writes again.
+        self._input_positions = state.positions.copy()
+
+    def set_cursor(self, name: str):
+        """Change the cursor, only talking to GTK if it is actually different."""
+        if name == self._cursor:
+            return
+        self._cursor = name
+        self.canvas.set_cursor_from_name(name)
+
+    def check_hovered_object(self, x, y) -> PhysicsObject | None:
+        if self._holding is not None:
+            self.set_cursor("grabbing")
+            return None
+        obj = self.simulation.state.object_at(x, y)
+        if obj:
+            self.set_cursor("grab")
+        else:
+            self.set_cursor("default")
+        return obj
+
+    def _on_mouse_click(self, gesture, data, x, y):
+        if self.recorder is not None:
+            self.recorder.event("click", x, y)
+        if self._holding is not None:
+            return
+        obj = self.check_hovered_object(x, y)
+        if obj:
+            self.simulation.send(MoveMouse(x, y))
+            self.simulation.send(Grab(obj))
+            self._holding = obj
+            self.set_cursor("grabbing")
+            self._update_input_region()
+            self.wake()
+
+    def _on_mouse_release(self, gesture, data, x, y):
+        if self.recorder is not None:
+            self.recorder.event("release", x, y)
+        if self._holding is not None:
+            self.simulation.send(MoveMouse(x, y))
+            self.simulation.send(Release())
+            self._holding = None
+            self._update_input_region()
             self.check_hovered_object(x, y)
 
     def _on_mouse_move(self, motion, x, y):
-        SMALLER_BOUND = 5
-        if x < SMALLER_BOUND + self.left_offset:
-            x = SMALLER_BOUND + self.left_offset
-        if x > self.geometry.width - SMALLER_BOUND - self.right_offset:
-            x = self.geometry.width - SMALLER_BOUND - self.right_offset
-        if y < SMALLER_BOUND + self.bottom_offset:
-            y = SMALLER_BOUND + self.bottom_offset
-        if y > self.geometry.height - SMALLER_BOUND - self.top_offset:
-            y = self.geometry.height - SMALLER_BOUND - self.top_offset
-        self.mouse_position = (x, y)
+        if self.recorder is not None:
+            self.recorder.event("move", x, y)
+        # Motion events can arrive many times per frame, so only remember the
+        # latest position and deal with it once per frame.
+        if self._pending_motion is None and self._pace is not Pace.FULL:
+            self.window.get_frame_clock().request_phase(
+                Gdk.FrameClockPhase.AFTER_PAINT
+            )
+        self._pending_motion = (x, y)
+
+    def _process_motion(self):
+        if self._pending_motion is None:
+            return
+        start = time.perf_counter()
+        x, y = self._pending_motion
+        self._pending_motion = None
+        # The mouse position only matters while something is dragged, don't fill
+        # the queue of a sleeping simulation with it.
+        if self._holding is not None:
+            self.simulation.send(MoveMouse(x, y))
         self.check_hovered_object(x, y)
+        if self.stats is not None:
+            self.stats.record("motion", time.perf_counter() - start)
 
     def _on_scroll(self, event, x, y):
-        if self.holding_body:
-            self.sim_lock.acquire()
-            self.holding_body.angular_velocity += y
-            self.physics_space.reindex_shapes_for_body(self.holding_body)
-            self.sim_lock.release()
+        if self.recorder is not None:
+            self.recorder.event("scroll", x, y)
+        if self._holding is not None:
+            self.simulation.send(Spin(y))
+
+    def wake(self):
+        """Start ticking every frame until the simulation slows down or sleeps."""
+        self._set_pace(Pace.FULL)
 
-    def _on_after_paint(self, _):
-        STEP = 1 / (self.target_framerate or 60)
+    def _set_pace(self, pace: Pace):
+        if pace is self._pace:
+            return
 
-        frame_clock = self.window.get_frame_clock()
+        if self._pace is Pace.FULL:
+            self.window.get_frame_clock().end_updating()
+        elif self._pace is Pace.THROTTLED:
+            GLib.source_remove(self._throttle_source)
+            self._throttle_source = None
+        else:
+            self._last_frame_time = None
+
+        if pace is Pace.FULL:
+            self.window.get_frame_clock().begin_updating()
+        elif pace is Pace.THROTTLED:
+            self._throttle_source = GLib.timeout_add(
+                1000 // THROTTLED_FRAMERATE, self._on_throttled_tick
+            )
+        else:
+            # Nothing is left that would wake us up again, until pointer input.
+            self._accumulator = 0.0
+            # Everything settled, which is what the next start should see.
+            self.save_snapshot()
+
+        self._pace = pace
+
+    def _update_pace(self):
+        state = self.simulation.state
+        # Commands sent or objects loaded while the last step was running wake the
+        # simulation up once the next step gets to them.
+        if state.sim_sleep and not self.simulation.has_pending:
+            self._set_pace(Pace.IDLE)
+            return
+        if self.pacing == "fixed" or self._holding is not None or state.sim_sleep:
+            self._set_pace(Pace.FULL)
+            return
+
+        speed, angular_speed = state.fastest_motion()
+        if speed < RESIDUAL_SPEED and angular_speed < RESIDUAL_ANGULAR_SPEED:
+            self._set_pace(Pace.THROTTLED)
+        else:
+            self._set_pace(Pace.FULL)
+
+    def _on_after_paint(self, frame_clock: Gdk.FrameClock):
+        self.wakeups.record()
+        self._process_motion()
+        if self._pace is Pace.FULL:
+            # The frame clock reports time in microseconds.
+            self._tick(frame_clock.get_frame_time() / 1_000_000)
+
+    def _on_throttled_tick(self):
+        self.wakeups.record()
+        self._tick(GLib.get_monotonic_time() / 1_000_000)
+        return GLib.SOURCE_CONTINUE
+
+    def _tick(self, frame_time: float):
+        step = self.step
+
+        if self._last_frame_time is None:
+            elapsed = step
+        else:
+            elapsed = frame_time - self._last_frame_time
+        self._last_frame_time = frame_time
 
-        self.update(STEP)
+        # Don't try to catch up on more than a few frames after a stall, otherwise
+        # every frame gets slower than the last one. Time past that is dropped.
+        self._accumulator = min(self._accumulator + elapsed, step * MAX_STEPS_PER_FRAME)
+
+        # The last frame's physics is still running on the worker pool. The time
+        # stays in the accumulator and gets simulated next frame.
+        if self._step_future is not None:
+            return
+
+        steps = min(int(self._accumulator // step), MAX_STEPS_PER_FRAME)
+        self._accumulator -= steps * step
+
+        if self.recorder is not None:
+            self._record_frame(step, steps)
+
+        if self.executor is None:
+            self.update(step, steps)
+            self._finish_frame()
+            return
+
+        self._step_future = self.executor.submit(self.update, step, steps)
+        self._step_future.add_done_callback(
+            lambda _: GLib.idle_add(self._finish_frame)
+        )
+
+    def _finish_frame(self):
+        if self._step_future is not None:
+            future, self._step_future = self._step_future, None
+            # Raise any errors from the physics thread here.
+            future.result()
+
+        if self.on_frame is not None:
+            self.on_frame(self)
 
         # If the window is sleeping we don't need to update the sim or visuals.
         # GTK will send another update tick once we intereact with an object which
         # will cause the sim to update.
-        if not self.sim_sleep:
-            time.sleep(STEP)
-            # Schedule a new frame now that this one is over.
-            frame_clock.begin_updating()
-
-    def limit_velocity(self, body, gravity, damping, dt):
-        max_velocity = 500
-        max_angular_velocity = 15
-        pymunk.Body.update_velocity(body, gravity, damping, dt)
-
-        # No matter what apply friction
-        body.velocity *= 0.99
-        body.angular_velocity *= 0.99
-
-        if self.holding_body == body:
-            body.velocity *= 0.3
-
-        if body.velocity.length > max_velocity:
-            body.velocity *= 0.9
-        if body.velocity.length > max_velocity * 1.5:
-            body.velocity = body.velocity * 0.5
-
-        if body is not self.holding_body:
-            if abs(body.angular_velocity) > max_angular_velocity:
-                body.angular_velocity = body.angular_velocity * 0.8
-
-        if body is self.holding_body:
-            if abs(body.angular_velocity) >= 50:
-                body.angular_velocity = math.copysign(30, body.angular_velocity)
-
-        # Finally, velocity close to 0 should be set to 0
-        if body.velocity.length < 0.25:
-            body.velocity = (0, 0)
-        if abs(body.angular_velocity) < 0.001:
-            body.angular_velocity = 0
-
-    def update(self, step: float):
-        if not self.is_initialized:
-            return
+        self._update_pace()
+        self._update_input_region()
 
-        if self.holding_body is not None:
-            self.sim_sleep = False
-            distance = (
-                self.mouse_position[0] / SIMULATION_SCALE
-                - self.holding_body.position[0],
-                self.mouse_position[1] / SIMULATION_SCALE
-                - self.holding_body.position[1],
-            )
-
-            x = distance[0] * (1 / 0.3) * 2
-            y = distance[1] * (1 / 0.3) * 2
+        if time.monotonic() - self._saved_time > CHECKPOINT_SECONDS:
+            self.save_snapshot()
 
-            self.sim_lock.acquire()
-            self.holding_body.apply_impulse_at_world_point(
-                (x, y),
-                self.holding_body.position,
-            )
-            self.sim_lock.release()
+        if self.stats is None:
+            if self._prepare_frame():
+                self.canvas.queue_draw()
+            return GLib.SOURCE_REMOVE
 
-        if not self.sim_sleep:
-            self.sim_frame += 1
-            self.sim_lock.acquire()
-            self.physics_space.step(step)
+        start = time.perf_counter()
+        changed = self._prepare_frame()
+        self._prepare_time += time.perf_counter() - start
+        if changed:
             self.canvas.queue_draw()
-
-            if self.sim_frame > 200:
-                self.sim_sleep = True
-            for object in self.physics_objects:
-                if (
-                    object._body.velocity.length != 0
-                    or object._body.angular_velocity != 0
-                ):
-                    self.sim_sleep = False
-            self.sim_lock.release()
+        state = self.simulation.state
+        gauges = {}
+        if self.governor is not None:
+            gauges["iterations"] = self.governor.iterations
+            gauges["substeps"] = self.governor.substeps
+        self.stats.end_frame(
+            sleeping=state.sim_sleep,
+            awake_bodies=state.awake_count(),
+            damage=round(self.layout.damage.damage, 4),
+            pace=self._pace.name.lower(),
+            wakeups_per_second=self.wakeups.per_second(),
+            **gauges,
+        )
+        return GLib.SOURCE_REMOVE
+
+    def _record_frame(self, step: float, steps: int):
+        assert self.recorder
+        if not self.recorder.started:
+            # Start once everything is loaded, so the recorded scene is complete.
+            if self.simulation.loading:
+                return
+            self.recorder.start(self.simulation)
+        substeps = 1 if self.governor is None else self.governor.substeps
+        self.recorder.frame(step, steps, substeps, self.simulation.iterations)
+
+    def update(self, step: float, steps: int = 1):
+        # The worker's state ring only has room for this many steps per frame.
+        assert steps <= MAX_STEPS_PER_FRAME
+        # Every step of a frame runs with the same settings, the ones
+        # `_record_frame` wrote down. The governor only changes them for the next
+        # frame.
+        substeps = 1 if self.governor is None else self.governor.substeps
+        step_time = 0.0
+        for _ in range(steps):
+            self.simulation.step(step, substeps)
+            step_time += self.simulation.last_step_time
+            if self.stats is not None:
+                self.stats.record("step", self.simulation.last_step_time)
+
+        if self.governor is not None and steps and not self.simulation.sim_sleep:
+            self.governor.update(
+                step_time / steps,
+                step * PHYSICS_SHARE,
+                self.governor.wanted_substeps(self.simulation.state, step),
+            )
+            self.simulation.iterations = self.governor.iterations
 
     def setup_window(self):
         LayerShell.init_for_window(self.window)
@@ -365,44 +607,79 @@ class PhysicsSpace:
         self.window.present()
 
         self.window.get_frame_clock().connect("after_paint", self._on_after_paint)
+        self.wake()
 
     def setup_drawing_area(self):
         self.canvas.draw_func = self._draw
 
     def setup_physics_space(self):
-        self.physics_space.gravity = self.gravity
-
-        for shape in self.physics_objects:
-            self.physics_space.add(shape._body)
-            self.physics_space.add(shape._physics_shape)
-
-            shape._body.position = pymunk.Vec2d(
-                random.randrange(0, self.geometry.width / SIMULATION_SCALE),
-                random.randrange(0, self.geometry.height / SIMULATION_SCALE),
-            )
-            shape._body.angle = random.random() * math.pi * 2
-            shape._body.velocity_func = self.limit_velocity
-            self.physics_space.reindex_shapes_for_body(shape._body)
-
-        add_box(
-            self.physics_space,
-            self.wall_elasticity,
-            self.wall_friction,
-            (self.left_offset / SIMULATION_SCALE, self.top_offset / SIMULATION_SCALE),
-            (
-                (self.geometry.width - self.right_offset) / SIMULATION_SCALE,
-                (self.geometry.height - self.bottom_offset)  / SIMULATION_SCALE,
-            ),
+        if self.snapshot_path is not None:
+            self.simulation.restore = snapshot.load(self.snapshot_path, *self.geometry)
+        self.simulation.setup()
+        # The first checkpoint is due `CHECKPOINT_SECONDS` from now, not on the
+        # first frame.
+        self._saved_time = time.monotonic()
+        self._wake_when_loaded(self.simulation.loading)
+        self._wake_when_loaded(self.simulation.particles)
+
+    def _wake_when_loaded(self, objects: typing.Iterable[PhysicsObject | Particles]):
+        for obj in objects:
+            if obj._loading is not None:
+                # The next step adds the object, make sure there is one.
+                obj._loading.add_done_callback(lambda _: GLib.idle_add(self.wake))
+
+
+def open_edges(geometry: Gdk.Rectangle, others: list[Gdk.Rectangle]) -> set[str]:
+    """Find the edges of a monitor that touch another monitor in the layout."""
+    edges = set()
+    for other in others:
+        overlaps_vertically = (
+            other.y < geometry.y + geometry.height
+            and geometry.y < other.y + other.height
         )
-
-        self.is_initialized = True
+        overlaps_horizontally = (
+            other.x < geometry.x + geometry.width
+            and geometry.x < other.x + other.width
+        )
+        if overlaps_vertically and other.x + other.width == geometry.x:
+            edges.add("left")
+        if overlaps_vertically and other.x == geometry.x + geometry.width:
+            edges.add("right")
+        if overlaps_horizontally and other.y + other.height == geometry.y:
+            edges.add("top")
+        if overlaps_horizontally and other.y == geometry.y + geometry.height:
+            edges.add("bottom")
+    return edges
+
+
+def split_particles(
+    objects: list[PhysicsObject | Particles],
+) -> tuple[list[PhysicsObject], list[Particles]]:
+    """Separate the particles from the objects, they are simulated apart."""
+    physics_objects = []
+    particles = []
+    for obj in objects:
+        if isinstance(obj, Particles):
+            particles.append(obj)
+        else:
+            physics_objects.append(obj)
+    return physics_objects, particles
 
 
 @dataclasses.dataclass(kw_only=True)
 class Client:
-    objects: list[PhysicsObject]
+    objects: (
+        list[PhysicsObject | Particles] | dict[str, list[PhysicsObject | Particles]]
+    )
+    """The objects and particles to show. A list is copied onto every monitor, a
+    dict maps a monitor connector to the objects for that monitor."""
     monitor: str | None = None
+    monitors: list[str] | None = None
+    """The connectors of the monitors to use. Every monitor is used by default."""
+    handoff: bool = False
+    """Let objects move between monitors that are next to each other."""
     target_framerate: int | None = None
+    pacing: typing.Literal["fixed", "adaptive"] = "adaptive"
     gravity: tuple[float, float] = (0, 0)
     wall_friction: float = 0.5
     wall_elasticity: float = 0.5
@@ -410,10 +687,240 @@ class Client:
     bottom_offset: int = 0
     left_offset: int = 0
     right_offset: int = 0
+    threads: int = 1
+    spatial_hash: bool | tuple[float, int] = False
+    iterations: int = 10
+    """The most solver iterations to run per step."""
+    min_iterations: int = 4
+    """Solver iterations are lowered down to this when steps take too long."""
+    max_substeps: int = 4
+    """The most substeps a step is split into while objects move fast."""
+    resume: bool = True
+    """Put objects back where they were when the program last ran."""
+    worker: bool = False
+    """Run the physics of every monitor in its own process. Objects can't move
+    between processes, so this is ignored with `handoff`."""
+
+    stats: bool = False
+    """Collect frame timings and show them over the objects."""
+    stats_output: str | None = None
+    """Where to write stats as JSON lines, a file path or `unix:` and a socket path."""
+    startup: StartupProfile | None = None
+    """Time the rest of starting up and print a report once everything is shown."""
+    config_path: Path | None = None
+    """Watch this config file and apply changes to it while running."""
+    record: Path | None = None
+    """Record the objects and pointer input of the first window to this file."""
 
     _spaces: list[PhysicsSpace] = dataclasses.field(default_factory=list)
+    _config_monitor: Gio.FileMonitor | None = None
+    _reload_source: int | None = None
+    _executor: concurrent.futures.Executor | None = None
+    _stats_writer: StatsWriter | None = None
+
+    def _selected_monitors(self, display: Gdk.Display) -> list[Gdk.Monitor]:
+        connectors = self.monitors
+        if connectors is None and self.monitor:
+            connectors = [self.monitor]
+        if connectors is None and isinstance(self.objects, dict):
+            connectors = list(self.objects)
+
+        monitors = list(display.get_monitors())
+        if connectors is None:
+            return monitors
+
+        selected = []
+        for connector in connectors:
+            for monitor in monitors:
+                if monitor.get_connector() == connector:
+                    selected.append(monitor)
+                    break
+            else:
+                raise Exception(f"Monitor {connector} not found")
+        return selected
+
+    def _objects_for(
+        self, monitor: Gdk.Monitor, first: bool
+    ) -> list[PhysicsObject | Particles]:
+        if isinstance(self.objects, dict):
+            return self.objects.get(monitor.get_connector(), [])
+        # Every monitor needs its own bodies, pymunk bodies can only be in one space.
+        if first:
+            return self.objects
+        return [obj.copy() for obj in self.objects]
+
+    def _handoff(self, space: PhysicsSpace):
+        """Move objects that left `space` through an open edge to the monitor
+        they are now on."""
+        departures = space.simulation.departures
+        origin = space.monitor.get_geometry()
+        while departures:
+            departure = departures.popleft()
+            x = departure.position[0] + origin.x
+            y = departure.position[1] + origin.y
+
+            for target in self._spaces:
+                geometry = target.monitor.get_geometry()
+                if target is not space and (
+                    geometry.x <= x < geometry.x + geometry.width
+                    and geometry.y <= y < geometry.y + geometry.height
+                ):
+                    target.simulation.send(
+                        AddObject(
+                            departure.obj,
+                            (x - geometry.x, y - geometry.y),
+                            departure.angle,
+                        )
+                    )
+                    target.wake()
+                    break
+            else:
+                # It went through a part of the edge no other monitor is next to.
+                space.simulation.send(
+                    AddObject(
+                        departure.obj, departure.position, departure.angle, bounce=True
+                    )
+                )
+                space.wake()
+
+    def _watch_config(self):
+        assert self.config_path
+        config_file = Gio.File.new_for_path(str(self.config_path))
+        self._config_monitor = config_file.monitor_file(
+            Gio.FileMonitorFlags.WATCH_MOVES, None
+        )
+        self._config_monitor.connect("changed", self._on_config_changed)
+
+    def _on_config_changed(
+        self, monitor, file, other_file, event: Gio.FileMonitorEvent
+    ):
+        # Saving in place ends with CHANGES_DONE_HINT, saving to a temporary file
+        # and renaming it over the config shows up as a rename or creation.
+        if event not in (
+            Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+            Gio.FileMonitorEvent.CREATED,
+            Gio.FileMonitorEvent.RENAMED,
+            Gio.FileMonitorEvent.MOVED_IN,
+        ):
+            return
+        if self._reload_source is not None:
+            GLib.source_remove(self._reload_source)
+        self._reload_source = GLib.timeout_add(RELOAD_DELAY_MS, self._reload_config)
+
+    def _reload_config(self):
+        self._reload_source = None
+        assert self.config_path
+        try:
+            options = config.client_options(config.load(self.config_path))
+        except Exception:
+            print("Could not reload the config:", file=sys.stderr)
+            traceback.print_exc()
+            return GLib.SOURCE_REMOVE
+
+        self.apply_options(options)
+        return GLib.SOURCE_REMOVE
+
+    def apply_options(self, options: dict[str, typing.Any]):
+        """Change the options of the running client.
+
+        Only objects that are not in the running spaces are added and only the ones
+        that are not in `options["objects"]` anymore are removed. Images that were
+        loaded before are not decoded again.
+        """
+        if restart := [
+            name
+            for name in config.RESTART_OPTIONS
+            if options[name] != getattr(self, name)
+        ]:
+            print(f"Restart to apply changes to {', '.join(restart)}.", file=sys.stderr)
+
+        world_fields = [field.name for field in dataclasses.fields(SetWorld)]
+        world_changed = any(
+            options[name] != getattr(self, name) for name in world_fields
+        )
+        for name, value in options.items():
+            if name not in config.RESTART_OPTIONS:
+                setattr(self, name, value)
+
+        for i, space in enumerate(self._spaces):
+            space.target_framerate = self.target_framerate
+            space.pacing = self.pacing
+            space.snapshot_path = (
+                snapshot.path_for(space.monitor.get_connector())
+                if self.resume
+                else None
+            )
+            if space.governor is not None:
+                space.governor.set_bounds(
+                    min(self.min_iterations, self.iterations),
+                    self.iterations,
+                    self.max_substeps,
+                )
+
+            objects, particles = split_particles(
+                self._objects_for(space.monitor, first=i == 0)
+            )
+            space.simulation.send(SetObjects(objects))
+            space.simulation.send(SetParticles(particles))
+            space._wake_when_loaded(objects)
+            space._wake_when_loaded(particles)
+            if world_changed:
+                space.simulation.send(
+                    SetWorld(**{name: getattr(self, name) for name in world_fields})
+                )
+            space.wake()
+
+    def _on_stats_tick(self):
+        for space in self._spaces:
+            assert space.stats
+            if self._stats_writer is not None:
+                self._stats_writer.write(space.stats.summary())
+            # Keep the overlay up to date while nothing else is being drawn.
+            space.canvas.queue_draw()
+        return GLib.SOURCE_CONTINUE
+
+    def _mark_first_frame(self, space: PhysicsSpace):
+        assert self.startup
+        startup = self.startup
+
+        def on_after_paint(frame_clock: Gdk.FrameClock):
+            startup.mark(f"first frame {space.monitor.get_connector()}")
+            frame_clock.disconnect(handler)
+
+        handler = space.window.get_frame_clock().connect("after-paint", on_after_paint)
+
+    def _profile_startup(self):
+        """Report once every window drew a frame and every texture is decoded."""
+        startup = self.startup
+        assert startup
+
+        startup.wait_for(
+            "textures decoded",
+            *(f"first frame {space.monitor.get_connector()}" for space in self._spaces),
+        )
+
+        for space in self._spaces:
+            self._mark_first_frame(space)
+
+        loading = [
+            obj._loading
+            for space in self._spaces
+            for obj in space.simulation.loading
+            if obj._loading is not None
+        ]
+
+        def check_loaded():
+            if all(future.done() for future in loading):
+                startup.mark("textures decoded")
+
+        for future in loading:
+            future.add_done_callback(lambda _: GLib.idle_add(check_loaded))
+        check_loaded()
 
     def on_activate(self, app):
+        if self.startup is not None:
+            self.startup.mark("activate")
+
         provider = Gtk.CssProvider()
         provider.load_from_data(THEME, len(THEME))
 
@@ -422,44 +929,115 @@ class Client:
             display, provider, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION
         )
 
-        for monitor in display.get_monitors():
-            if self.monitor and monitor.get_connector() != self.monitor:
-                continue
-
-            # These are the objects that will be intereacted with by the engines
-            physics_space = pymunk.Space(threaded=False)
-
-            canvas = Canvas()
-            window = Gtk.ApplicationWindow()
-
-            space = PhysicsSpace(
-                monitor=monitor,
-                window=window,
-                canvas=canvas,
-                target_framerate=self.target_framerate,
-                physics_space=physics_space,
-                physics_objects=self.objects,
-                gravity=self.gravity,
-                wall_friction=self.wall_friction,
-                wall_elasticity=self.wall_elasticity,
-                top_offset=self.top_offset,
-                bottom_offset=self.bottom_offset,
-                left_offset=self.left_offset,
-                right_offset=self.right_offset,
+        monitors = self._selected_monitors(display)
+        geometries = [monitor.get_geometry() for monitor in monitors]
+
+        worker = self.worker and not self.handoff
+        if self.worker and self.handoff:
+            print("The physics can't run in a worker with handoff.", file=sys.stderr)
+
+        # Each monitor has its own independent space, so they can be stepped at
+        # the same time. Pymunk releases the GIL while it steps, and a worker
+        # process is waited for on a thread so painting goes on meanwhile.
+        if len(monitors) > 1 or worker:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(monitors), thread_name_prefix="physics"
             )
-            self._spaces += [space]
 
-            space.setup_drawing_area()
-            space.setup_window()
-            space.setup_physics_space()
+        for i, monitor in enumerate(monitors):
+            geometry = geometries[i]
+            phase = (
+                self.startup.phase(f"window {monitor.get_connector()}")
+                if self.startup
+                else contextlib.nullcontext()
+            )
+            with phase:
+                objects, particles = split_particles(
+                    self._objects_for(monitor, first=i == 0)
+                )
+                simulation = Simulation(
+                    width=geometry.width,
+                    height=geometry.height,
+                    physics_objects=objects,
+                    particles=particles,
+                    gravity=self.gravity,
+                    wall_friction=self.wall_friction,
+                    wall_elasticity=self.wall_elasticity,
+                    top_offset=self.top_offset,
+                    bottom_offset=self.bottom_offset,
+                    left_offset=self.left_offset,
+                    right_offset=self.right_offset,
+                    threads=self.threads,
+                    spatial_hash=self.spatial_hash,
+                    iterations=self.iterations,
+                )
+                if self.handoff:
+                    simulation.open_edges = open_edges(
+                        geometry, geometries[:i] + geometries[i + 1 :]
+                    )
+                if worker:
+                    simulation = RemoteSimulation(simulation)
+
+                canvas = Canvas()
+                window = Gtk.ApplicationWindow()
+
+                space = PhysicsSpace(
+                    monitor=monitor,
+                    window=window,
+                    canvas=canvas,
+                    target_framerate=self.target_framerate,
+                    pacing=self.pacing,
+                    simulation=simulation,
+                    executor=self._executor,
+                    on_frame=self._handoff if self.handoff else None,
+                    snapshot_path=(
+                        snapshot.path_for(monitor.get_connector())
+                        if self.resume
+                        else None
+                    ),
+                    governor=Governor(
+                        min_iterations=min(self.min_iterations, self.iterations),
+                        max_iterations=self.iterations,
+                        max_substeps=self.max_substeps,
+                    ),
+                    stats=(
+                        FrameStats(name=monitor.get_connector()) if self.stats else None
+                    ),
+                )
+                if self.record is not None and i == 0:
+                    seed = random.randrange(2**32)
+                    random.seed(seed)
+                    space.recorder = Recorder(self.record, seed)
+                self._spaces += [space]
 
-            app.add_window(window)
-            # We only run one window to prevent bugs (i am lazy af)
-            break
-        else:
-            raise Exception(f"Monitor {self.monitor} not found")
+                space.setup_drawing_area()
+                space.setup_window()
+                space.setup_physics_space()
+
+                app.add_window(window)
+
+        if self.startup is not None:
+            self._profile_startup()
+
+        if self.config_path is not None:
+            self._watch_config()
+
+        if self.stats:
+            if self.stats_output:
+                self._stats_writer = StatsWriter(self.stats_output)
+            GLib.timeout_add_seconds(1, self._on_stats_tick)
 
     def start(self):
         app = Gtk.Application()
         app.connect("activate", self.on_activate)
         app.run()
+        for space in self._spaces:
+            space.save_snapshot()
+            if space.recorder is not None:
+                space.recorder.close()
+            if isinstance(space.simulation, RemoteSimulation):
+                space.simulation.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._stats_writer is not None:
+            self._stats_writer.close()
@@ -0,0 +1,160 @@
+import concurrent.futures
+import json
+import os
+
+import numpy as np
+import pymunk
+from pymunk import autogeometry
+
+from desktop_thingies import textures
+from desktop_thingies.textures import TextureImage
+
+# Collision outlines traced from the alpha channel of textures. Tracing is slow, so
+# outlines are kept in memory and on disk like decoded images are.
+
+Polygon = list[tuple[float, float]]
+
+# Pixels with at least this much alpha are solid.
+ALPHA_THRESHOLD = 0.5
+# Images are sampled at most this many times along each axis while tracing.
+MAX_SAMPLES = 256
+# Islands smaller than this many square pixels are ignored.
+MIN_AREA = 16
+# How many times the tolerance is doubled trying to fit the vertex budget before
+# giving up and using the convex hull.
+MAX_SIMPLIFY = 6
+
+_outlines: dict[tuple[tuple[str, float], float, int], list[Polygon]] = {}
+
+
+def _outlines_of(image: TextureImage) -> list[Polygon]:
+    """Trace the solid parts of an image, leaving out holes and specks."""
+    alpha = np.frombuffer(image.data, dtype=np.uint8).reshape(
+        image.height, image.width, 4
+    )[:, :, 3]
+
+    def sample(point: tuple[float, float]) -> float:
+        x = round(point[0])
+        y = round(point[1])
+        if 0 <= x < image.width and 0 <= y < image.height:
+            return alpha[y, x] / 255
+        return 0.0
+
+    # Sample one pixel past every edge so shapes touching the edge are closed.
+    lines = autogeometry.march_soft(
+        pymunk.BB(-1, -1, image.width, image.height),
+        min(image.width + 2, MAX_SAMPLES),
+        min(image.height + 2, MAX_SAMPLES),
+        ALPHA_THRESHOLD,
+        sample,
+    )
+    # Holes wind the other way and have a negative area.
+    return [
+        list(line)
+        for line in lines
+        if autogeometry.is_closed(line) and pymunk.area_for_poly(line) >= MIN_AREA
+    ]
+
+
+def _decompose(outlines: list[Polygon], tolerance: float) -> list[Polygon]:
+    polygons = []
+    for outline in outlines:
+        simplified = autogeometry.simplify_curves(outline, tolerance)
+        if len(simplified) < 4:
+            continue
+        for part in autogeometry.convex_decomposition(simplified, tolerance):
+            # The parts are closed polylines that repeat their first vertex.
+            polygons.append([(p.x, p.y) for p in part[:-1]])
+    return polygons
+
+
+def trace(image: TextureImage, tolerance: float, max_vertices: int) -> list[Polygon]:
+    """Trace the alpha channel of an image into convex polygons.
+
+    `tolerance` is how far in pixels the outline may stray from the image. It is
+    raised until the polygons have at most `max_vertices` vertices in total. The
+    polygons are in pixels relative to the center of the image.
+    """
+    outlines = _outlines_of(image)
+    if not outlines:
+        return []
+
+    for _ in range(MAX_SIMPLIFY):
+        polygons = _decompose(outlines, tolerance)
+        if sum(len(polygon) for polygon in polygons) <= max_vertices:
+            break
+        tolerance *= 2
+    else:
+        points = [point for outline in outlines for point in outline]
+        hull = autogeometry.to_convex_hull(points, tolerance)
+        polygons = [[(p.x, p.y) for p in hull[:-1]]]
+
+    half_width = image.width / 2
+    half_height = image.height / 2
+    return [
+        [(x - half_width, y - half_height) for x, y in polygon] for polygon in polygons
+    ]
+
+
+def load(
+    image: TextureImage, tolerance: float, max_vertices: int, disk_cache: bool = True
+) -> list[Polygon]:
+    """Like `trace`, but remember the result in memory and, with `disk_cache`, in
+    `$XDG_CACHE_HOME`."""
+    key = (image.key, float(tolerance), max_vertices)
+    if (polygons := _outlines.get(key)) is not None:
+        return polygons
+
+    path = textures.cache_dir("collision") / (
+        f"{image.key[0]}-{image.key[1]!r}-{float(tolerance)!r}-{max_vertices}.json"
+    )
+    polygons = None
+    if disk_cache:
+        try:
+            polygons = [
+                [(x, y) for x, y in polygon]
+                for polygon in json.loads(path.read_text())
+            ]
+        except (OSError, ValueError, TypeError):
+            polygons = None
+
+    if polygons is None:
+        polygons = trace(image, tolerance, max_vertices)
+        if disk_cache:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(f".{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(polygons))
+                os.replace(tmp, path)
+            except OSError:
+                pass
+
+    _outlines[key] = polygons
+    return polygons
+
+
+def load_async(
+    image: concurrent.futures.Future[TextureImage],
+    tolerance: float,
+    max_vertices: int,
+    disk_cache: bool = True,
+) -> concurrent.futures.Future[list[Polygon]]:
+    """Like `load`, run on the texture thread pool once `image` is decoded."""
+    future: concurrent.futures.Future[list[Polygon]] = concurrent.futures.Future()
+
+    def copy_result(done: concurrent.futures.Future):
+        if (error := done.exception()) is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(done.result())
+
+    def start(image: concurrent.futures.Future[TextureImage]):
+        if (error := image.exception()) is not None:
+            future.set_exception(error)
+            return
+        textures.executor().submit(
+            load, image.result(), tolerance, max_vertices, disk_cache
+        ).add_done_callback(copy_result)
+
+    image.add_done_callback(start)
+    return future
@@ -0,0 +1,58 @@
+import os
+import runpy
+import sys
+import types
+import typing
+from pathlib import Path
+
+RESTART_OPTIONS = (
+    "monitor",
+    "monitors",
+    "handoff",
+    "threads",
+    "spatial_hash",
+    "worker",
+)
+"""Options that only take effect after a restart, everything else is applied when
+the config is reloaded."""
+
+
+def default_path() -> Path:
+    if config_home := os.environ.get("XDG_CONFIG_HOME"):
+        return Path(config_home) / "desktop-thingies" / "config.py"
+    return Path(os.environ["HOME"]) / ".config" / "desktop-thingies" / "config.py"
+
+
+def load(path: Path) -> types.SimpleNamespace:
+    """Run the config file. Every call runs it again from the source, so this is
+    also how the config is reloaded."""
+    # Let the config import modules next to it.
+    if str(path.parent) not in sys.path:
+        sys.path.append(str(path.parent))
+    return types.SimpleNamespace(**runpy.run_path(str(path)))
+
+
+def client_options(config: types.SimpleNamespace) -> dict[str, typing.Any]:
+    """The `Client` arguments set by a config."""
+    return dict(
+        objects=config.objects,
+        monitor=getattr(config, "monitor", None),
+        monitors=getattr(config, "monitors", None),
+        handoff=getattr(config, "handoff", False),
+        target_framerate=getattr(config, "framerate", None),
+        pacing=getattr(config, "pacing", "adaptive"),
+        gravity=getattr(config, "gravity", (0,0)),
+        wall_elasticity=getattr(config, "wall_elasticity", 0.5),
+        wall_friction=getattr(config, "wall_friction", 0.5),
+        top_offset=getattr(config, "top_offset", 0),
+        bottom_offset=getattr(config, "bottom_offset", 0),
+        left_offset=getattr(config, "left_offset", 0),
+        right_offset=getattr(config, "right_offset", 0),
+        threads=getattr(config, "threads", 1),
+        spatial_hash=getattr(config, "spatial_hash", False),
+        iterations=getattr(config, "iterations", 10),
+        min_iterations=getattr(config, "min_iterations", 4),
+        max_substeps=getattr(config, "max_substeps", 4),
+        resume=getattr(config, "resume", True),
+        worker=getattr(config, "worker", False),
+    )
@@ -1 +1,4 @@
 SIMULATION_SCALE = 10
+
+# The most physics steps that will be run to catch up in a single frame.
+MAX_STEPS_PER_FRAME = 5
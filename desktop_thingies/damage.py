@@ -0,0 +1,89 @@
+import dataclasses
+import math
+
+import numpy as np
+
+# Damage is measured in tiles of this many pixels, like most compositors do.
+TILE_SIZE = 64
+# Objects that moved less than this many pixels (or degrees) are not redrawn.
+TOLERANCE = 0.01
+
+
+def bounding_boxes(
+    position: np.ndarray, stretch: np.ndarray, angle: np.ndarray, size: np.ndarray
+) -> np.ndarray:
+    """Get the screen space bounding box of every object.
+
+    Objects are drawn rotated by `angle` degrees, then scaled by `stretch` and
+    moved to `position`. `size` is the `(n, 2)` untransformed size of each object.
+    Returns a `(n, 4)` array of `x0, y0, x1, y1`, padded by a pixel for
+    antialiasing.
+    """
+    radians = np.radians(angle)
+    cos = np.abs(np.cos(radians))
+    sin = np.abs(np.sin(radians))
+    half_width = size[:, 0] / 2
+    half_height = size[:, 1] / 2
+    extent = np.stack(
+        (
+            (cos * half_width + sin * half_height) * stretch[:, 0],
+            (sin * half_width + cos * half_height) * stretch[:, 1],
+        ),
+        axis=1,
+    ) + 1
+    return np.concatenate((position - extent, position + extent), axis=1)
+
+
+@dataclasses.dataclass
+class DamageTracker:
+    """Work out which objects changed since the last frame and how much of the
+    surface has to be repainted because of it."""
+
+    width: int
+    height: int
+
+    transforms: np.ndarray = dataclasses.field(default_factory=lambda: np.zeros((0, 5)))
+    boxes: np.ndarray = dataclasses.field(default_factory=lambda: np.zeros((0, 4)))
+
+    damage: float = 0
+    """The fraction of the surface that was damaged by the last frame."""
+
+    def update(self, transforms: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+        """Compare a frame against the previous one.
+
+        `transforms` holds the `x, y, x_stretch, y_stretch, angle` of every object
+        and `boxes` their bounding boxes. Returns a mask of the objects that have
+        to be redrawn.
+        """
+        if transforms.shape != self.transforms.shape:
+            dirty = np.ones(len(transforms), dtype=bool)
+            old_boxes = self.boxes
+        else:
+            dirty = (np.abs(transforms - self.transforms) > TOLERANCE).any(axis=1)
+            old_boxes = self.boxes[dirty]
+
+        self.damage = self._damaged_fraction(np.concatenate((old_boxes, boxes[dirty])))
+        self.transforms = transforms
+        self.boxes = boxes
+        return dirty
+
+    def invalidate(self):
+        """Redraw every object in the next frame, e.g. because objects were added
+        or removed and rows no longer belong to the same objects."""
+        self.transforms = np.zeros((0, 5))
+
+    def _damaged_fraction(self, boxes: np.ndarray) -> float:
+        if not len(boxes):
+            return 0
+
+        columns = math.ceil(self.width / TILE_SIZE)
+        rows = math.ceil(self.height / TILE_SIZE)
+        tiles = np.zeros((rows, columns), dtype=bool)
+
+        tile_boxes = np.floor(boxes / TILE_SIZE).astype(int)
+        tile_boxes[:, (0, 2)] = np.clip(tile_boxes[:, (0, 2)], 0, columns - 1)
+        tile_boxes[:, (1, 3)] = np.clip(tile_boxes[:, (1, 3)], 0, rows - 1)
+        for x0, y0, x1, y1 in tile_boxes.tolist():
+            tiles[y0 : y1 + 1, x0 : x1 + 1] = True
+
+        return float(tiles.mean())
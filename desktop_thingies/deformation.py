@@ -0,0 +1,126 @@
+import dataclasses
+
+import numpy as np
+
+# How many frames an impact squash lasts for.
+STRECH_TIME = 4
+STRETCH_MIN = 0.9
+STRETCH_MAX = 1.5
+# How much a held object is scaled up.
+HOLDING_STRETCH = 1.05
+
+
+@dataclasses.dataclass
+class Deformation:
+    """The squash and stretch state of every object, stored as arrays.
+
+    Row `i` of every array belongs to the object at index `i` of the simulation's
+    object list. `update` computes the stretch for all objects at once so the
+    cost of a frame doesn't depend on running python code for every object.
+    """
+
+    last_velocity: np.ndarray = dataclasses.field(
+        default_factory=lambda: np.zeros((0, 2))
+    )
+    strech_scale: np.ndarray = dataclasses.field(
+        default_factory=lambda: np.zeros((0, 2))
+    )
+    strech_time: np.ndarray = dataclasses.field(
+        default_factory=lambda: np.zeros(0, dtype=np.int32)
+    )
+
+    def resize(self, count: int):
+        """Make room for `count` objects. New objects start out undeformed."""
+        old = len(self.strech_time)
+        if old == count:
+            return
+        if count < old:
+            self.last_velocity = self.last_velocity[:count]
+            self.strech_scale = self.strech_scale[:count]
+            self.strech_time = self.strech_time[:count]
+            return
+        self.last_velocity = np.concatenate(
+            (self.last_velocity, np.zeros((count - old, 2)))
+        )
+        self.strech_scale = np.concatenate(
+            (self.strech_scale, np.zeros((count - old, 2)))
+        )
+        self.strech_time = np.concatenate(
+            (self.strech_time, np.zeros(count - old, dtype=np.int32))
+        )
+
+    def reorder(self, rows: list[int | None]):
+        """Follow the objects when the object list changes.
+
+        `rows[i]` is the row the object now at index `i` had before, or `None` if
+        it is new. New objects start out undeformed.
+        """
+        old = np.array([-1 if row is None else row for row in rows], dtype=int)
+        new = old < 0
+        old[new] = 0
+
+        def take(array: np.ndarray) -> np.ndarray:
+            if not len(array):
+                return np.zeros((len(rows),) + array.shape[1:], dtype=array.dtype)
+            taken = array[old]
+            taken[new] = 0
+            return taken
+
+        self.last_velocity = take(self.last_velocity)
+        self.strech_scale = take(self.strech_scale)
+        self.strech_time = take(self.strech_time)
+
+    def update(
+        self,
+        velocity: np.ndarray,
+        angular_velocity: np.ndarray,
+        holding: int | None = None,
+    ) -> np.ndarray:
+        """Advance the deformation by one frame.
+
+        `velocity` is a `(n, 2)` array and `angular_velocity` a `(n,)` array.
+        `holding` is the index of the held object. Returns the `(n, 2)` x and y
+        scale each object should be drawn with.
+        """
+        self.resize(len(velocity))
+
+        speed = np.abs(velocity)
+        stretch = np.maximum(1, (speed - 70) / 1000 * .8 + 1)
+        stretch[:, 0] -= (stretch[:, 1] - 1) / 2
+        stretch[:, 1] -= (stretch[:, 0] - 1) / 2
+
+        diff = np.abs(velocity - self.last_velocity)
+
+        # The velocity changed direction or suddenly changed speed, this is an impact.
+        flipped = (np.abs(self.last_velocity) > 0.1) & (
+            np.signbit(velocity) != np.signbit(self.last_velocity)
+        )
+        impact = ((flipped | (diff > 10)).any(axis=1)) & ~(self.strech_time > 0)
+
+        squashing = self.strech_time > 0
+        progress = (self.strech_time[squashing] / STRECH_TIME)[:, None]
+        stretch[squashing] = 1 - (1 - self.strech_scale[squashing]) * progress
+
+        if impact.any():
+            squash = np.maximum(
+                STRETCH_MIN, 1 - (np.maximum(diff[impact] - 10, 1) / 800) ** 1.8
+            )
+            squash[:, 0] += 1 - squash[:, 1]
+            squash[:, 1] += 1 - squash[:, 0]
+
+            stretch[impact] = squash
+            self.strech_scale[impact] = squash
+            self.strech_time[impact] = STRECH_TIME + 1
+
+        np.minimum(stretch, STRETCH_MAX, out=stretch)
+
+        if holding is not None:
+            stretch[holding] = HOLDING_STRETCH
+
+        spinning = np.abs(angular_velocity) > 10
+        stretch[spinning, 1] += np.abs(angular_velocity[spinning]) / 500
+
+        self.last_velocity = velocity.copy()
+        self.strech_time[self.strech_time > 0] -= 1
+
+        return stretch
@@ -0,0 +1,91 @@
+import dataclasses
+import math
+
+from desktop_thingies.state import SimState
+
+# The share of a frame the physics may take, the rest is left for drawing.
+PHYSICS_SHARE = 0.5
+# How quickly the measured cost follows changes, between 0 and 1.
+SMOOTHING = 0.2
+# Quality is only raised again while the cost is below this share of the budget.
+HEADROOM = 0.6
+
+
+@dataclasses.dataclass
+class Governor:
+    """Pick solver iterations and substeps so a physics step fits its budget.
+
+    When a step takes too long, solver iterations are shed first, since that only
+    makes stacks softer, then substeps. Substeps are only added while objects move
+    fast enough to pass through each other in a single step.
+    """
+
+    min_iterations: int = 4
+    max_iterations: int = 10
+    max_substeps: int = 4
+
+    iterations: int = dataclasses.field(init=False)
+    substeps: int = 1
+    cost: float | None = None
+    """The smoothed time a step takes with the current settings, in seconds."""
+
+    def __post_init__(self):
+        self.iterations = self.max_iterations
+
+    def set_bounds(self, min_iterations: int, max_iterations: int, max_substeps: int):
+        self.min_iterations = min_iterations
+        self.max_iterations = max_iterations
+        self.max_substeps = max_substeps
+        self.iterations = min(max(self.iterations, min_iterations), max_iterations)
+        self.substeps = min(self.substeps, max_substeps)
+
+    def wanted_substeps(self, state: SimState, dt: float) -> int:
+        """How many substeps keep the fastest object from moving further than the
+        size of the smallest object in one substep."""
+        if not len(state.objects):
+            return 1
+        speed, _ = state.fastest_motion()
+        smallest = float(state.hit_radii.min())
+        if smallest <= 0:
+            return self.max_substeps
+        return min(max(math.ceil(speed * dt / smallest), 1), self.max_substeps)
+
+    def update(self, seconds: float, budget: float, wanted_substeps: int):
+        """Feed how long the last step took and pick the settings for the next one.
+
+        `budget` is how long a step may take in seconds.
+        """
+        if self.cost is None:
+            self.cost = seconds
+        else:
+            self.cost += (seconds - self.cost) * SMOOTHING
+
+        work = self._work()
+
+        if self.substeps > wanted_substeps:
+            self.substeps = wanted_substeps
+        elif self.cost > budget:
+            if self.iterations > self.min_iterations:
+                self.iterations = max(
+                    math.floor(self.iterations * budget / self.cost),
+                    self.min_iterations,
+                )
+            elif self.substeps > 1:
+                self.substeps -= 1
+        elif self.substeps < wanted_substeps and (
+            self.cost * wanted_substeps / self.substeps <= budget
+        ):
+            # A fling needs its substeps right away, not a few frames later.
+            self.substeps = wanted_substeps
+        elif self.cost < budget * HEADROOM:
+            if self.substeps < wanted_substeps:
+                self.substeps += 1
+            elif self.iterations < self.max_iterations:
+                self.iterations += 1
+
+        # Assume the cost follows the amount of solver work, so the next
+        # measurement isn't compared against what the old settings cost.
+        self.cost *= self._work() / work
+
+    def _work(self) -> int:
+        return self.substeps * self.iterations
@@ -0,0 +1,17 @@
+import ctypes
+import os
+from pathlib import Path
+
+import gi
+
+# Setup GTK stuff. This is quite annoying but it needs to happen before anything
+# from `gi.repository` is imported, so import this module first.
+binary_dir = str(Path(__file__).parent / "bin")
+os.environ["GI_TYPELIB_PATH"] = binary_dir
+ctypes.CDLL(binary_dir + "/libgtk4-layer-shell.so")
+gi.require_version("Gtk", "4.0")
+gi.require_version("Gdk", "4.0")
+gi.require_version("Gsk", "4.0")
+gi.require_version("Graphene", "1.0")
+gi.require_version("Pango", "1.0")
+gi.require_version("Gtk4LayerShell", "1.0")
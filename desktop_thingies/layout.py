@@ -0,0 +1,57 @@
+import dataclasses
+
+import numpy as np
+
+from desktop_thingies.damage import DamageTracker, bounding_boxes
+from desktop_thingies.deformation import Deformation
+from desktop_thingies.physics_object import PhysicsObject
+from desktop_thingies.state import SimState
+
+
+@dataclasses.dataclass
+class FrameLayout:
+    """Work out where every object is drawn and which ones changed since the last
+    frame.
+
+    This is the part of drawing a frame that doesn't need GTK, so windows, replays
+    and benchmarks all lay frames out the same way.
+    """
+
+    width: int
+    height: int
+    deformation: Deformation = dataclasses.field(default_factory=Deformation)
+    damage: DamageTracker = dataclasses.field(init=False)
+    objects: tuple[PhysicsObject, ...] = ()
+    """The objects of the state the deformation rows belong to."""
+
+    def __post_init__(self):
+        self.damage = DamageTracker(width=self.width, height=self.height)
+
+    def follow(self, objects: tuple[PhysicsObject, ...]) -> list[PhysicsObject]:
+        """Move the per object state along when objects were added or removed.
+
+        Returns the objects that are new.
+        """
+        rows = {id(obj): i for i, obj in enumerate(self.objects)}
+        self.deformation.reorder([rows.get(id(obj)) for obj in objects])
+        self.damage.invalidate()
+        self.objects = objects
+        return [obj for obj in objects if id(obj) not in rows]
+
+    def update(self, state: SimState, alpha: float) -> tuple[np.ndarray, np.ndarray]:
+        """Lay out the frame `alpha` of the way from the previous to the last step.
+
+        Returns the `x, y, x_stretch, y_stretch, angle` of every object, with the
+        angle in degrees, and a mask of the objects that have to be redrawn. Call
+        `follow` first if the objects changed.
+        """
+        position, angle = state.interpolate(alpha)
+        angle = np.degrees(angle)
+        stretch = self.deformation.update(
+            state.velocities, state.angular_velocities, state.holding
+        )
+
+        size = np.array([obj.render_size() for obj in state.objects], dtype=float)
+        transforms = np.column_stack((position, stretch, angle))
+        boxes = bounding_boxes(position, stretch, angle, size)
+        return transforms, self.damage.update(transforms, boxes)
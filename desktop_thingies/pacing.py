@@ -0,0 +1,43 @@
+import collections
+import enum
+import time
+
+
+class Pace(enum.Enum):
+    """How often a space wakes up to step the simulation."""
+
+    IDLE = enum.auto()
+    """Everything is asleep. Nothing runs until there is pointer input."""
+    THROTTLED = enum.auto()
+    """Only slow motion is left, tick on a timer at `THROTTLED_FRAMERATE`."""
+    FULL = enum.auto()
+    """Tick on every frame of the monitor."""
+
+
+# The rate used while only slow residual motion is left.
+THROTTLED_FRAMERATE = 20
+# Below this speed in pixels per second motion counts as residual.
+RESIDUAL_SPEED = 40
+# Below this speed in radians per second spinning counts as residual.
+RESIDUAL_ANGULAR_SPEED = 0.5
+
+
+class WakeupCounter:
+    """Count how many times per second the process woke up to do work."""
+
+    def __init__(self, window: float = 1.0) -> None:
+        self.window = window
+        self._wakeups: collections.deque[float] = collections.deque()
+
+    def record(self):
+        now = time.monotonic()
+        self._wakeups.append(now)
+        self._trim(now)
+
+    def per_second(self) -> float:
+        self._trim(time.monotonic())
+        return len(self._wakeups) / self.window
+
+    def _trim(self, now: float):
+        while self._wakeups and self._wakeups[0] < now - self.window:
+            self._wakeups.popleft()
@@ -0,0 +1,413 @@
+import dataclasses
+import math
+import random
+import typing
+
+import numpy as np
+import pymunk
+import pymunk.batch
+
+from desktop_thingies import textures
+from desktop_thingies.constants import SIMULATION_SCALE
+
+if typing.TYPE_CHECKING:
+    from gi.repository import Gdk, Gsk  # type: ignore
+
+# A `PhysicsObject` carries a lot per object: a dataclass, its own render node,
+# colour and deformation, and a Python call for every one of them every frame.
+# Particles are configured as a whole population instead. Their sizes and colours
+# are arrays, their bodies are read back from pymunk in one batched call, and they
+# are drawn as one node whose children are only rebuilt for particles that moved.
+
+# Particles closer than this many pixels and degrees to where they were last drawn
+# keep their node.
+MIN_MOVE = 0.25
+MIN_TURN = 0.5
+# Colour sprites are drawn at this multiple of the largest size, so they stay sharp
+# on scaled monitors.
+SPRITE_OVERSAMPLING = 2
+
+_BODY_FIELDS = (
+    pymunk.batch.BodyFields.BODY_ID
+    | pymunk.batch.BodyFields.POSITION
+    | pymunk.batch.BodyFields.ANGLE
+    | pymunk.batch.BodyFields.VELOCITY
+    | pymunk.batch.BodyFields.ANGULAR_VELOCITY
+)
+
+
+def read_bodies(
+    space: pymunk.Space, buffer: pymunk.batch.Buffer
+) -> tuple[np.ndarray, np.ndarray]:
+    """The id of every body in `space`, and its position, angle, velocity and
+    angular velocity as a row of 6 values, in one call.
+
+    `buffer` is reused between calls, pymunk never frees the memory of one. The
+    arrays are views of it and only valid until the next call.
+    """
+    buffer.clear()
+    pymunk.batch.get_space_bodies(space, _BODY_FIELDS, buffer)
+    ids = np.frombuffer(buffer.int_buf(), dtype=np.uintp)
+    values = np.frombuffer(buffer.float_buf(), dtype=np.float64).reshape(-1, 6)
+    return ids, values
+
+
+def index_bodies(bodies: typing.Sequence[pymunk.Body]) -> tuple[np.ndarray, np.ndarray]:
+    """The ids of `bodies` in order and the row each one belongs to, to find
+    them in what `read_bodies` returns."""
+    ids = np.array([body.id for body in bodies], dtype=np.uintp)
+    rows = np.argsort(ids)
+    return ids[rows], rows
+
+
+def gather_bodies(
+    index: tuple[np.ndarray, np.ndarray], ids: np.ndarray, values: np.ndarray
+) -> np.ndarray:
+    """The rows of `values` that belong to the bodies in `index`, in their order.
+    Bodies that weren't read are left at zero."""
+    sorted_ids, rows = index
+    gathered = np.zeros((len(sorted_ids), 6))
+    if len(sorted_ids):
+        spots = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        found = sorted_ids[spots] == ids
+        gathered[rows[spots[found]]] = values[found]
+    return gathered
+
+
+@dataclasses.dataclass(kw_only=True)
+class Particles:
+    """A population of small round bodies, like confetti, snow or marbles.
+
+    They collide with each other, the walls and objects, but can't be picked up,
+    and they start at random spots instead of where they were last time.
+    """
+
+    count: int
+    size: tuple[float, float] = (8, 16)
+    """The smallest and largest diameter in pixels. Every particle gets a random
+    size in between."""
+    colors: tuple[str, ...] = ("#000000",)
+    """Every particle gets one of these colours at random."""
+    texture: str | None = None
+    """Draw every particle with this PNG image instead of a colour, scaled to fit
+    its size."""
+    texture_scale: float = 1
+    """Amount to scale the image when it is loaded. Lower it for big images, they
+    are drawn a lot smaller anyway."""
+    mass: float = 0.1
+    """The mass of a particle of the largest size. Smaller ones are lighter."""
+    friction: float = 0.5
+    elasticity: float = 0.5
+    seed: int | None = None
+    """Pick sizes, colours and starting spots with this seed instead of randomly."""
+
+    # Built by `_create`, row `i` of every array belongs to particle `i`.
+    _bodies = ()
+    _shapes = ()
+    _sizes = np.empty(0)
+    _colors = np.empty(0, dtype=np.intp)
+    # The seed the sizes and colours were picked with.
+    _seed = None
+    # Body ids in order and the particle each one belongs to, to find the rows of
+    # bodies read back from the space.
+    _index = (np.empty(0, dtype=np.uintp), np.empty(0, dtype=np.intp))
+
+    # Set while the texture is decoded in the background.
+    _loading = None
+
+    # What was drawn last: one node per particle, where they were, and the node
+    # with all of them.
+    _sprites = None
+    _texture_nodes = None
+    _nodes = None
+    _drawn_positions = np.empty((0, 2))
+    _drawn_angles = np.empty(0)
+    _node = None
+
+    def __post_init__(self):
+        self.colors = tuple(self.colors)
+        self.size = tuple(self.size)  # type: ignore
+        if self.texture is not None:
+            self._loading = textures.load_async(self.texture, self.texture_scale)
+
+    def copy(self) -> "Particles":
+        """Create new particles with the same settings and their own bodies."""
+        return dataclasses.replace(self)
+
+    def _pick_looks(self, seed: int) -> np.random.Generator:
+        """Pick the size and colour of every particle with `seed`. Returns the
+        generator to go on picking with."""
+        rng = np.random.default_rng(seed)
+        self._seed = seed
+        self._sizes = rng.uniform(*self.size, self.count)
+        self._colors = rng.integers(0, len(self.colors), self.count)
+        self._texture_nodes = None
+        self._nodes = None
+        self._node = None
+        return rng
+
+    def _create(self, width: int, height: int) -> list[pymunk.Body | pymunk.Shape]:
+        """Build the bodies at random spots on a screen of `width` by `height`
+        pixels and return what has to be added to the space."""
+        rng = self._pick_looks(
+            random.getrandbits(32) if self.seed is None else self.seed
+        )
+        count = self.count
+        positions = rng.uniform((0, 0), (width, height), (count, 2)) / SIMULATION_SCALE
+        angles = rng.uniform(0, math.tau, count)
+
+        radii = self._sizes / SIMULATION_SCALE / 2
+        # Mass grows with the area, so small and large particles push each other
+        # around the way they look like they should.
+        masses = self.mass * (self._sizes / max(self.size[1], 1)) ** 2
+        moments = masses * radii**2 / 2
+
+        self._bodies = []
+        self._shapes = []
+        for radius, mass, moment, position, angle in zip(
+            radii.tolist(),
+            masses.tolist(),
+            moments.tolist(),
+            positions.tolist(),
+            angles.tolist(),
+        ):
+            body = pymunk.Body(mass, moment)
+            body.position = position
+            body.angle = angle
+            shape = pymunk.Circle(body, radius)
+            shape.friction = self.friction
+            shape.elasticity = self.elasticity
+            self._bodies.append(body)
+            self._shapes.append(shape)
+
+        self._index = index_bodies(self._bodies)
+        return [*self._bodies, *self._shapes]
+
+    def _restore(self, bodies: np.ndarray):
+        """Move the bodies to `bodies`, rows of x and y in pixels, angle, velocity
+        and angular velocity."""
+        for body, (x, y, angle, vx, vy, angular_velocity) in zip(
+            self._bodies, bodies.tolist()
+        ):
+            body.position = (x / SIMULATION_SCALE, y / SIMULATION_SCALE)
+            body.angle = angle
+            body.velocity = (vx, vy)
+            body.angular_velocity = angular_velocity
+
+    def render_node(
+        self, state: "ParticleState", alpha: float
+    ) -> "Gsk.RenderNode | None":
+        """Every particle `alpha` of the way from the previous to the last step,
+        in one node.
+
+        Particles that didn't move since the last call keep their node, and when
+        none moved the node from the last call is returned.
+        """
+        from gi.repository import Graphene, Gsk  # type: ignore
+
+        if self._loading is not None and not self._loading.done():
+            return None
+        if self._sprites is None:
+            self._sprites = self._build_sprites()
+
+        positions, angles = state.interpolate(alpha)
+        angles = np.degrees(angles)
+        if self._nodes is None or len(self._nodes) != len(positions):
+            self._nodes = [None] * len(positions)  # type: ignore
+            self._drawn_positions = positions.copy()
+            self._drawn_angles = angles.copy()
+            moved = np.ones(len(positions), dtype=bool)
+        else:
+            moved = (np.abs(positions - self._drawn_positions) > MIN_MOVE).any(axis=1)
+            if self.texture is not None:
+                moved |= np.abs(angles - self._drawn_angles) > MIN_TURN
+            if not moved.any():
+                return self._node
+
+        rows = np.flatnonzero(moved)
+        nodes = self._nodes
+        if self.texture is None:
+            # Circles look the same at any angle, so they are placed without a
+            # transform.
+            sizes = self._sizes[rows]
+            corners = positions[rows] - sizes[:, None] / 2
+            for i, (x, y), size, color in zip(
+                rows.tolist(),
+                corners.tolist(),
+                sizes.tolist(),
+                self._colors[rows].tolist(),
+            ):
+                nodes[i] = Gsk.TextureNode.new(
+                    self._sprites[color], Graphene.Rect().init(x, y, size, size)
+                )
+        else:
+            if self._texture_nodes is None:
+                self._texture_nodes = self._build_texture_nodes()
+            children = self._texture_nodes
+            for i, (x, y), angle in zip(
+                rows.tolist(), positions[rows].tolist(), angles[rows].tolist()
+            ):
+                transform = (
+                    Gsk.Transform.new()
+                    .translate(Graphene.Point().init(x, y))
+                    .rotate(angle)
+                )
+                nodes[i] = Gsk.TransformNode.new(children[i], transform)
+
+        # Particles that moved less keep where they were drawn, so slow drifting
+        # adds up until they are moved.
+        self._drawn_positions[rows] = positions[rows]
+        self._drawn_angles[rows] = angles[rows]
+        self._node = Gsk.ContainerNode.new(nodes)
+        return self._node
+
+    def _build_sprites(self) -> list["Gdk.Texture"]:
+        """The texture, or an antialiased disk for every colour."""
+        from gi.repository import Gdk, GLib  # type: ignore
+
+        from desktop_thingies.physics_object import parse_color
+
+        if self._loading is not None:
+            image = self._loading.result()
+            return [
+                Gdk.MemoryTexture.new(
+                    image.width,
+                    image.height,
+                    Gdk.MemoryFormat.R8G8B8A8,
+                    GLib.Bytes.new(image.data),
+                    image.stride,
+                )
+            ]
+
+        diameter = max(math.ceil(self.size[1] * SPRITE_OVERSAMPLING), 1)
+        radius = diameter / 2
+        y, x = np.mgrid[:diameter, :diameter] + 0.5 - radius
+        coverage = np.clip(radius - np.hypot(x, y) + 0.5, 0, 1)
+
+        sprites = []
+        for color in self.colors:
+            rgba = parse_color(color)
+            pixels = np.empty((diameter, diameter, 4), dtype=np.uint8)
+            pixels[..., 0] = round(rgba.red * 255)
+            pixels[..., 1] = round(rgba.green * 255)
+            pixels[..., 2] = round(rgba.blue * 255)
+            pixels[..., 3] = np.round(coverage * rgba.alpha * 255)
+            sprites.append(
+                Gdk.MemoryTexture.new(
+                    diameter,
+                    diameter,
+                    Gdk.MemoryFormat.R8G8B8A8,
+                    GLib.Bytes.new(pixels.tobytes()),
+                    diameter * 4,
+                )
+            )
+        return sprites
+
+    def _build_texture_nodes(self) -> list["Gsk.RenderNode"]:
+        """The texture at the size of every particle, centered on 0,0. These never
+        change, only the transforms around them do."""
+        from gi.repository import Graphene, Gsk  # type: ignore
+
+        assert self._sprites
+        texture = self._sprites[0]
+        # Fit the longer side of the image to the size.
+        longest = max(texture.get_width(), texture.get_height())
+        width = texture.get_width() / longest
+        height = texture.get_height() / longest
+        return [
+            Gsk.TextureScaleNode.new(
+                texture,
+                Graphene.Rect().init(
+                    -width * size / 2, -height * size / 2, width * size, height * size
+                ),
+                Gsk.ScalingFilter.TRILINEAR,
+            )
+            for size in self._sizes.tolist()
+        ]
+
+
+@dataclasses.dataclass(frozen=True)
+class ParticleState:
+    """An immutable copy of the bodies of one `Particles` after a step, like
+    `SimState` is for objects. Row `i` belongs to particle `i`."""
+
+    particles: Particles
+    positions: np.ndarray
+    angles: np.ndarray
+    previous_positions: np.ndarray
+    previous_angles: np.ndarray
+    velocities: np.ndarray
+    angular_velocities: np.ndarray
+    asleep: bool
+    """Whether every particle is asleep."""
+
+    def interpolate(self, alpha: float) -> tuple[np.ndarray, np.ndarray]:
+        positions = (
+            self.previous_positions
+            + (self.positions - self.previous_positions) * alpha
+        )
+        angles = self.previous_angles + (self.angles - self.previous_angles) * alpha
+        return positions, angles
+
+    def fastest_motion(self) -> tuple[float, float]:
+        """Like `SimState.fastest_motion`."""
+        if self.asleep or not len(self.positions):
+            return 0.0, 0.0
+        speed = np.hypot(self.velocities[:, 0], self.velocities[:, 1]).max()
+        angular_speed = np.abs(self.angular_velocities).max()
+        return float(speed) * SIMULATION_SCALE, float(angular_speed)
+
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+def capture(
+    ids: np.ndarray,
+    values: np.ndarray,
+    systems: typing.Sequence[Particles],
+    previous: typing.Sequence[ParticleState],
+    idle_speed: float,
+) -> tuple[ParticleState, ...]:
+    """Copy the bodies of every particle out of what `read_bodies` returned.
+
+    The previous poses are taken from the state in `previous` of the same
+    particles. Particles count as asleep once none of them is faster than
+    `idle_speed`, in simulation units, and pymunk put all of them to sleep.
+    """
+    if not systems:
+        return ()
+
+    previous_states = {id(state.particles): state for state in previous}
+
+    states = []
+    for system in systems:
+        body_values = gather_bodies(system._index, ids, values)
+        positions = _frozen(body_values[:, 0:2] * SIMULATION_SCALE)
+        angles = _frozen(body_values[:, 2].copy())
+        velocities = _frozen(body_values[:, 3:5].copy())
+        angular_velocities = _frozen(body_values[:, 5].copy())
+
+        # Only look at every body when they are all slow enough to be asleep.
+        asleep = not (
+            np.hypot(velocities[:, 0], velocities[:, 1]) > idle_speed
+        ).any() and all(body.is_sleeping for body in system._bodies)
+
+        if (old := previous_states.get(id(system))) is not None:
+            previous_positions, previous_angles = old.positions, old.angles
+        else:
+            previous_positions, previous_angles = positions, angles
+        states.append(
+            ParticleState(
+                particles=system,
+                positions=positions,
+                angles=angles,
+                previous_positions=previous_positions,
+                previous_angles=previous_angles,
+                velocities=velocities,
+                angular_velocities=angular_velocities,
+                asleep=asleep,
+            )
+        )
+    return tuple(states)
@@ -1,13 +1,66 @@
 import dataclasses
+import functools
+import importlib
+import math
+import typing
 from abc import ABC, abstractmethod
-import random
 
-import gi
 import pymunk
-from PIL import Image
 
+from desktop_thingies import atlas, collision, textures
 from desktop_thingies.constants import SIMULATION_SCALE
-from gi.repository import Gdk, Graphene, Gsk, Gtk  # type: ignore
+
+if typing.TYPE_CHECKING:
+    from gi.repository import Gdk, Gsk, Gtk  # type: ignore
+
+# GTK is only imported when an object is first drawn, so that objects can be built
+# and simulated without a display. `desktop_thingies.gtk_setup` must have been
+# imported by then.
+
+
+def parse_color(color: str) -> "Gdk.RGBA":
+    from gi.repository import Gdk  # type: ignore
+
+    rgba = Gdk.RGBA()
+    rgba.parse(color)
+    return rgba
+
+
+def _polygon_distance(polygon: "collision.Polygon", x: float, y: float) -> float:
+    """The distance from a point to a convex polygon, negative inside it."""
+    edges = list(zip(polygon, polygon[1:] + polygon[:1]))
+    # Which side of the edges is outside depends on the winding.
+    winding = -1 if sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in edges) > 0 else 1
+
+    inside = -math.inf
+    outside = math.inf
+    for (x0, y0), (x1, y1) in edges:
+        dx = x1 - x0
+        dy = y1 - y0
+        length = math.hypot(dx, dy) or 1
+        # How far the point is on the outer side of the edge.
+        inside = max(inside, winding * (dx * (y - y0) - dy * (x - x0)) / length)
+
+        t = min(max(((x - x0) * dx + (y - y0) * dy) / (length * length), 0), 1)
+        outside = min(outside, math.hypot(x - x0 - t * dx, y - y0 - t * dy))
+    return inside if inside < 0 else outside
+
+
+def to_dict(obj: "PhysicsObject") -> dict[str, typing.Any]:
+    """The class and settings of an object, to build it again with `from_dict`,
+    e.g. in another process."""
+    cls = type(obj)
+    settings = {
+        field.name: getattr(obj, field.name)
+        for field in dataclasses.fields(obj)
+        if not field.name.startswith("_")
+    }
+    return {"class": f"{cls.__module__}:{cls.__qualname__}", "settings": settings}
+
+
+def from_dict(data: dict[str, typing.Any]) -> "PhysicsObject":
+    module, name = data["class"].split(":")
+    return getattr(importlib.import_module(module), name)(**data["settings"])
 
 
 @dataclasses.dataclass
@@ -24,17 +77,89 @@ class PhysicsObject(ABC):
     _physics_shape: pymunk.Shape = dataclasses.field(default=None)  # type: ignore
     _body: pymunk.Body = dataclasses.field(default=None)  # type: ignore
 
-    _last_velocity_x = 0
-    _last_velocity_y = 0
+    # The node this object was last drawn with, reused while it doesn't move.
+    _render_node = None
+
+    # Set while the object is still loading in the background. The object has no
+    # body until it is done and `_finish_loading` was called.
+    _loading = None
+
+    # Fields that change how the object looks. Setting one of these rebuilds the
+    # cached render node.
+    _appearance_fields: typing.ClassVar[tuple[str, ...]] = ()
 
-    _strech_scale_x = 0
-    _strech_scale_y = 0
-    _strech_time = 0
+    def __setattr__(self, name: str, value: typing.Any):
+        super().__setattr__(name, value)
+        if name in self._appearance_fields:
+            self.__dict__.pop("untransformed_node", None)
+            self.__dict__.pop("_gtk_color", None)
+
+    @functools.cached_property
+    def untransformed_node(self) -> "Gsk.RenderNode":
+        """The object rendered at 0,0. This is built once and reused every frame."""
+        from gi.repository import Gtk  # type: ignore
+
+        snapshot = Gtk.Snapshot.new()
+        self.render_onto(snapshot)
+        return snapshot.to_node()
+
+    def transformed_node(
+        self, x: float, y: float, x_stretch: float, y_stretch: float, angle: float
+    ) -> "Gsk.RenderNode":
+        """`untransformed_node` moved to `x, y`, stretched and rotated by `angle`
+        degrees. The object's own node never changes, only the transform around it
+        does."""
+        from gi.repository import Graphene, Gsk  # type: ignore
+
+        transform = (
+            Gsk.Transform.new()
+            .translate(Graphene.Point().init(x, y))
+            .scale(x_stretch, y_stretch)
+            .rotate(angle)
+        )
+        return Gsk.TransformNode.new(self.untransformed_node, transform)
+
+    @property
+    def _physics_shapes(self) -> list[pymunk.Shape]:
+        """Every shape attached to the body."""
+        return [self._physics_shape]
+
+    def _finish_loading(self):
+        """Build the body once `_loading` is done."""
+
+    def _prepare_drawing(self):
+        """Called for every new object before any of them is drawn."""
+
+    def _settings(self) -> tuple:
+        """Everything the object was configured with. Objects with the same
+        settings are interchangeable."""
+        return (type(self),) + tuple(
+            getattr(self, field.name)
+            for field in dataclasses.fields(self)
+            if not field.name.startswith("_")
+        )
+
+    def copy(self) -> "PhysicsObject":
+        """Create a new object with the same settings and its own physics body."""
+        return dataclasses.replace(self)
 
     @abstractmethod
-    def render_onto(self, snapshot: Gtk.Snapshot):
+    def render_onto(self, snapshot: "Gtk.Snapshot"):
         """Render the object at 0,0 on the snapshot"""
 
+    @abstractmethod
+    def render_size(self) -> tuple[float, float]:
+        """The width and height in pixels that `render_onto` draws over"""
+
+    @abstractmethod
+    def hit_distance(self, x: float, y: float) -> float:
+        """The distance in pixels from a point relative to the object's center and
+        rotation to the edge of the object. Negative inside the object."""
+
+    @abstractmethod
+    def hit_radius(self) -> float:
+        """The furthest distance in pixels of any edge from the object's center"""
+
 
 @dataclasses.dataclass(kw_only=True)
 class Texture(PhysicsObject):
@@ -44,43 +169,149 @@ class Texture(PhysicsObject):
     """Amount to scale the image."""
     collision_scale: float = dataclasses.field(kw_only=True, default=1)
     """The size ofthe collison in comparision to the size of the image."""
+    disk_cache: bool = dataclasses.field(kw_only=True, default=True)
+    """Keep the decoded image in `$XDG_CACHE_HOME` to make the next start faster."""
+    collision: typing.Literal["circle", "alpha"] = dataclasses.field(
+        kw_only=True, default="circle"
+    )
+    """The shape used for collisions. "circle" fits a circle in the image, "alpha"
+    traces the outline of the opaque part of the image."""
+    collision_tolerance: float = dataclasses.field(kw_only=True, default=2)
+    """How many pixels a traced outline may be off from the image."""
+    collision_vertices: int = dataclasses.field(kw_only=True, default=48)
+    """The most vertices a traced outline may have. The tolerance is raised until
+    the outline fits, so collisions stay cheap."""
+
+    _appearance_fields = ("texture", "scale")
 
     def __post_init__(self):
-        texture_file = Image.open(self.texture)
-        height, width = texture_file.size
+        # Decoding the image is the slowest part of starting up, so it happens on a
+        # thread pool while the windows are being set up.
+        self._physics_shape = None  # type: ignore
+        self._body = None  # type: ignore
+        self._image_loading = textures.load_async(
+            self.texture, self.scale, self.disk_cache
+        )
+        self._loading = self._image_loading
+        if self.collision == "alpha":
+            self._loading = collision.load_async(
+                self._image_loading,
+                self.collision_tolerance,
+                self.collision_vertices,
+                self.disk_cache,
+            )
+
+    def _finish_loading(self):
+        self._image = self._image_loading.result()
+        self._size = (self._image.width, self._image.height)
+        self._polygons: list[collision.Polygon] = []
+
+        if self.collision == "alpha":
+            assert self._loading
+            self._polygons = [
+                [
+                    (x * self.collision_scale, y * self.collision_scale)
+                    for x, y in polygon
+                ]
+                for polygon in self._loading.result()
+            ]
+
+        if self._polygons:
+            self._body, self._shapes = self._polygon_shapes()
+        else:
+            radius = min(self._size) / SIMULATION_SCALE / 2 * self.collision_scale
+            self._body = pymunk.Body(
+                self.mass, pymunk.moment_for_circle(self.mass, 0, radius)
+            )
+            self._shapes = [pymunk.Circle(self._body, radius=radius)]
+
+        self._physics_shape = self._shapes[0]
+        for shape in self._shapes:
+            shape.friction = self.friction
+            shape.elasticity = self.elasticity
 
-        uniq = str(map(random.choice, ["abcdefghijklmnopqrztuvwxyz"] * 10))
-        DEST = f"/tmp/{uniq}.png"
+    def _polygon_shapes(self) -> tuple[pymunk.Body, list[pymunk.Shape]]:
+        vertices = [
+            [(x / SIMULATION_SCALE, y / SIMULATION_SCALE) for x, y in polygon]
+            for polygon in self._polygons
+        ]
 
-        texture_file = texture_file.resize((int(height * self.scale), int(width * self.scale)))
-        texture_file.save(DEST)
-        
-        self._gdk_texture = Gdk.Texture.new_from_filename(DEST)
+        shapes = [pymunk.Poly(None, polygon) for polygon in vertices]
 
-        radius = (
-            min(self._gdk_texture.get_width(), self._gdk_texture.get_height())
-            / SIMULATION_SCALE
-            / 2
+        # Spread the mass over the polygons by area and spin around the centroid.
+        total_area = sum(shape.area for shape in shapes)
+        center = sum(
+            (shape.center_of_gravity * (shape.area / total_area) for shape in shapes),
+            pymunk.Vec2d(0, 0),
         )
-        self._physics_shape = pymunk.Circle(
-            pymunk.Body(self.mass, pymunk.moment_for_circle(self.mass, 0, radius * self.collision_scale)),
-            radius=radius * self.collision_scale,
+        moment = sum(
+            pymunk.moment_for_poly(
+                self.mass * shape.area / total_area, polygon, -center
+            )
+            for shape, polygon in zip(shapes, vertices)
         )
 
-        self._body = self._physics_shape.body
-        self._physics_shape.friction = self.friction
-        self._physics_shape.elasticity = self.elasticity
+        body = pymunk.Body(self.mass, moment)
+        body.center_of_gravity = center
+        for shape in shapes:
+            shape.body = body
+        # The object keeps its own reference to the body. Shapes hold theirs
+        # strongly in pymunk 6, but the rest of the code reads `_body`.
+        return body, shapes
+
+    @property
+    def _physics_shapes(self) -> list[pymunk.Shape]:
+        return self._shapes
+
+    def render_size(self) -> tuple[float, float]:
+        return self._size
+
+    def hit_distance(self, x: float, y: float) -> float:
+        if not self._polygons:
+            return math.hypot(x, y) - self.hit_radius()
+        return min(_polygon_distance(polygon, x, y) for polygon in self._polygons)
+
+    def hit_radius(self) -> float:
+        if not self._polygons:
+            return self._physics_shape.radius * SIMULATION_SCALE
+        return max(math.hypot(x, y) for polygon in self._polygons for x, y in polygon)
+
+    def _prepare_drawing(self):
+        self._region = atlas.add(self._image)
+
+    def transformed_node(
+        self, x: float, y: float, x_stretch: float, y_stretch: float, angle: float
+    ) -> "Gsk.RenderNode":
+        # Point at the latest upload of the page, so old uploads can be freed.
+        if self.__dict__.get("_atlas_version") != atlas.version(self._region.page):
+            self.__dict__.pop("untransformed_node", None)
+        return super().transformed_node(x, y, x_stretch, y_stretch, angle)
+
+    def render_onto(self, snapshot: "Gtk.Snapshot"):
+        from gi.repository import Graphene, Gsk  # type: ignore
 
-    def render_onto(self, snapshot: Gtk.Snapshot):
         bounds = Graphene.Rect().init(
-            -self._gdk_texture.get_width() / 2,
-            -self._gdk_texture.get_height() / 2,
-            self._gdk_texture.get_width(),
-            self._gdk_texture.get_height(),
+            -self._size[0] / 2,
+            -self._size[1] / 2,
+            self._size[0],
+            self._size[1],
         )
-        snapshot.append_scaled_texture(
-            self._gdk_texture, Gsk.ScalingFilter.TRILINEAR, bounds
+        # Draw the whole atlas page, moved so this image's region lands on
+        # `bounds`, and clip away the rest.
+        region = self._region
+        self._atlas_version = atlas.version(region.page)
+        page = atlas.gdk_texture(region.page)
+        page_bounds = Graphene.Rect().init(
+            bounds.get_x() - region.x,
+            bounds.get_y() - region.y,
+            page.get_width(),
+            page.get_height(),
         )
+        # The image was resized to its drawn size when it was decoded, so it is
+        # never shrunk and doesn't need mipmaps.
+        snapshot.push_clip(bounds)
+        snapshot.append_scaled_texture(page, Gsk.ScalingFilter.LINEAR, page_bounds)
+        snapshot.pop()
 
 
 @dataclasses.dataclass
@@ -88,26 +319,40 @@ class Circle(PhysicsObject):
     radius: float = dataclasses.field(kw_only=True)
     color: str = dataclasses.field(kw_only=True, default="#000000")
 
+    _appearance_fields = ("radius", "color")
+
     def __post_init__(self):
-        self.radius /= SIMULATION_SCALE
-        self._physics_shape = pymunk.Circle(
-            pymunk.Body(self.mass, pymunk.moment_for_circle(self.mass, 0, self.radius / SIMULATION_SCALE)),
-            radius=self.radius,
+        radius = self.radius / SIMULATION_SCALE
+        self._body = pymunk.Body(
+            self.mass, pymunk.moment_for_circle(self.mass, 0, radius / SIMULATION_SCALE)
         )
-        self._body = self._physics_shape.body
-        self._gtk_color = Gdk.RGBA()
-        self._gtk_color.parse(self.color)
+        self._physics_shape = pymunk.Circle(self._body, radius=radius)
+
+    @functools.cached_property
+    def _gtk_color(self) -> "Gdk.RGBA":
+        return parse_color(self.color)
+
+    def render_size(self) -> tuple[float, float]:
+        return (self.radius * 2, self.radius * 2)
+
+    def hit_distance(self, x: float, y: float) -> float:
+        return math.hypot(x, y) - self.radius
+
+    def hit_radius(self) -> float:
+        return self.radius
+
+    def render_onto(self, snapshot: "Gtk.Snapshot"):
+        from gi.repository import Graphene, Gsk  # type: ignore
 
-    def render_onto(self, snapshot: Gtk.Snapshot):
         rect = Graphene.Rect().init(
-            -self.radius * SIMULATION_SCALE,
-            -self.radius * SIMULATION_SCALE,
-            self.radius * 2 * SIMULATION_SCALE,
-            self.radius * 2 * SIMULATION_SCALE,
+            -self.radius,
+            -self.radius,
+            self.radius * 2,
+            self.radius * 2,
         )
 
         rounded_rect = Gsk.RoundedRect()
-        rounded_rect.init_from_rect(rect, radius=self.radius * SIMULATION_SCALE)
+        rounded_rect.init_from_rect(rect, radius=self.radius)
         snapshot.push_rounded_clip(rounded_rect)
         snapshot.append_color(self._gtk_color, rect)
         snapshot.pop()
@@ -119,30 +364,49 @@ class Rectangle(PhysicsObject):
     height: float= dataclasses.field(kw_only=True)
     color: str = dataclasses.field(kw_only=True, default="#000000")
 
+    _appearance_fields = ("width", "height", "color")
+
     def __post_init__(self):
-        self.width /= SIMULATION_SCALE
-        self.height /= SIMULATION_SCALE
-        
+        width = self.width / SIMULATION_SCALE
+        height = self.height / SIMULATION_SCALE
+
+        self._body = pymunk.Body(
+            self.mass, pymunk.moment_for_box(self.mass, (width, height))
+        )
         self._physics_shape = pymunk.Poly(
-            pymunk.Body(
-                self.mass, pymunk.moment_for_box(self.mass, (self.width, self.height))
-            ),
+            self._body,
             vertices=[
-                (-self.width / 2, -self.height / 2),
-                (self.width / 2, -self.height / 2),
-                (self.width / 2, self.height / 2),
-                (-self.width / 2, self.height / 2),
+                (-width / 2, -height / 2),
+                (width / 2, -height / 2),
+                (width / 2, height / 2),
+                (-width / 2, height / 2),
             ],
         )
-        self._body = self._physics_shape.body
-        self._gtk_color = Gdk.RGBA()
-        self._gtk_color.parse(self.color)
 
-    def render_onto(self, snapshot: Gtk.Snapshot):
+    @functools.cached_property
+    def _gtk_color(self) -> "Gdk.RGBA":
+        return parse_color(self.color)
+
+    def render_size(self) -> tuple[float, float]:
+        return (self.width, self.height)
+
+    def hit_distance(self, x: float, y: float) -> float:
+        dx = abs(x) - self.width / 2
+        dy = abs(y) - self.height / 2
+        outside = math.hypot(max(dx, 0), max(dy, 0))
+        inside = min(max(dx, dy), 0)
+        return outside + inside
+
+    def hit_radius(self) -> float:
+        return math.hypot(self.width, self.height) / 2
+
+    def render_onto(self, snapshot: "Gtk.Snapshot"):
+        from gi.repository import Graphene  # type: ignore
+
         rect = Graphene.Rect().init(
-            -self.width / 2 * SIMULATION_SCALE,
-            -self.height / 2 * SIMULATION_SCALE,
-            self.width * SIMULATION_SCALE,
-            self.height * SIMULATION_SCALE,
+            -self.width / 2,
+            -self.height / 2,
+            self.width,
+            self.height,
         )
         snapshot.append_color(self._gtk_color, rect)
@@ -0,0 +1,394 @@
+"""Replay recorded pointer input against a recorded scene, without a window.
+
+Record a trace with `desktop-thingies --record trace.jsonl`, then run
+`python -m desktop_thingies.replay trace.jsonl` to step the same scene through the
+same input as fast as possible. It prints the step and draw time of every frame and
+a checksum of the final state, which is the same on every replay on the same
+machine and pymunk version.
+
+A trace is JSON lines. The first line is the scene: the world settings, every
+object's and particle's settings and where its body was when recording started.
+Every other line is either a pointer event as it reached the window or a frame,
+with how many steps it ran and with which settings. Replays run the same frames,
+so they follow the recorded run closely, but not bit for bit: pymunk's contact
+caches are not part of the trace and input that arrived during a step on the
+worker thread is replayed after it.
+"""
+
+import argparse
+import collections
+import dataclasses
+import hashlib
+import json
+import random
+import time
+import typing
+from pathlib import Path
+
+import numpy as np
+
+from desktop_thingies import physics_object, snapshot
+from desktop_thingies.layout import FrameLayout
+from desktop_thingies.physics_object import PhysicsObject
+from desktop_thingies.simulation import Grab, MoveMouse, Release, Simulation, Spin
+from desktop_thingies.state import SimState
+
+VERSION = 1
+
+EventKind = typing.Literal["click", "move", "scroll", "release"]
+
+
+@dataclasses.dataclass
+class Recorder:
+    """Write the scene of a simulation and the input it gets to a trace file.
+
+    Nothing is recorded until `start` is called, which the client does once every
+    object has loaded, so the scene in the trace is complete.
+    """
+
+    path: Path
+    seed: int
+    """The seed of the random module while recording, objects added later are
+    placed with it."""
+
+    _file: typing.TextIO | None = None
+    _start = 0.0
+
+    @property
+    def started(self) -> bool:
+        return self._file is not None
+
+    def start(self, simulation: Simulation):
+        state = simulation.state
+        bodies = [
+            [
+                *state.positions[i].tolist(),
+                float(state.angles[i]),
+                *state.velocities[i].tolist(),
+                float(state.angular_velocities[i]),
+                bool(state.sleeping[i]),
+            ]
+            for i in range(len(state.objects))
+        ]
+        particles = []
+        for particle_state in state.particles:
+            settings = physics_object.to_dict(particle_state.particles)
+            # The same seed picks the same sizes and colours again.
+            settings["settings"]["seed"] = particle_state.particles._seed
+            particle_bodies = np.column_stack(
+                (
+                    particle_state.positions,
+                    particle_state.angles,
+                    particle_state.velocities,
+                    particle_state.angular_velocities,
+                )
+            )
+            particles.append(
+                {"particles": settings, "bodies": particle_bodies.tolist()}
+            )
+        self._file = open(self.path, "w", buffering=1)
+        self._start = time.monotonic()
+        self._write(
+            version=VERSION,
+            seed=self.seed,
+            width=simulation.width,
+            height=simulation.height,
+            gravity=simulation.gravity,
+            wall_friction=simulation.wall_friction,
+            wall_elasticity=simulation.wall_elasticity,
+            top_offset=simulation.top_offset,
+            bottom_offset=simulation.bottom_offset,
+            left_offset=simulation.left_offset,
+            right_offset=simulation.right_offset,
+            spatial_hash=simulation.spatial_hash,
+            objects=[physics_object.to_dict(obj) for obj in state.objects],
+            bodies=bodies,
+            particles=particles,
+        )
+
+    def event(self, kind: EventKind, x: float, y: float):
+        """Record pointer input. For scrolling `x` and `y` are the scroll deltas."""
+        if self._file is not None:
+            self._write(time=self._time(), event=kind, x=x, y=y)
+
+    def frame(self, dt: float, steps: int, substeps: int, iterations: int):
+        """Record a frame that runs `steps` steps of `dt` seconds."""
+        if self._file is not None:
+            self._write(
+                time=self._time(),
+                frame=steps,
+                dt=dt,
+                substeps=substeps,
+                iterations=iterations,
+            )
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def _time(self) -> float:
+        return round(time.monotonic() - self._start, 6)
+
+    def _write(self, **entry: typing.Any):
+        assert self._file
+        self._file.write(json.dumps(entry) + "\n")
+
+
+@dataclasses.dataclass
+class _Pointer:
+    """Turns pointer events into commands the way `PhysicsSpace` does."""
+
+    simulation: Simulation
+    holding: PhysicsObject | None = None
+    pending_motion: tuple[float, float] | None = None
+
+    def handle(self, kind: EventKind, x: float, y: float):
+        if kind == "click":
+            if self.holding is None and (obj := self.simulation.state.object_at(x, y)):
+                self.simulation.send(MoveMouse(x, y))
+                self.simulation.send(Grab(obj))
+                self.holding = obj
+        elif kind == "release":
+            if self.holding is not None:
+                self.simulation.send(MoveMouse(x, y))
+                self.simulation.send(Release())
+                self.holding = None
+        elif kind == "move":
+            # Motion is only handled once per frame, like in the client.
+            self.pending_motion = (x, y)
+        elif kind == "scroll":
+            if self.holding is not None:
+                self.simulation.send(Spin(y))
+
+    def process_motion(self):
+        if self.pending_motion is None:
+            return
+        x, y = self.pending_motion
+        self.pending_motion = None
+        if self.holding is not None:
+            self.simulation.send(MoveMouse(x, y))
+        else:
+            # The hover check for the cursor.
+            self.simulation.state.object_at(x, y)
+
+
+@dataclasses.dataclass
+class FrameTiming:
+    frame: int
+    steps: int
+    step_ms: float
+    draw_ms: float
+    motion_ms: float
+    redrawn: int
+    awake: int
+
+
+@dataclasses.dataclass
+class Result:
+    frames: list[FrameTiming]
+    seconds: float
+    """How long the whole replay took."""
+    recorded_seconds: float
+    """How long the recording took."""
+    checksum: str
+    """A hash of every body's position, angle, velocity and sleep state at the end."""
+
+    def summary(self) -> dict[str, typing.Any]:
+        step = np.array([frame.step_ms for frame in self.frames] or [0.0])
+        draw = np.array([frame.draw_ms for frame in self.frames] or [0.0])
+        return {
+            "frames": len(self.frames),
+            "steps": sum(frame.steps for frame in self.frames),
+            "seconds": round(self.seconds, 4),
+            "recorded_seconds": self.recorded_seconds,
+            "step_ms_mean": round(float(step.mean()), 4),
+            "step_ms_p95": round(float(np.percentile(step, 95)), 4),
+            "step_ms_max": round(float(step.max()), 4),
+            "draw_ms_mean": round(float(draw.mean()), 4),
+            "draw_ms_p95": round(float(np.percentile(draw, 95)), 4),
+            "draw_ms_max": round(float(draw.max()), 4),
+            "checksum": self.checksum,
+        }
+
+
+def checksum(state: SimState) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for array in (
+        state.positions,
+        state.angles,
+        state.velocities,
+        state.angular_velocities,
+        state.sleeping,
+    ):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    for particles in state.particles:
+        for array in (
+            particles.positions,
+            particles.angles,
+            particles.velocities,
+            particles.angular_velocities,
+        ):
+            digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def read(path: Path) -> tuple[dict[str, typing.Any], list[dict[str, typing.Any]]]:
+    """Read a trace, returning the scene and the events and frames in order."""
+    with open(path) as f:
+        scene = json.loads(f.readline())
+        if scene.get("version") != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} trace")
+        return scene, [json.loads(line) for line in f if line.strip()]
+
+
+def _simulation_for(scene: dict[str, typing.Any], threads: int) -> Simulation:
+    objects = [physics_object.from_dict(data) for data in scene["objects"]]
+    restore: snapshot.Restore = collections.defaultdict(collections.deque)
+    for obj, (x, y, angle, vx, vy, angular_velocity, sleeping) in zip(
+        objects, scene["bodies"]
+    ):
+        restore[snapshot.object_key(obj)].append(
+            snapshot.BodyState((x, y), angle, (vx, vy), angular_velocity, sleeping)
+        )
+
+    # Traces from before particles existed don't have them.
+    particles = scene.get("particles", [])
+
+    spatial_hash = scene["spatial_hash"]
+    simulation = Simulation(
+        width=scene["width"],
+        height=scene["height"],
+        physics_objects=objects,
+        particles=[physics_object.from_dict(data["particles"]) for data in particles],
+        gravity=tuple(scene["gravity"]),
+        wall_friction=scene["wall_friction"],
+        wall_elasticity=scene["wall_elasticity"],
+        top_offset=scene["top_offset"],
+        bottom_offset=scene["bottom_offset"],
+        left_offset=scene["left_offset"],
+        right_offset=scene["right_offset"],
+        threads=threads,
+        spatial_hash=(
+            tuple(spatial_hash) if isinstance(spatial_hash, list) else spatial_hash
+        ),
+        restore=restore,
+    )
+    simulation.setup()
+    for system, data in zip(simulation.particles, particles):
+        system._restore(np.array(data["bodies"], dtype=float))
+    if particles:
+        simulation._publish()
+    # Everything had loaded when recording started, so wait for it here as well.
+    for obj in simulation.loading:
+        if obj._loading is not None:
+            obj._loading.result()
+    return simulation
+
+
+def run(path: Path, *, threads: int = 1) -> Result:
+    """Replay the trace at `path` as fast as possible and time every frame.
+
+    Replays are only deterministic with a single thread, the threaded solver
+    doesn't solve contacts in a fixed order.
+    """
+    scene, entries = read(path)
+    random.seed(scene["seed"])
+    simulation = _simulation_for(scene, threads)
+    pointer = _Pointer(simulation)
+    layout = FrameLayout(scene["width"], scene["height"])
+
+    frames: list[FrameTiming] = []
+    start = time.perf_counter()
+    for entry in entries:
+        if "event" in entry:
+            pointer.handle(entry["event"], entry["x"], entry["y"])
+            continue
+
+        motion_start = time.perf_counter()
+        pointer.process_motion()
+        step_start = time.perf_counter()
+        simulation.iterations = entry["iterations"]
+        for _ in range(entry["frame"]):
+            simulation.step(entry["dt"], entry["substeps"])
+        draw_start = time.perf_counter()
+        # Drawing without GTK means laying the frame out, the render nodes
+        # aren't built.
+        state = simulation.state
+        if state.objects is not layout.objects:
+            layout.follow(state.objects)
+        redrawn = int(layout.update(state, 1)[1].sum()) if state.objects else 0
+        end = time.perf_counter()
+
+        frames.append(
+            FrameTiming(
+                frame=len(frames),
+                steps=entry["frame"],
+                step_ms=round((draw_start - step_start) * 1000, 4),
+                draw_ms=round((end - draw_start) * 1000, 4),
+                motion_ms=round((step_start - motion_start) * 1000, 4),
+                redrawn=redrawn,
+                awake=simulation.state.awake_count(),
+            )
+        )
+
+    return Result(
+        frames=frames,
+        seconds=time.perf_counter() - start,
+        recorded_seconds=entries[-1]["time"] if entries else 0.0,
+        checksum=checksum(simulation.state),
+    )
+
+
+def main(argv: typing.Sequence[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m desktop_thingies.replay",
+        description="Replay a trace recorded with `desktop-thingies --record`.",
+    )
+    parser.add_argument("trace", type=Path)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Replay this many times and check that every replay ends the same.",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print every frame and then the summary as JSON lines.",
+    )
+    args = parser.parse_args(argv)
+
+    checksums = set()
+    for _ in range(args.repeat):
+        result = run(args.trace, threads=args.threads)
+        checksums.add(result.checksum)
+        summary = result.summary()
+
+        if args.json:
+            for timing in result.frames:
+                print(json.dumps(dataclasses.asdict(timing)))
+            print(json.dumps(summary), flush=True)
+        else:
+            print(
+                f"{summary['frames']} frames, {summary['steps']} steps in "
+                f"{summary['seconds']:.3f} s "
+                f"(recorded {summary['recorded_seconds']:.3f} s)"
+            )
+            print(
+                f"  step ms  mean {summary['step_ms_mean']:.3f}  p95 "
+                f"{summary['step_ms_p95']:.3f}  max {summary['step_ms_max']:.3f}"
+            )
+            print(
+                f"  draw ms  mean {summary['draw_ms_mean']:.3f}  p95 "
+                f"{summary['draw_ms_p95']:.3f}  max {summary['draw_ms_max']:.3f}"
+            )
+            print(f"  checksum {summary['checksum']}", flush=True)
+
+    if len(checksums) > 1:
+        print(f"Replays ended in {len(checksums)} different states.")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
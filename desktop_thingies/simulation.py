@@ -0,0 +1,832 @@
+import collections
+import dataclasses
+import math
+import random
+import statistics
+import sys
+import time
+import typing
+
+import numpy as np
+import pymunk
+import pymunk.batch
+
+from desktop_thingies import particles, snapshot
+from desktop_thingies.constants import SIMULATION_SCALE
+from desktop_thingies.particles import Particles, ParticleState
+from desktop_thingies.physics_object import PhysicsObject
+from desktop_thingies.state import SimState
+
+EDGES = ("top", "right", "bottom", "left")
+
+
+def add_box(
+    space: pymunk.Space,
+    friction: float,
+    elasticity: float,
+    p0: tuple[int, int],
+    p1: tuple[int, int],
+    d: int = 4,
+    open_edges: typing.Collection[str] = (),
+) -> list[pymunk.Segment]:
+    """Surround the rectangle from `p0` to `p1` with walls and return them.
+
+    Edges named in `open_edges` ("top", "right", "bottom" or "left") are left open.
+    """
+    WALL_WIDTH = 1000
+    WALL_OFFSET = 0
+    x0, y0 = p0
+    x1, y1 = p1
+    ps = [
+        (x0 - WALL_WIDTH - WALL_OFFSET, y0 - WALL_WIDTH - WALL_OFFSET),
+        (x1 + WALL_WIDTH + WALL_OFFSET, y0 - WALL_WIDTH - WALL_OFFSET),
+        (x1 + WALL_WIDTH + WALL_OFFSET, y1 + WALL_WIDTH + WALL_OFFSET),
+        (x0 - WALL_WIDTH - WALL_OFFSET, y1 + WALL_WIDTH + WALL_OFFSET),
+    ]
+    walls = []
+    for i, edge in enumerate(EDGES):
+        if edge in open_edges:
+            continue
+        segment = pymunk.Segment(space.static_body, ps[i], ps[(i + 1) % 4], WALL_WIDTH)
+        segment.elasticity = friction
+        segment.friction = elasticity
+        space.add(segment)
+        walls.append(segment)
+    return walls
+
+
+# How many seconds a group of touching bodies has to be idle before it sleeps.
+SLEEP_TIME = 0.5
+# The smallest spatial hash cell, in simulation units. The walls are huge, so tiny
+# cells make them cover a lot of cells.
+MIN_HASH_CELL = 1
+
+# Bodies slower than this count as idle. Pymunk derives it from gravity by
+# default, which means nothing ever sleeps without gravity.
+IDLE_SPEED = 0.25
+
+# Every step bodies keep this share of their velocity and feel this share of
+# gravity, no matter what they touch.
+FRICTION = 0.99
+# Bodies faster than this are slowed down, in simulation units per second.
+MAX_VELOCITY = 500
+MAX_ANGULAR_VELOCITY = 15
+# The held body follows the mouse and would overshoot without extra damping.
+HOLDING_DAMPING = 0.3
+# The held body may spin faster, up to a point.
+HOLDING_MAX_ANGULAR_VELOCITY = 50
+HOLDING_ANGULAR_VELOCITY = 30
+
+
+def limit_velocities(
+    velocities: np.ndarray, angular_velocities: np.ndarray, holding: int | None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Slow down bodies that move or spin too fast and damp the held body.
+
+    Takes the `(n, 2)` velocities and `(n,)` angular velocities of every body and
+    returns new arrays.
+    """
+    velocities = velocities.copy()
+    angular_velocities = angular_velocities.copy()
+    if holding is not None:
+        velocities[holding] *= HOLDING_DAMPING
+
+    speed = np.hypot(velocities[:, 0], velocities[:, 1])
+    fast = speed > MAX_VELOCITY
+    velocities[fast] *= 0.9
+    speed[fast] *= 0.9
+    velocities[speed > MAX_VELOCITY * 1.5] *= 0.5
+
+    spinning = np.abs(angular_velocities) > MAX_ANGULAR_VELOCITY
+    if holding is not None:
+        spinning[holding] = False
+        if abs(angular_velocities[holding]) >= HOLDING_MAX_ANGULAR_VELOCITY:
+            angular_velocities[holding] = math.copysign(
+                HOLDING_ANGULAR_VELOCITY, angular_velocities[holding]
+            )
+    angular_velocities[spinning] *= 0.8
+    return velocities, angular_velocities
+
+
+def clamp(n: float, max: float):
+    if n < 0:
+        if n < -max:
+            return -max
+    if n > max:
+        return max
+    return n
+
+
+@dataclasses.dataclass(frozen=True)
+class Grab:
+    """Pick up an object."""
+
+    obj: PhysicsObject
+
+
+@dataclasses.dataclass(frozen=True)
+class Release:
+    """Let go of the held object, flinging it towards the mouse."""
+
+
+@dataclasses.dataclass(frozen=True)
+class Spin:
+    """Spin the held object."""
+
+    amount: float
+
+
+@dataclasses.dataclass(frozen=True)
+class MoveMouse:
+    """Set the point in pixels the held object is dragged towards."""
+
+    x: float
+    y: float
+
+
+@dataclasses.dataclass(frozen=True)
+class AddObject:
+    """Add an object at `position` in pixels. It keeps its current velocity. With
+    `bounce` it is put back inside the walls if it is outside of them."""
+
+    obj: PhysicsObject
+    position: tuple[float, float]
+    angle: float
+    bounce: bool = False
+
+
+@dataclasses.dataclass(frozen=True)
+class RemoveObject:
+    obj: PhysicsObject
+
+
+@dataclasses.dataclass(frozen=True)
+class SetObjects:
+    """Change the objects to `objects`, keeping the ones that are already there."""
+
+    objects: list[PhysicsObject]
+
+
+@dataclasses.dataclass(frozen=True)
+class SetParticles:
+    """Change the particles to `particles`, keeping the ones that are already
+    there."""
+
+    particles: list[Particles]
+
+
+@dataclasses.dataclass(frozen=True)
+class SetWorld:
+    """Change the gravity and the walls."""
+
+    gravity: tuple[float, float]
+    wall_friction: float
+    wall_elasticity: float
+    top_offset: int
+    bottom_offset: int
+    left_offset: int
+    right_offset: int
+
+
+Command = (
+    Grab
+    | Release
+    | Spin
+    | MoveMouse
+    | AddObject
+    | RemoveObject
+    | SetObjects
+    | SetParticles
+    | SetWorld
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class Departure:
+    """An object that left the screen through an open edge."""
+
+    obj: PhysicsObject
+    position: tuple[float, float]
+    """Where the object left, in pixels."""
+    angle: float
+
+
+@dataclasses.dataclass(kw_only=True)
+class Simulation:
+    """The physics world for one screen.
+
+    This owns the pymunk space, the walls and the objects, and knows how to turn
+    mouse input into impulses. It does not depend on GTK so it can be stepped
+    without a display, e.g. from tests or benchmarks. All coordinates passed in
+    and out are in pixels.
+
+    Only the thread calling `step` touches the pymunk space. Other threads `send`
+    commands, which are applied at the start of the next step, and read `state`,
+    which is replaced with a new immutable snapshot after every step.
+    """
+
+    width: int
+    """The width of the screen in pixels."""
+    height: int
+    """The height of the screen in pixels."""
+    physics_objects: list[PhysicsObject]
+    particles: list[Particles] = dataclasses.field(default_factory=list)
+    """Particles are placed randomly by `setup` and never leave the screen."""
+    physics_space: pymunk.Space = None  # type: ignore
+    """Created from `threads` if not given."""
+    gravity: tuple[float, float] = (0, 0)
+    wall_friction: float = 0.5
+    wall_elasticity: float = 0.5
+    top_offset: int = 0
+    bottom_offset: int = 0
+    left_offset: int = 0
+    right_offset: int = 0
+
+    threads: int = 1
+    """Solve collisions with this many threads. Pymunk only has a threaded solver
+    on Linux, and it uses at most 2 threads."""
+    spatial_hash: bool | tuple[float, int] = False
+    """Find colliding objects with a spatial hash instead of a bounding box tree,
+    which is faster for lots of objects of similar size. `True` picks the cell
+    size and count from the objects, or pass `(cell size, cell count)` in
+    simulation units."""
+    iterations: int = 10
+    """How many iterations the solver runs every step. Fewer is faster but makes
+    stacks of objects softer."""
+
+    open_edges: set[str] = dataclasses.field(default_factory=set)
+    """Edges without a wall, where objects can leave the screen."""
+
+    restore: snapshot.Restore = dataclasses.field(default_factory=dict)
+    """Saved bodies to put objects back where they were instead of placing them
+    randomly. Each one is used up by the first object with the same key."""
+    loading: list[PhysicsObject] = dataclasses.field(default_factory=list)
+    """Objects that are still loading in the background. Each one is added at a
+    random spot by the first step after it is done."""
+
+    holding_body: pymunk.Body | None = None
+    mouse_position: tuple[float, float] = (0, 0)
+
+    state: SimState = dataclasses.field(default_factory=SimState.empty)
+    """The state after the last step."""
+    departures: collections.deque[Departure] = dataclasses.field(
+        default_factory=collections.deque
+    )
+    """Objects that left through an open edge. They are no longer part of this
+    simulation, whoever reads them decides where they go."""
+
+    is_initialized: bool = False
+    sim_sleep = False
+    sim_frame = 0
+    # How long the physics of the last step took in seconds.
+    last_step_time = 0.0
+
+    _commands: collections.deque[Command] = dataclasses.field(
+        default_factory=collections.deque
+    )
+    _objects: tuple[PhysicsObject, ...] = ()
+    _walls: list[pymunk.Segment] = dataclasses.field(default_factory=list)
+    _body_buffer: pymunk.batch.Buffer | None = None
+    # The body index of `_objects`, to find their rows in a batched read.
+    _objects_index: tuple[np.ndarray, np.ndarray] | None = None
+
+    def __post_init__(self):
+        if self.physics_space is None:
+            threaded = self.threads > 1 and sys.platform.startswith("linux")
+            self.physics_space = pymunk.Space(threaded=threaded)
+            if threaded:
+                self.physics_space.threads = self.threads
+
+    def setup(self):
+        """Add the objects and the walls to the space, placing objects where they
+        are in `restore` or randomly.
+
+        Objects that are still loading are moved to `loading`.
+        """
+        self._set_gravity()
+        self.physics_space.sleep_time_threshold = SLEEP_TIME
+        self.physics_space.idle_speed_threshold = IDLE_SPEED
+        self.physics_space.iterations = self.iterations
+
+        objects, self.physics_objects = self.physics_objects, []
+        for obj in objects:
+            if obj._loading is not None and not obj._loading.done():
+                self.loading.append(obj)
+                continue
+            obj._finish_loading()
+            self._add_to_space(obj)
+            self._place(obj)
+            self.physics_objects.append(obj)
+        for system in self.particles:
+            self.physics_space.add(*system._create(self.width, self.height))
+
+        self._build_walls()
+        self._tune_broadphase()
+
+        # When everything was restored asleep there is nothing to simulate.
+        self.sim_sleep = (
+            not self.particles
+            and bool(self.physics_objects)
+            and all(obj._body.is_sleeping for obj in self.physics_objects)
+        )
+
+        self.is_initialized = True
+        self._publish()
+
+    def _build_walls(self):
+        if self._walls:
+            self.physics_space.remove(*self._walls)
+        self._walls = add_box(
+            self.physics_space,
+            self.wall_elasticity,
+            self.wall_friction,
+            (self.left_offset / SIMULATION_SCALE, self.top_offset / SIMULATION_SCALE),
+            (
+                (self.width - self.right_offset) / SIMULATION_SCALE,
+                (self.height - self.bottom_offset)  / SIMULATION_SCALE,
+            ),
+            open_edges=self.open_edges,
+        )
+
+    def send(self, command: Command):
+        """Queue a command for the next step. This is safe to call from any thread."""
+        self._commands.append(command)
+
+    @property
+    def has_pending(self) -> bool:
+        """Whether commands or loaded objects are waiting for the next step."""
+        return bool(self._commands) or any(
+            obj._loading is None or obj._loading.done() for obj in self.loading
+        )
+
+    def _place(self, obj: PhysicsObject):
+        """Put a new object where it was saved, or at a random spot."""
+        if saved := self.restore.get(snapshot.object_key(obj)):
+            body = saved.popleft()
+            obj._body.position = (
+                body.position[0] / SIMULATION_SCALE,
+                body.position[1] / SIMULATION_SCALE,
+            )
+            obj._body.angle = body.angle
+            self.physics_space.reindex_shapes_for_body(obj._body)
+            if body.sleeping:
+                obj._body.sleep()
+            else:
+                obj._body.velocity = body.velocity
+                obj._body.angular_velocity = body.angular_velocity
+            return
+
+        obj._body.position = pymunk.Vec2d(
+            random.randrange(0, self.width / SIMULATION_SCALE),
+            random.randrange(0, self.height / SIMULATION_SCALE),
+        )
+        obj._body.angle = random.random() * math.pi * 2
+        self.physics_space.reindex_shapes_for_body(obj._body)
+
+    def _tune_broadphase(self):
+        if self.spatial_hash is False:
+            return
+        if self.spatial_hash is not True:
+            self.physics_space.use_spatial_hash(*self.spatial_hash)
+            return
+        if not self.physics_objects and not any(
+            system.count for system in self.particles
+        ):
+            return
+
+        # Chipmunk suggests cells the size of an average shape and about ten
+        # times as many cells as shapes. The median isn't thrown off by a few
+        # big objects.
+        sizes = []
+        for obj in self.physics_objects:
+            boxes = [shape.cache_bb() for shape in obj._physics_shapes]
+            width = max(bb.right for bb in boxes) - min(bb.left for bb in boxes)
+            height = max(bb.top for bb in boxes) - min(bb.bottom for bb in boxes)
+            sizes.append(max(width, height))
+        for system in self.particles:
+            sizes.extend((system._sizes / SIMULATION_SCALE).tolist())
+        shapes = sum(len(obj._physics_shapes) for obj in self.physics_objects)
+        shapes += sum(system.count for system in self.particles)
+        self.physics_space.use_spatial_hash(
+            max(statistics.median(sizes), MIN_HASH_CELL), max(shapes * 10, 100)
+        )
+
+    def _add_loaded(self) -> bool:
+        """Add the objects that finished loading and return whether there were any."""
+        still_loading = []
+        for obj in self.loading:
+            if obj._loading is not None and not obj._loading.done():
+                still_loading.append(obj)
+                continue
+            obj._finish_loading()
+            self._add_to_space(obj)
+            self._place(obj)
+            self.physics_objects.append(obj)
+            if not obj._body.is_sleeping:
+                self.sim_sleep = False
+
+        added = len(still_loading) != len(self.loading)
+        if added:
+            self._tune_broadphase()
+        self.loading = still_loading
+        return added
+
+    def _add_to_space(self, obj: PhysicsObject):
+        self.physics_space.add(obj._body)
+        self.physics_space.add(*obj._physics_shapes)
+
+    def _apply(self, command: Command):
+        match command:
+            case MoveMouse(x, y):
+                self.move_mouse(x, y)
+            case Grab(obj):
+                if obj in self.physics_objects:
+                    self.grab(obj)
+            case Release():
+                self.release()
+            case Spin(amount):
+                self.spin(amount)
+            case AddObject(obj, position, angle, bounce):
+                self.add_object(obj, position, angle)
+                if bounce:
+                    self.push_back(obj)
+            case RemoveObject(obj):
+                if obj in self.physics_objects:
+                    self.remove_object(obj)
+            case SetObjects(objects):
+                self.set_objects(objects)
+            case SetParticles(new_particles):
+                self.set_particles(new_particles)
+            case SetWorld():
+                self.set_world(command)
+
+    def add_object(
+        self, obj: PhysicsObject, position: tuple[float, float], angle: float
+    ):
+        """Add an object to the running simulation at `position` in pixels.
+
+        The object keeps its current velocity.
+        """
+        self._add_to_space(obj)
+        self.physics_objects.append(obj)
+        obj._body.position = (
+            position[0] / SIMULATION_SCALE,
+            position[1] / SIMULATION_SCALE,
+        )
+        obj._body.angle = angle
+        self.physics_space.reindex_shapes_for_body(obj._body)
+        obj._body.activate()
+        self.sim_sleep = False
+
+    def remove_object(self, obj: PhysicsObject):
+        if obj._body is self.holding_body:
+            self.holding_body = None
+        self.physics_space.remove(*obj._physics_shapes, obj._body)
+        self.physics_objects.remove(obj)
+
+    def set_objects(self, objects: list[PhysicsObject]):
+        """Change the objects to `objects`.
+
+        Objects with the same settings as one in `objects` stay where they are.
+        The others are removed, and what is left of `objects` is added at random
+        spots once it has loaded.
+        """
+        new: dict[tuple, list[PhysicsObject]] = collections.defaultdict(list)
+        for obj in objects:
+            new[obj._settings()].append(obj)
+
+        for obj in list(self.physics_objects):
+            if twins := new.get(obj._settings()):
+                twins.pop()
+            else:
+                self.remove_object(obj)
+
+        still_loading = []
+        for obj in self.loading:
+            if twins := new.get(obj._settings()):
+                twins.pop()
+                still_loading.append(obj)
+        self.loading = still_loading + [obj for twins in new.values() for obj in twins]
+
+    def set_particles(self, new_particles: list[Particles]):
+        """Change the particles to `new_particles`.
+
+        Particles with the same settings as one in `new_particles` stay as they
+        are, the others are removed and the rest of `new_particles` is added at
+        random spots.
+        """
+        kept = []
+        added = list(new_particles)
+        for system in self.particles:
+            if system in added:
+                del added[added.index(system)]
+                kept.append(system)
+            else:
+                self.physics_space.remove(*system._shapes, *system._bodies)
+
+        for system in added:
+            self.physics_space.add(*system._create(self.width, self.height))
+        self.particles = kept + added
+        if added:
+            self._tune_broadphase()
+            self.sim_sleep = False
+
+    def set_world(self, world: SetWorld):
+        """Change the gravity and rebuild the walls, leaving the objects alone."""
+        for field in dataclasses.fields(world):
+            setattr(self, field.name, getattr(world, field.name))
+        self._set_gravity()
+        self._build_walls()
+
+        # Objects can end up outside of the walls when the offsets changed.
+        for obj in self.physics_objects:
+            x, y = obj._body.position * SIMULATION_SCALE
+            if not (
+                self.left_offset <= x <= self.width - self.right_offset
+                and self.top_offset <= y <= self.height - self.bottom_offset
+            ):
+                self.push_back(obj)
+            obj._body.activate()
+        for system in self.particles:
+            for body in system._bodies:
+                body.activate()
+        self._contain_particles()
+        self.sim_sleep = False
+
+    def push_back(self, obj: PhysicsObject):
+        """Put an object that escaped back on the screen, bouncing it off the edge."""
+        x, y = obj._body.position * SIMULATION_SCALE
+        vx, vy = obj._body.velocity
+        if x < self.left_offset or x > self.width - self.right_offset:
+            vx = -vx
+        if y < self.top_offset or y > self.height - self.bottom_offset:
+            vy = -vy
+        x = min(max(x, self.left_offset), self.width - self.right_offset)
+        y = min(max(y, self.top_offset), self.height - self.bottom_offset)
+        obj._body.position = (x / SIMULATION_SCALE, y / SIMULATION_SCALE)
+        obj._body.velocity = (vx, vy)
+        self.physics_space.reindex_shapes_for_body(obj._body)
+
+    def _remove_escaped(self):
+        """Move objects that left the screen through an open edge to `departures`."""
+        for obj in list(self.physics_objects):
+            if obj._body is self.holding_body or obj._body.is_sleeping:
+                continue
+            x, y = obj._body.position * SIMULATION_SCALE
+            if (
+                ("left" in self.open_edges and x < self.left_offset)
+                or ("right" in self.open_edges and x > self.width - self.right_offset)
+                or ("top" in self.open_edges and y < self.top_offset)
+                or (
+                    "bottom" in self.open_edges
+                    and y > self.height - self.bottom_offset
+                )
+            ):
+                self.remove_object(obj)
+                self.departures.append(Departure(obj, (x, y), obj._body.angle))
+
+    def _contain_particles(self):
+        """Put particles that got outside of the walls back, bouncing them off the
+        edge. Particles never leave through open edges."""
+        for state in self.state.particles:
+            x, y = state.positions[:, 0], state.positions[:, 1]
+            outside_x = (x < self.left_offset) | (x > self.width - self.right_offset)
+            outside_y = (y < self.top_offset) | (y > self.height - self.bottom_offset)
+            for i in np.flatnonzero(outside_x | outside_y).tolist():
+                body = state.particles._bodies[i]
+                vx, vy = body.velocity
+                body.position = (
+                    min(max(x[i], self.left_offset), self.width - self.right_offset)
+                    / SIMULATION_SCALE,
+                    min(max(y[i], self.top_offset), self.height - self.bottom_offset)
+                    / SIMULATION_SCALE,
+                )
+                body.velocity = (
+                    -vx if outside_x[i] else vx,
+                    -vy if outside_y[i] else vy,
+                )
+                self.physics_space.reindex_shapes_for_body(body)
+
+    def move_mouse(self, x: float, y: float):
+        """Set the point the held object is dragged towards."""
+        SMALLER_BOUND = 5
+        if x < SMALLER_BOUND + self.left_offset:
+            x = SMALLER_BOUND + self.left_offset
+        if x > self.width - SMALLER_BOUND - self.right_offset:
+            x = self.width - SMALLER_BOUND - self.right_offset
+        if y < SMALLER_BOUND + self.bottom_offset:
+            y = SMALLER_BOUND + self.bottom_offset
+        if y > self.height - SMALLER_BOUND - self.top_offset:
+            y = self.height - SMALLER_BOUND - self.top_offset
+        self.mouse_position = (x, y)
+
+    def grab(self, obj: PhysicsObject):
+        self.sim_sleep = False
+        self.holding_body = obj._body
+        # Wake up the object and everything touching it.
+        self.holding_body.activate()
+
+    def release(self):
+        """Let go of the held object, flinging it towards the mouse."""
+        if self.holding_body is None:
+            return
+
+        distance = (
+            clamp(
+                self.mouse_position[0] / SIMULATION_SCALE
+                - self.holding_body.position[0],
+                1000,
+            ),
+            clamp(
+                self.mouse_position[1] / SIMULATION_SCALE
+                - self.holding_body.position[1],
+                1000,
+            ),
+        )
+
+        self.holding_body.apply_impulse_at_world_point(
+            (distance[0] * (1 / 0.3) * 4, distance[1] * (1 / 0.3) * 4),
+            self.holding_body.position,
+        )
+        self.holding_body = None
+
+    def spin(self, amount: float):
+        """Spin the held object."""
+        if self.holding_body is None:
+            return
+        self.holding_body.angular_velocity += amount
+        self.physics_space.reindex_shapes_for_body(self.holding_body)
+
+    def _set_gravity(self):
+        self.physics_space.gravity = (
+            self.gravity[0] * FRICTION,
+            self.gravity[1] * FRICTION,
+        )
+
+    def _limit_velocities(self):
+        """Apply `limit_velocities` to the bodies of the published state.
+
+        Only bodies that actually changed are written to, since writing a velocity
+        wakes a body up and would keep it from ever falling asleep.
+        """
+        for particle_state in self.state.particles:
+            if particle_state.asleep:
+                continue
+            velocities, angular_velocities = limit_velocities(
+                particle_state.velocities, particle_state.angular_velocities, None
+            )
+            changed = (velocities != particle_state.velocities).any(axis=1) | (
+                angular_velocities != particle_state.angular_velocities
+            )
+            for i in np.flatnonzero(changed).tolist():
+                body = particle_state.particles._bodies[i]
+                body.velocity = tuple(velocities[i].tolist())
+                body.angular_velocity = float(angular_velocities[i])
+
+        state = self.state
+        if not state.objects:
+            return
+        velocities, angular_velocities = limit_velocities(
+            state.velocities, state.angular_velocities, state.holding
+        )
+        changed = (velocities != state.velocities).any(axis=1) | (
+            angular_velocities != state.angular_velocities
+        )
+        if not changed.any():
+            return
+
+        for i in np.flatnonzero(changed).tolist():
+            body = state.objects[i]._body
+            body.velocity = tuple(velocities[i].tolist())
+            body.angular_velocity = float(angular_velocities[i])
+        self.state = state.with_velocities(velocities, angular_velocities)
+
+    def _read_bodies(self) -> tuple[np.ndarray, np.ndarray]:
+        """Read every body in the space in one call, see `particles.read_bodies`."""
+        if self._body_buffer is None:
+            self._body_buffer = pymunk.batch.Buffer()
+        return particles.read_bodies(self.physics_space, self._body_buffer)
+
+    def _capture_particles(
+        self, bodies: tuple[np.ndarray, np.ndarray] | None = None
+    ) -> tuple[ParticleState, ...]:
+        if not self.particles:
+            return ()
+        ids, values = bodies or self._read_bodies()
+        return particles.capture(
+            ids, values, self.particles, self.state.particles, IDLE_SPEED
+        )
+
+    def _publish(
+        self,
+        particle_states: tuple[ParticleState, ...] | None = None,
+        bodies: tuple[np.ndarray, np.ndarray] | None = None,
+    ):
+        """Publish a new state. `bodies` is what `_read_bodies` returned, if the
+        bodies were already read after the last step."""
+        if len(self._objects) != len(self.physics_objects) or any(
+            a is not b for a, b in zip(self._objects, self.physics_objects)
+        ):
+            self._objects = tuple(self.physics_objects)
+            self._objects_index = None
+        if self._objects_index is None:
+            self._objects_index = particles.index_bodies(
+                [obj._body for obj in self._objects]
+            )
+
+        holding = None
+        if self.holding_body is not None:
+            holding = next(
+                i
+                for i, obj in enumerate(self._objects)
+                if obj._body is self.holding_body
+            )
+
+        # Replacing the attribute is atomic, readers see either the old or the new
+        # state and never a half written one.
+        # Positions and velocities of every body come from one batched read
+        # instead of a Python attribute access per body and field.
+        ids, values = bodies or self._read_bodies()
+        if particle_states is None:
+            particle_states = self._capture_particles((ids, values))
+        self.state = SimState.capture(
+            self._objects,
+            previous=self.state,
+            holding=holding,
+            sim_sleep=self.sim_sleep,
+            frame=self.sim_frame,
+            particles=particle_states,
+            values=particles.gather_bodies(self._objects_index, ids, values),
+        )
+
+    def step(self, dt: float, substeps: int = 1):
+        """Advance the simulation by `dt` seconds.
+
+        With `substeps` the physics is advanced in that many smaller steps, which
+        keeps fast objects from passing through each other.
+        """
+        if not self.is_initialized:
+            return
+
+        changed = bool(self._commands)
+        while self._commands:
+            self._apply(self._commands.popleft())
+
+        # Newly loaded objects wake the simulation up, unless they were restored
+        # asleep.
+        if self.loading and self._add_loaded():
+            changed = True
+
+        if self.holding_body is not None:
+            self.sim_sleep = False
+            distance = (
+                self.mouse_position[0] / SIMULATION_SCALE
+                - self.holding_body.position[0],
+                self.mouse_position[1] / SIMULATION_SCALE
+                - self.holding_body.position[1],
+            )
+
+            x = distance[0] * (1 / 0.3) * 2
+            y = distance[1] * (1 / 0.3) * 2
+
+            self.holding_body.apply_impulse_at_world_point(
+                (x, y),
+                self.holding_body.position,
+            )
+
+        if not self.sim_sleep:
+            self.sim_frame += 1
+            if self.physics_space.iterations != self.iterations:
+                self.physics_space.iterations = self.iterations
+            # Pymunk raises the damping to the power of the step length, this
+            # keeps `FRICTION` of the velocity over the whole step, however many
+            # substeps it is split into. The held body is damped once per step in
+            # `_limit_velocities` the same way.
+            damping = FRICTION ** (1 / dt)
+            if self.physics_space.damping != damping:
+                self.physics_space.damping = damping
+            start = time.perf_counter()
+            for _ in range(substeps):
+                self.physics_space.step(dt / substeps)
+
+            if self.open_edges:
+                self._remove_escaped()
+
+            # Pymunk puts groups of touching bodies to sleep on their own once they
+            # stop moving. Once everything sleeps there is nothing left to step.
+            bodies = self._read_bodies()
+            particle_states = self._capture_particles(bodies)
+            self.sim_sleep = (
+                self.holding_body is None
+                and all(obj._body.is_sleeping for obj in self.physics_objects)
+                and all(state.asleep for state in particle_states)
+            )
+            self._publish(particle_states, bodies)
+            if self.open_edges and self.particles:
+                self._contain_particles()
+            # Clamping velocities once per step on arrays is a lot cheaper than a
+            # python velocity callback for every body in every substep.
+            self._limit_velocities()
+            self.last_step_time = time.perf_counter() - start
+        elif changed:
+            self._publish()
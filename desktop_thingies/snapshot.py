@@ -0,0 +1,122 @@
+import collections
+import dataclasses
+import hashlib
+import mmap
+import os
+import struct
+from pathlib import Path
+
+from desktop_thingies.physics_object import PhysicsObject
+from desktop_thingies.state import SimState
+
+# Snapshots store where every body was, so the next start can put them back instead
+# of shuffling the desktop.
+#
+# The file is a header followed by one fixed size record per body:
+#   header: magic, version, record size, body count, screen width, screen height
+#   record: object key, x, y, angle, x velocity, y velocity, angular velocity,
+#           sleeping
+# Positions are in pixels, velocities in simulation units.
+
+MAGIC = b"DTSS"
+VERSION = 1
+_HEADER = struct.Struct("<4sHHIII")
+_RECORD = struct.Struct("<8s6f?3x")
+
+
+@dataclasses.dataclass(frozen=True)
+class BodyState:
+    position: tuple[float, float]
+    angle: float
+    velocity: tuple[float, float]
+    angular_velocity: float
+    sleeping: bool
+
+
+Restore = dict[bytes, collections.deque[BodyState]]
+"""Saved bodies by the key of the object they belong to."""
+
+
+def state_dir() -> Path:
+    if state_home := os.environ.get("XDG_STATE_HOME"):
+        return Path(state_home) / "desktop-thingies"
+    return Path(os.environ["HOME"]) / ".local" / "state" / "desktop-thingies"
+
+
+def path_for(name: str) -> Path:
+    """Where the snapshot of the space on monitor `name` is kept."""
+    return state_dir() / f"{name}.snapshot"
+
+
+def object_key(obj: PhysicsObject) -> bytes:
+    """Objects with the same settings have the same key, in any process."""
+    return hashlib.blake2b(repr(obj._settings()).encode(), digest_size=8).digest()
+
+
+def save(path: Path, state: SimState, width: int, height: int):
+    """Write the bodies of `state` to `path`, replacing it atomically."""
+    data = bytearray(_HEADER.size + _RECORD.size * len(state.objects))
+    _HEADER.pack_into(
+        data, 0, MAGIC, VERSION, _RECORD.size, len(state.objects), width, height
+    )
+    for i, obj in enumerate(state.objects):
+        x, y = state.positions[i].tolist()
+        vx, vy = state.velocities[i].tolist()
+        _RECORD.pack_into(
+            data,
+            _HEADER.size + i * _RECORD.size,
+            object_key(obj),
+            x,
+            y,
+            float(state.angles[i]),
+            vx,
+            vy,
+            float(state.angular_velocities[i]),
+            bool(state.sleeping[i]),
+        )
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    except OSError:
+        # Losing a snapshot only means the objects get shuffled on the next start.
+        pass
+
+
+def load(path: Path, width: int, height: int) -> Restore:
+    """Read the bodies saved in `path`.
+
+    Nothing is restored if the file is missing, broken, from another version or
+    was saved for a screen of a different size.
+    """
+    restore: Restore = collections.defaultdict(collections.deque)
+    try:
+        with (
+            open(path, "rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data,
+        ):
+            if len(data) < _HEADER.size:
+                return restore
+            magic, version, record_size, count, saved_width, saved_height = (
+                _HEADER.unpack_from(data)
+            )
+            if (
+                magic != MAGIC
+                or version != VERSION
+                or record_size != _RECORD.size
+                or (saved_width, saved_height) != (width, height)
+                or len(data) != _HEADER.size + count * _RECORD.size
+            ):
+                return restore
+
+            records = _RECORD.iter_unpack(data[_HEADER.size :])
+            for key, x, y, angle, vx, vy, angular_velocity, sleeping in records:
+                restore[key].append(
+                    BodyState((x, y), angle, (vx, vy), angular_velocity, sleeping)
+                )
+    except (OSError, ValueError):
+        # ValueError is raised for mapping an empty file.
+        pass
+    return restore
@@ -0,0 +1,96 @@
+import contextlib
+import dataclasses
+import os
+import sys
+import time
+
+
+def _process_age() -> float | None:
+    """Seconds since the process was started, if the OS tells us."""
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name can contain spaces, the fields we want come after it.
+            fields = f.read().rpartition(")")[2].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    start_time = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    return uptime - start_time
+
+
+@dataclasses.dataclass
+class StartupProfile:
+    """Time how long each phase of starting up takes.
+
+    Phases are timed with `phase`, things that happen at a point in time, like the
+    first frame being drawn, are recorded with `mark`. The report is printed once
+    every mark passed to `wait_for` has happened, never before `wait_for` is called.
+    """
+
+    start: float = dataclasses.field(default_factory=time.perf_counter)
+    before_start: float | None = dataclasses.field(default_factory=_process_age)
+    """How long the process ran before the profile was created, in seconds."""
+    entries: list[tuple[str, float, float | None]] = dataclasses.field(
+        default_factory=list
+    )
+    """The name, start and duration in seconds of every phase and mark."""
+
+    _waiting_for: set[str] | None = None
+    _reported: bool = False
+
+    def _now(self) -> float:
+        return time.perf_counter() - self.start
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = self._now()
+        try:
+            yield
+        finally:
+            self.entries.append((name, start, self._now() - start))
+
+    def _happened(self, name: str) -> bool:
+        return any(entry[0] == name for entry in self.entries)
+
+    def _report_when_done(self):
+        if self._waiting_for or self._waiting_for is None or self._reported:
+            return
+        self._reported = True
+        print(self.report(), file=sys.stderr)
+
+    def mark(self, name: str):
+        """Record that something happened. Only the first time counts."""
+        if self._happened(name):
+            return
+        self.entries.append((name, self._now(), None))
+        if self._waiting_for is not None:
+            self._waiting_for.discard(name)
+        self._report_when_done()
+
+    def wait_for(self, *names: str):
+        """Print the report once all of these marks happened."""
+        if self._waiting_for is None:
+            self._waiting_for = set()
+        self._waiting_for.update(name for name in names if not self._happened(name))
+        self._report_when_done()
+
+    def report(self) -> str:
+        entries = sorted(self.entries, key=lambda entry: entry[1])
+        width = max([len(name) for name, _, _ in entries] + [len("before main")])
+        lines = [f"{'startup':<{width}}  {'at ms':>8}  {'took ms':>8}"]
+        if self.before_start is not None:
+            lines.append(
+                f"{'before main':<{width}}  {'':>8}  {self.before_start * 1000:8.1f}"
+            )
+        for name, start, duration in entries:
+            took = "" if duration is None else f"{duration * 1000:8.1f}"
+            lines.append(f"{name:<{width}}  {start * 1000:8.1f}  {took:>8}")
+
+        total = max(
+            (start + (duration or 0) for _, start, duration in entries), default=0
+        )
+        if self.before_start is not None:
+            total += self.before_start
+        lines.append(f"total {total * 1000:.1f} ms")
+        return "\n".join(lines)
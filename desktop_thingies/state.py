@@ -0,0 +1,189 @@
+import dataclasses
+import math
+
+import numpy as np
+
+from desktop_thingies.constants import SIMULATION_SCALE
+from desktop_thingies.particles import ParticleState
+from desktop_thingies.physics_object import PhysicsObject
+
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+@dataclasses.dataclass(frozen=True)
+class SimState:
+    """An immutable copy of every body after a physics step.
+
+    The simulation publishes a new one after each step, so rendering and hit
+    testing can read it from any thread without touching the live pymunk bodies.
+    Row `i` of every array belongs to `objects[i]`. Positions are in pixels,
+    velocities are in simulation units like pymunk uses.
+    """
+
+    objects: tuple[PhysicsObject, ...]
+    positions: np.ndarray
+    angles: np.ndarray
+    previous_positions: np.ndarray
+    """Positions before the step, used to interpolate between steps."""
+    previous_angles: np.ndarray
+    velocities: np.ndarray
+    angular_velocities: np.ndarray
+    sleeping: np.ndarray
+    hit_radii: np.ndarray
+    """How far from its position each object reaches, in pixels."""
+    pickup_distances: np.ndarray
+    holding: int | None = None
+    """The index of the held object."""
+    sim_sleep: bool = False
+    frame: int = 0
+    particles: tuple[ParticleState, ...] = ()
+    """The bodies of every `Particles`, which are kept apart from the objects."""
+
+    @classmethod
+    def empty(cls) -> "SimState":
+        return cls.capture(())
+
+    @classmethod
+    def capture(
+        cls,
+        objects: tuple[PhysicsObject, ...],
+        previous: "SimState | None" = None,
+        holding: int | None = None,
+        sim_sleep: bool = False,
+        frame: int = 0,
+        particles: tuple[ParticleState, ...] = (),
+        values: np.ndarray | None = None,
+    ) -> "SimState":
+        """Copy the state out of the bodies of `objects`.
+
+        The previous pose is taken from `previous` if it was captured from the
+        same `objects` tuple, otherwise objects don't move between the two poses.
+
+        `values` are the position, angle, velocity and angular velocity of every
+        body as rows in the order of `objects`, if they were already read in one
+        go. Otherwise they are read from each body.
+        """
+        bodies = [obj._body for obj in objects]
+        count = len(bodies)
+
+        if values is None:
+            values = np.array(
+                [
+                    (*body.position, body.angle, *body.velocity, body.angular_velocity)
+                    for body in bodies
+                ],
+                dtype=float,
+            ).reshape(count, 6)
+
+        positions = values[:, 0:2] * SIMULATION_SCALE
+        angles = values[:, 2].copy()
+
+        if previous is not None and previous.objects is objects:
+            previous_positions = previous.positions
+            previous_angles = previous.angles
+            hit_radii = previous.hit_radii
+            pickup_distances = previous.pickup_distances
+        else:
+            previous_positions = positions
+            previous_angles = angles
+            hit_radii = _frozen(
+                np.array([obj.hit_radius() for obj in objects], dtype=float)
+            )
+            pickup_distances = _frozen(
+                np.array([obj.pickup_distance for obj in objects], dtype=float)
+            )
+
+        return cls(
+            objects=objects,
+            positions=_frozen(positions),
+            angles=_frozen(angles),
+            previous_positions=previous_positions,
+            previous_angles=previous_angles,
+            velocities=_frozen(values[:, 3:5].copy()),
+            angular_velocities=_frozen(values[:, 5].copy()),
+            sleeping=_frozen(
+                np.array([body.is_sleeping for body in bodies], dtype=bool)
+            ),
+            hit_radii=hit_radii,
+            pickup_distances=pickup_distances,
+            holding=holding,
+            sim_sleep=sim_sleep,
+            frame=frame,
+            particles=particles,
+        )
+
+    def with_velocities(
+        self, velocities: np.ndarray, angular_velocities: np.ndarray
+    ) -> "SimState":
+        """A copy of this state with other velocities."""
+        return dataclasses.replace(
+            self,
+            velocities=_frozen(velocities),
+            angular_velocities=_frozen(angular_velocities),
+        )
+
+    def interpolate(self, alpha: float) -> tuple[np.ndarray, np.ndarray]:
+        """Positions and angles `alpha` of the way from the previous to this step."""
+        positions = (
+            self.previous_positions
+            + (self.positions - self.previous_positions) * alpha
+        )
+        angles = self.previous_angles + (self.angles - self.previous_angles) * alpha
+        return positions, angles
+
+    def awake_count(self) -> int:
+        return int(np.count_nonzero(~self.sleeping))
+
+    def fastest_motion(self) -> tuple[float, float]:
+        """The highest speed in pixels per second and the highest angular speed in
+        radians per second of any awake body."""
+        speed = 0.0
+        angular_speed = 0.0
+        awake = ~self.sleeping
+        if awake.any():
+            speed = float(
+                np.hypot(self.velocities[awake, 0], self.velocities[awake, 1]).max()
+            ) * SIMULATION_SCALE
+            angular_speed = float(np.abs(self.angular_velocities[awake]).max())
+
+        for particles in self.particles:
+            particle_speed, particle_angular_speed = particles.fastest_motion()
+            speed = max(speed, particle_speed)
+            angular_speed = max(angular_speed, particle_angular_speed)
+        return speed, angular_speed
+
+    def pickup_boxes(self, margin: float = 0) -> np.ndarray:
+        """The box around every object the pointer can pick it up from, grown by
+        `margin` pixels, as rows of `x0, y0, x1, y1`."""
+        reach = (self.hit_radii + self.pickup_distances + margin)[:, None]
+        return np.hstack((self.positions - reach, self.positions + reach))
+
+    def object_at(self, x: float, y: float) -> PhysicsObject | None:
+        """Return the object that can be picked up at this point, if any.
+
+        If several objects are in reach the closest one is picked.
+        """
+        if not self.objects:
+            return None
+
+        # Throw out everything whose bounding circle is out of reach, then look at
+        # the exact shape of what is left.
+        offset = np.array((x, y)) - self.positions
+        distance = np.hypot(offset[:, 0], offset[:, 1]) - self.hit_radii
+        candidates = np.flatnonzero(distance <= self.pickup_distances)
+
+        closest = None
+        closest_distance = math.inf
+        for i in candidates.tolist():
+            dx, dy = offset[i].tolist()
+            cos = math.cos(-self.angles[i])
+            sin = math.sin(-self.angles[i])
+            obj = self.objects[i]
+            hit_distance = obj.hit_distance(dx * cos - dy * sin, dx * sin + dy * cos)
+            if hit_distance <= obj.pickup_distance and hit_distance < closest_distance:
+                closest = obj
+                closest_distance = hit_distance
+        return closest
@@ -0,0 +1,118 @@
+import collections
+import contextlib
+import dataclasses
+import json
+import socket
+import time
+import typing
+
+import numpy as np
+
+# How many frames the rolling percentiles are computed over.
+WINDOW = 600
+PERCENTILES = (50, 95, 99)
+
+TIMINGS = ("step", "draw", "motion")
+"""Everything that is timed, in seconds.
+
+`step` is the time spent in `pymunk.Space.step`, `draw` the time spent preparing
+and snapshotting a frame and `motion` the time spent handling pointer motion.
+"""
+
+
+@dataclasses.dataclass
+class FrameStats:
+    """Rolling frame timings for one space."""
+
+    name: str
+    timings: dict[str, collections.deque[float]] = dataclasses.field(
+        default_factory=lambda: {
+            timing: collections.deque(maxlen=WINDOW) for timing in TIMINGS
+        }
+    )
+    gauges: dict[str, typing.Any] = dataclasses.field(default_factory=dict)
+    """The latest value of things that are not timed, like the awake body count."""
+    frames: int = 0
+
+    def record(self, timing: str, seconds: float):
+        self.timings[timing].append(seconds)
+
+    @contextlib.contextmanager
+    def measure(self, timing: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(timing, time.perf_counter() - start)
+
+    def end_frame(self, **gauges: typing.Any):
+        self.frames += 1
+        self.gauges.update(gauges)
+
+    def percentiles(self, timing: str) -> dict[str, float]:
+        """The rolling percentiles of a timing, in milliseconds."""
+        samples = self.timings[timing]
+        if not samples:
+            return {f"p{p}": 0.0 for p in PERCENTILES}
+        values = np.percentile(np.fromiter(samples, float), PERCENTILES) * 1000
+        return {f"p{p}": round(float(v), 3) for p, v in zip(PERCENTILES, values)}
+
+    def summary(self) -> dict[str, typing.Any]:
+        return {
+            "time": time.time(),
+            "space": self.name,
+            "frames": self.frames,
+            **{f"{timing}_ms": self.percentiles(timing) for timing in TIMINGS},
+            **self.gauges,
+        }
+
+    def overlay_text(self) -> str:
+        lines = [self.name]
+        for timing in TIMINGS:
+            p = self.percentiles(timing)
+            lines.append(
+                f"{timing:<9} p50 {p['p50']:6.2f}  p95 {p['p95']:6.2f}  "
+                f"p99 {p['p99']:6.2f} ms"
+            )
+        lines += [f"{key}: {value}" for key, value in self.gauges.items()]
+        return "\n".join(lines)
+
+
+class StatsWriter:
+    """Write stats summaries as JSON lines.
+
+    `destination` is either a file path, which is appended to, or `unix:` followed
+    by the path of a listening unix stream socket.
+    """
+
+    def __init__(self, destination: str) -> None:
+        self.destination = destination
+        self._file: typing.TextIO | None = None
+        self._socket: socket.socket | None = None
+
+    def write(self, summary: dict[str, typing.Any]):
+        line = json.dumps(summary) + "\n"
+        if self.destination.startswith("unix:"):
+            self._send(line.encode())
+            return
+        if self._file is None:
+            self._file = open(self.destination, "a", buffering=1)
+        self._file.write(line)
+
+    def _send(self, data: bytes):
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.connect(self.destination.removeprefix("unix:"))
+            self._socket.sendall(data)
+        except OSError:
+            # Nobody is listening right now, try again with the next summary.
+            if self._socket is not None:
+                self._socket.close()
+            self._socket = None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._socket is not None:
+            self._socket.close()
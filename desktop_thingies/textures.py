@@ -0,0 +1,164 @@
+import concurrent.futures
+import dataclasses
+import hashlib
+import os
+import struct
+import threading
+from pathlib import Path
+
+# Decoded images are shared between every object that uses the same file at the
+# same scale, so memory use grows with the number of unique images instead of the
+# number of objects.
+
+_HEADER = struct.Struct("<II")
+
+
+@dataclasses.dataclass(frozen=True)
+class TextureImage:
+    """Decoded, scaled RGBA pixels of an image."""
+
+    key: tuple[str, float]
+    """The hash of the image file and the scale it was resized to."""
+    width: int
+    height: int
+    data: bytes = dataclasses.field(repr=False)
+    """Pixels in non-premultiplied RGBA8 order, without row padding."""
+
+    @property
+    def stride(self) -> int:
+        return self.width * 4
+
+
+_hashes: dict[tuple[str, int, int], str] = {}
+_images: dict[tuple[str, float], TextureImage] = {}
+
+# Images being decoded in the background, by path and scale.
+_pending: dict[tuple[str, float, bool], concurrent.futures.Future[TextureImage]] = {}
+_pending_lock = threading.Lock()
+_executor: concurrent.futures.ThreadPoolExecutor | None = None
+
+
+def cache_dir(name: str = "textures") -> Path:
+    if cache_home := os.environ.get("XDG_CACHE_HOME"):
+        return Path(cache_home) / "desktop-thingies" / name
+    return Path(os.environ["HOME"]) / ".cache" / "desktop-thingies" / name
+
+
+def executor() -> concurrent.futures.Executor:
+    """The thread pool images are loaded on."""
+    global _executor
+
+    with _pending_lock:
+        if _executor is None:
+            # Pillow releases the GIL while decoding and resizing.
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                thread_name_prefix="textures"
+            )
+        return _executor
+
+
+def file_hash(path: str | Path) -> str:
+    """Hash the contents of a file, remembering the result while it is unchanged."""
+    stat = os.stat(path)
+    stat_key = (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size)
+    if (digest := _hashes.get(stat_key)) is not None:
+        return digest
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 16):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    _hashes[stat_key] = digest
+    return digest
+
+
+def _read_cached(path: Path, key: tuple[str, float]) -> TextureImage | None:
+    try:
+        data = path.read_bytes()
+    except OSError:
+        return None
+    if len(data) < _HEADER.size:
+        return None
+    width, height = _HEADER.unpack_from(data)
+    pixels = data[_HEADER.size :]
+    if len(pixels) != width * height * 4:
+        return None
+    return TextureImage(key=key, width=width, height=height, data=pixels)
+
+
+def _write_cached(path: Path, image: TextureImage):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(_HEADER.pack(image.width, image.height) + image.data)
+        os.replace(tmp, path)
+    except OSError:
+        # The disk cache is only an optimization.
+        pass
+
+
+def load(path: str | Path, scale: float, disk_cache: bool = True) -> TextureImage:
+    """Decode an image and resize it by `scale`.
+
+    Results are kept in memory for the lifetime of the process. If `disk_cache` is
+    set the decoded pixels are also stored under `$XDG_CACHE_HOME` so the next
+    start doesn't need to decode the image again.
+    """
+    key = (file_hash(path), float(scale))
+    if (image := _images.get(key)) is not None:
+        return image
+
+    cache_path = cache_dir() / f"{key[0]}-{key[1]!r}.rgba"
+    image = _read_cached(cache_path, key) if disk_cache else None
+
+    if image is None:
+        # Pillow takes a while to import and isn't needed at all when every
+        # image is in the disk cache.
+        from PIL import Image
+
+        texture_file = Image.open(path)
+        height, width = texture_file.size
+        texture_file = texture_file.resize(
+            (int(height * scale), int(width * scale))
+        ).convert("RGBA")
+        image = TextureImage(
+            key=key,
+            width=texture_file.width,
+            height=texture_file.height,
+            data=texture_file.tobytes(),
+        )
+        if disk_cache:
+            _write_cached(cache_path, image)
+
+    _images[key] = image
+    return image
+
+
+def load_async(
+    path: str | Path, scale: float, disk_cache: bool = True
+) -> concurrent.futures.Future[TextureImage]:
+    """Like `load`, but decode the image on a thread pool.
+
+    Asking for an image that is already being decoded returns the same future, so
+    every image is only decoded once no matter how many objects use it.
+    """
+    pending_key = (str(path), float(scale), disk_cache)
+    with _pending_lock:
+        future = _pending.get(pending_key)
+    if future is not None:
+        return future
+
+    future = executor().submit(load, path, scale, disk_cache)
+    with _pending_lock:
+        _pending[pending_key] = future
+
+    def done(_: concurrent.futures.Future):
+        # From now on `load` finds the image in memory, or notices that the file
+        # changed since.
+        with _pending_lock:
+            _pending.pop(pending_key, None)
+
+    future.add_done_callback(done)
+    return future
+
@@ -0,0 +1,542 @@
+import collections
+import dataclasses
+import multiprocessing
+import multiprocessing.connection
+import traceback
+import typing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from desktop_thingies import physics_object, snapshot
+from desktop_thingies.constants import MAX_STEPS_PER_FRAME
+from desktop_thingies.particles import Particles, ParticleState
+from desktop_thingies.physics_object import PhysicsObject
+from desktop_thingies.simulation import Command, Departure, Simulation
+from desktop_thingies.state import SimState
+
+# Running a simulation in its own process keeps its steps from holding the GIL the
+# window needs to paint.
+#
+# The client sends commands and step requests over a pipe and the worker answers
+# each step with a short summary. The bodies themselves are written to a ring of
+# slots in shared memory that the client's `SimState` reads without copying.
+#
+# Objects can't be sent between processes, they are referred to by a key instead.
+# The first time an object is sent its settings go along and the worker builds its
+# own copy. Particles are sent the same way, but their bodies go along with the
+# summary, there are only a few of them and they are arrays already.
+
+# Every step publishes a state into the next slot. While a frame's steps run, the
+# main thread may still be reading the state from before them, in drawing or in
+# the input handlers. A frame runs at most `MAX_STEPS_PER_FRAME` steps, which the
+# client's `_tick` enforces, so that state's slot is only written again after the
+# frame is over. One slot on top of that is spare.
+SLOTS = MAX_STEPS_PER_FRAME + 2
+# Room for this many bodies is made up front, the ring is replaced with a bigger
+# one when there are more.
+MIN_CAPACITY = 64
+
+# The arrays of a slot: name, values per body and type.
+_FIELDS: tuple[tuple[str, int, type], ...] = (
+    ("positions", 2, np.float64),
+    ("angles", 1, np.float64),
+    ("previous_positions", 2, np.float64),
+    ("previous_angles", 1, np.float64),
+    ("velocities", 2, np.float64),
+    ("angular_velocities", 1, np.float64),
+    ("sleeping", 1, np.bool_),
+)
+
+# The `Simulation` fields that are sent to the worker to build its simulation.
+_SETTINGS = (
+    "width",
+    "height",
+    "gravity",
+    "wall_friction",
+    "wall_elasticity",
+    "top_offset",
+    "bottom_offset",
+    "left_offset",
+    "right_offset",
+    "threads",
+    "spatial_hash",
+    "iterations",
+    "open_edges",
+)
+
+
+class _Ring:
+    """`SLOTS` copies of the body arrays for up to `capacity` bodies."""
+
+    def __init__(self, memory: shared_memory.SharedMemory, capacity: int) -> None:
+        self.memory = memory
+        self.capacity = capacity
+
+    @staticmethod
+    def slot_size(capacity: int) -> int:
+        size = sum(
+            capacity * width * np.dtype(dtype).itemsize for _, width, dtype in _FIELDS
+        )
+        # Keep every slot aligned for the floats at its start.
+        return -(-size // 8) * 8
+
+    @classmethod
+    def create(cls, capacity: int) -> "_Ring":
+        memory = shared_memory.SharedMemory(
+            create=True, size=cls.slot_size(capacity) * SLOTS
+        )
+        return cls(memory, capacity)
+
+    @classmethod
+    def attach(cls, name: str, capacity: int) -> "_Ring":
+        return cls(shared_memory.SharedMemory(name=name), capacity)
+
+    def arrays(self, slot: int, count: int) -> dict[str, np.ndarray]:
+        """Views of the arrays in `slot`, for the first `count` bodies."""
+        offset = slot * self.slot_size(self.capacity)
+        arrays = {}
+        for name, width, dtype in _FIELDS:
+            shape = (count, width) if width > 1 else (count,)
+            arrays[name] = np.ndarray(
+                shape, dtype=dtype, buffer=self.memory.buf, offset=offset
+            )
+            offset += self.capacity * width * np.dtype(dtype).itemsize
+        return arrays
+
+
+@dataclasses.dataclass(frozen=True)
+class _Ref:
+    """An object the other side already knows."""
+
+    key: int
+
+
+@dataclasses.dataclass(frozen=True)
+class _New:
+    """An object the other side hasn't seen yet."""
+
+    key: int
+    settings: dict[str, typing.Any]
+
+
+@dataclasses.dataclass(frozen=True)
+class _Step:
+    commands: list[Command]
+    dt: float
+    substeps: int
+    iterations: int
+
+
+@dataclasses.dataclass(frozen=True)
+class _Stop:
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class _Published:
+    """What the worker answers every request with."""
+
+    sequence: int
+    """How many states were published. The last one is in slot `sequence % SLOTS`."""
+    count: int
+    objects: tuple[int, ...] | None
+    """The keys of the objects in the state, if they changed."""
+    loading: tuple[int, ...]
+    holding: int | None
+    sim_sleep: bool
+    frame: int
+    last_step_time: float
+    has_pending: bool
+    """Whether the worker has commands or objects it is still working on."""
+    ring: tuple[str, int] | None
+    """The name and capacity of a new ring to read from."""
+    particles: tuple[tuple[typing.Any, ...], ...]
+    """The key, seed, positions, angles, velocities, angular velocities and
+    whether they are asleep of every `Particles`, if the state changed."""
+
+
+@dataclasses.dataclass(frozen=True)
+class _Failed:
+    traceback: str
+
+
+def _map_objects(
+    value: typing.Any, function: typing.Callable[[typing.Any], typing.Any]
+):
+    """Replace every object in a command, or in the lists and tuples in it."""
+    if isinstance(value, (PhysicsObject, Particles, _Ref, _New)):
+        return function(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_map_objects(item, function) for item in value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.replace(
+            value,
+            **{
+                field.name: _map_objects(getattr(value, field.name), function)
+                for field in dataclasses.fields(value)
+            },
+        )
+    return value
+
+
+@dataclasses.dataclass
+class _Worker:
+    connection: multiprocessing.connection.Connection
+    simulation: Simulation
+
+    objects: dict[int, PhysicsObject | Particles] = dataclasses.field(
+        default_factory=dict
+    )
+    keys: dict[int, int] = dataclasses.field(default_factory=dict)
+    """Object keys by `id` of the object."""
+    ring: _Ring | None = None
+    sequence = 0
+    _published: SimState | None = None
+
+    def decode(self, value: typing.Any) -> typing.Any:
+        if isinstance(value, _New):
+            obj = physics_object.from_dict(value.settings)
+            self.objects[value.key] = obj
+            self.keys[id(obj)] = value.key
+            return obj
+        # Commands for objects that are gone by now are ignored by the simulation.
+        return self.objects.get(value.key)
+
+    def forget_removed(self):
+        """Drop the objects that are no longer in the simulation. The client
+        drops the same ones when it gets the state."""
+        live = {
+            id(obj)
+            for obj in self.simulation.physics_objects + self.simulation.loading
+        }
+        for key, obj in list(self.objects.items()):
+            if isinstance(obj, PhysicsObject) and id(obj) not in live:
+                del self.objects[key]
+                del self.keys[id(obj)]
+
+    def publish(self):
+        simulation = self.simulation
+        state = simulation.state
+        objects = None
+        ring = None
+        particles = ()
+        if state is not self._published:
+            if self._published is None or state.objects is not self._published.objects:
+                objects = tuple(self.keys[id(obj)] for obj in state.objects)
+
+            count = len(state.objects)
+            if self.ring is None or count > self.ring.capacity:
+                old = self.ring
+                capacity = max(MIN_CAPACITY, count * 2)
+                self.ring = _Ring.create(capacity)
+                ring = (self.ring.memory.name, capacity)
+                if old is not None:
+                    # The client keeps its own mapping for as long as it needs it.
+                    old.memory.close()
+                    old.memory.unlink()
+
+            self.sequence += 1
+            arrays = self.ring.arrays(self.sequence % SLOTS, count)
+            for name, array in arrays.items():
+                array[:] = getattr(state, name)
+            del arrays
+            particles = tuple(
+                (
+                    self.keys[id(system.particles)],
+                    system.particles._seed,
+                    system.positions,
+                    system.angles,
+                    system.velocities,
+                    system.angular_velocities,
+                    system.asleep,
+                )
+                for system in state.particles
+            )
+            self._published = state
+
+        self.connection.send(
+            _Published(
+                sequence=self.sequence,
+                count=len(state.objects),
+                objects=objects,
+                loading=tuple(self.keys[id(obj)] for obj in simulation.loading),
+                holding=state.holding,
+                sim_sleep=simulation.sim_sleep,
+                frame=state.frame,
+                last_step_time=simulation.last_step_time,
+                has_pending=simulation.has_pending or bool(simulation.loading),
+                ring=ring,
+                particles=particles,
+            )
+        )
+
+    def serve(self):
+        self.simulation.setup()
+        self.publish()
+        while True:
+            request = self.connection.recv()
+            if isinstance(request, _Stop):
+                break
+            assert isinstance(request, _Step)
+            for command in request.commands:
+                self.simulation.send(_map_objects(command, self.decode))
+            self.simulation.iterations = request.iterations
+            self.simulation.step(request.dt, request.substeps)
+            self.forget_removed()
+            self.publish()
+
+        if self.ring is not None:
+            self.ring.memory.close()
+            self.ring.memory.unlink()
+
+
+def _serve(
+    connection: multiprocessing.connection.Connection,
+    settings: dict[str, typing.Any],
+    objects: list[_New],
+    particles: list[_New],
+):
+    try:
+        worker = _Worker(connection, Simulation(**settings, physics_objects=[]))
+        worker.simulation.physics_objects = [worker.decode(obj) for obj in objects]
+        worker.simulation.particles = [worker.decode(system) for system in particles]
+        worker.serve()
+    except Exception:
+        connection.send(_Failed(traceback.format_exc()))
+    except KeyboardInterrupt:
+        pass
+
+
+@dataclasses.dataclass
+class RemoteSimulation:
+    """Run a `Simulation` in a worker process.
+
+    It is used like the simulation it runs: commands are sent with `send`, `step`
+    advances it and `state` is the state after the last step. Settings that are
+    not about the running simulation, like `width` or `gravity`, are read from
+    `simulation`, which is never stepped itself.
+
+    States read the bodies straight from shared memory. A state stays valid until
+    `SLOTS - 1` more states have been published, so `step` must not be called
+    more than `MAX_STEPS_PER_FRAME` times while a state is being read.
+    """
+
+    simulation: Simulation
+
+    restore: snapshot.Restore = dataclasses.field(default_factory=dict)
+    state: SimState = dataclasses.field(default_factory=SimState.empty)
+    loading: list[PhysicsObject] = dataclasses.field(default_factory=list)
+    """Objects the worker is still loading."""
+    departures: collections.deque[Departure] = dataclasses.field(
+        default_factory=collections.deque
+    )
+    """Always empty, objects can't move between worker processes."""
+    sim_sleep = False
+    last_step_time = 0.0
+
+    _commands: collections.deque[Command] = dataclasses.field(
+        default_factory=collections.deque
+    )
+    _objects: dict[int, PhysicsObject | Particles] = dataclasses.field(
+        default_factory=dict
+    )
+    _keys: dict[int, int] = dataclasses.field(default_factory=dict)
+    _next_key = 0
+    _connection: multiprocessing.connection.Connection | None = None
+    _process: multiprocessing.process.BaseProcess | None = None
+    _ring: _Ring | None = None
+    # Rings that were replaced. States may still read from them.
+    _old_rings: list[_Ring] = dataclasses.field(default_factory=list)
+    _sequence = 0
+    _started = False
+    _worker_pending = False
+
+    def __post_init__(self):
+        self.iterations = self.simulation.iterations
+
+    def __getattr__(self, name: str) -> typing.Any:
+        return getattr(self.simulation, name)
+
+    def setup(self):
+        """Start the worker. It sets the simulation up and publishes the first
+        state while the client goes on starting up."""
+        context = multiprocessing.get_context("spawn")
+        self._connection, child = context.Pipe()
+        settings = {name: getattr(self.simulation, name) for name in _SETTINGS}
+        settings["restore"] = self.restore
+        objects = [self._encode(obj) for obj in self.simulation.physics_objects]
+        particles = [self._encode(system) for system in self.simulation.particles]
+        self.loading = list(self.simulation.physics_objects)
+
+        self._process = context.Process(
+            target=_serve,
+            args=(child, settings, objects, particles),
+            name="desktop-thingies physics",
+            daemon=True,
+        )
+        self._process.start()
+        child.close()
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._commands) or not self._started or self._worker_pending
+
+    def send(self, command: Command):
+        self._commands.append(command)
+
+    def step(self, dt: float, substeps: int = 1):
+        assert self._connection
+        if not self._started:
+            self._receive()
+            self._started = True
+
+        commands = []
+        while self._commands:
+            commands.append(_map_objects(self._commands.popleft(), self._encode))
+        self._connection.send(_Step(commands, dt, substeps, self.iterations))
+        self._receive()
+
+    def close(self):
+        if self._process is None:
+            return
+        assert self._connection
+        try:
+            self._connection.send(_Stop())
+        except OSError:
+            pass
+        self._process.join(timeout=1)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+
+        # The worker unlinks its ring when it stops, unless it had to be killed.
+        self.state = SimState.empty()
+        for ring in [*self._old_rings, self._ring]:
+            if ring is None:
+                continue
+            try:
+                ring.memory.close()
+            except BufferError:
+                # Someone still has arrays of an old state, the mapping goes away
+                # with them.
+                pass
+            try:
+                ring.memory.unlink()
+            except FileNotFoundError:
+                pass
+        self._ring = None
+        self._old_rings = []
+
+    def _encode(self, obj: PhysicsObject | Particles) -> _Ref | _New:
+        if (key := self._keys.get(id(obj))) is not None:
+            return _Ref(key)
+        key = self._next_key
+        self._next_key += 1
+        # Keeping the object around also keeps its `id` from being reused.
+        self._objects[key] = obj
+        self._keys[id(obj)] = key
+        return _New(key, physics_object.to_dict(obj))
+
+    def _receive(self):
+        assert self._connection
+        reply = self._connection.recv()
+        if isinstance(reply, _Failed):
+            raise RuntimeError(f"The physics worker failed:\n{reply.traceback}")
+        assert isinstance(reply, _Published)
+
+        if reply.ring is not None:
+            if self._ring is not None:
+                self._old_rings.append(self._ring)
+            self._ring = _Ring.attach(*reply.ring)
+
+        self.loading = [self._objects[key] for key in reply.loading]
+        self.sim_sleep = reply.sim_sleep
+        self.last_step_time = reply.last_step_time
+        self._worker_pending = reply.has_pending
+
+        if reply.sequence != self._sequence:
+            self._sequence = reply.sequence
+            self._read_state(reply)
+        self._forget_removed()
+
+    def _forget_removed(self):
+        """Drop the objects the worker dropped after the last step: the ones that
+        are neither in the state nor loading."""
+        live = {id(obj) for obj in self.state.objects + tuple(self.loading)}
+        for key, obj in list(self._objects.items()):
+            if isinstance(obj, PhysicsObject) and id(obj) not in live:
+                del self._objects[key]
+                del self._keys[id(obj)]
+
+    def _read_state(self, reply: _Published):
+        """Point `state` at the slot of the state in `reply`."""
+        previous = self.state
+        if reply.objects is not None:
+            objects = tuple(self._objects[key] for key in reply.objects)
+            for obj in objects:
+                # The client's copy is only used for drawing and hit testing, but
+                # those need it loaded.
+                if obj._body is None:
+                    assert obj._loading
+                    obj._loading.result()
+                    obj._finish_loading()
+            hit_radii = np.array([obj.hit_radius() for obj in objects], dtype=float)
+            pickup_distances = np.array(
+                [obj.pickup_distance for obj in objects], dtype=float
+            )
+            hit_radii.setflags(write=False)
+            pickup_distances.setflags(write=False)
+        else:
+            objects = previous.objects
+            hit_radii = previous.hit_radii
+            pickup_distances = previous.pickup_distances
+
+        previous_particles = {
+            id(state.particles): state for state in previous.particles
+        }
+        particles = []
+        for (
+            key,
+            seed,
+            positions,
+            angles,
+            velocities,
+            angular_velocities,
+            asleep,
+        ) in reply.particles:
+            system = self._objects[key]
+            assert isinstance(system, Particles)
+            # Drawing needs the same sizes and colours as the worker picked.
+            if system._seed != seed:
+                system._pick_looks(seed)
+            old = previous_particles.get(id(system))
+            for array in (positions, angles, velocities, angular_velocities):
+                array.setflags(write=False)
+            particles.append(
+                ParticleState(
+                    particles=system,
+                    positions=positions,
+                    angles=angles,
+                    previous_positions=positions if old is None else old.positions,
+                    previous_angles=angles if old is None else old.angles,
+                    velocities=velocities,
+                    angular_velocities=angular_velocities,
+                    asleep=asleep,
+                )
+            )
+
+        assert self._ring
+        arrays = self._ring.arrays(reply.sequence % SLOTS, reply.count)
+        for array in arrays.values():
+            array.setflags(write=False)
+        self.state = SimState(
+            objects=objects,
+            **arrays,
+            hit_radii=hit_radii,
+            pickup_distances=pickup_distances,
+            holding=reply.holding,
+            sim_sleep=reply.sim_sleep,
+            frame=reply.frame,
+            particles=tuple(particles),
+        )
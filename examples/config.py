@@ -3,14 +3,50 @@ from desktop_thingies import Texture
 # The display this program should show up on, optional
 display = "DP-3"
 
-# The target framerate, optional
+# The monitors to show objects on, optional. Every monitor gets its own copy of
+# `objects`. `objects` can also be a dict of monitor name to objects instead.
+# monitors = ["DP-3", "HDMI-A-1"]
+
+# Let objects move between monitors that are next to each other, optional.
+handoff = False
+
+# The target framerate, optional. The monitor's refresh rate is used by default.
 framerate = 60
 
+# "adaptive" ticks less often while objects only drift slowly, "fixed" ticks every
+# frame until everything is asleep, optional.
+pacing = "adaptive"
+
+# Put objects back where they were when the program last ran, optional.
+resume = True
+
 # The vertical and horizontal gravity for the stage.
 gravity = (0, 0)
 
+# Settings for scenes with lots of objects, all optional. See
+# `python -m desktop_thingies.bench` to find out what works best on your machine.
+# Solve collisions on 2 threads, only works on Linux.
+# threads = 2
+# Use a spatial hash to find collisions. True picks the cell size from the objects.
+# spatial_hash = True
+# Solver iterations per step. Fewer is faster but stacks get softer. When steps take
+# too long iterations are lowered down to `min_iterations`.
+# iterations = 10
+# min_iterations = 4
+# Fast objects are simulated in up to this many smaller steps so they don't pass
+# through each other or the walls.
+# max_substeps = 4
+# Run the physics in a separate process, so slow steps never hold up drawing. Doesn't
+# work together with `handoff`.
+# worker = True
+
 # The physics objects to display.
 objects = [
     Texture(texture="examples/reimu_fumo.png", scale=1 / 6),
-    Texture(texture="examples/reimu_fumo.png", scale=1 / 5),
+    # `collision="alpha"` traces the outline of the image instead of using a circle.
+    Texture(texture="examples/reimu_fumo.png", scale=1 / 5, collision="alpha"),
+    # Lots of small round things are cheaper as one `Particles` than as objects.
+    # They can't be picked up. `texture=` draws them with an image instead. Add
+    # `from desktop_thingies import Particles` at the top to use them.
+    # Particles(count=1000, size=(6, 12), colors=("#f7c6d9", "#c6e2f7", "#fdf1b8")),
 ]
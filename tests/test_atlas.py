@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from desktop_thingies import atlas
+from desktop_thingies.textures import TextureImage
+
+
+@pytest.fixture(autouse=True)
+def empty_atlas(monkeypatch):
+    monkeypatch.setattr(atlas, "_pages", [])
+    monkeypatch.setattr(atlas, "_regions", {})
+    monkeypatch.setattr(atlas, "_gdk_textures", {})
+
+
+def _image(name, width, height, value=255):
+    data = np.full((height, width, 4), value, dtype=np.uint8).tobytes()
+    return TextureImage((name, 1.0), width, height, data)
+
+
+def _overlap(a, b):
+    return (
+        a.page == b.page
+        and a.x < b.x + b.width
+        and b.x < a.x + a.width
+        and a.y < b.y + b.height
+        and b.y < a.y + a.height
+    )
+
+
+def test_images_are_packed_without_overlapping():
+    regions = [atlas.add(_image(str(i), 300 + i * 7, 100 + i * 13)) for i in range(20)]
+    assert {region.page for region in regions} == {0}
+    for i, a in enumerate(regions):
+        for b in regions[i + 1 :]:
+            assert not _overlap(a, b)
+        # Leave room for the gutter on every side.
+        assert a.x >= atlas.GUTTER and a.y >= atlas.GUTTER
+        assert a.x + a.width + atlas.GUTTER <= atlas.PAGE_WIDTH
+
+
+def test_pixels_and_gutter_are_copied():
+    region = atlas.add(_image("a", 4, 3, value=7))
+    pixels = atlas._pages[region.page].pixels
+    x, y, g = region.x, region.y, atlas.GUTTER
+    assert (pixels[y : y + 3, x : x + 4] == 7).all()
+    # The gutter repeats the edge pixels.
+    assert (pixels[y - g : y + 3 + g, x - g : x + 4 + g] == 7).all()
+
+
+def test_adding_the_same_image_again_reuses_it():
+    generation = atlas.generation()
+    region = atlas.add(_image("a", 10, 10))
+    version = atlas.version(region.page)
+    assert atlas.generation() != generation
+
+    assert atlas.add(_image("a", 10, 10)) is region
+    assert atlas.version(region.page) == version
+
+
+def test_pages_grow_and_overflow():
+    first = atlas.add(_image("a", 100, 100))
+    assert atlas._pages[0].height == 100 + 2 * atlas.GUTTER
+
+    tall = atlas.MAX_PAGE_HEIGHT - 50
+    second = atlas.add(_image("b", atlas.PAGE_WIDTH - 2 * atlas.GUTTER, tall))
+    assert second.page == 1
+    assert first.page == 0
+
+    wide = atlas.add(_image("c", atlas.PAGE_WIDTH * 2, 10))
+    assert atlas._pages[wide.page].width >= atlas.PAGE_WIDTH * 2
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from desktop_thingies.damage import TILE_SIZE, DamageTracker, bounding_boxes
+
+
+def _frame(positions):
+    positions = np.array(positions, dtype=float)
+    count = len(positions)
+    transforms = np.column_stack((positions, np.ones((count, 2)), np.zeros(count)))
+    boxes = bounding_boxes(
+        positions, np.ones((count, 2)), np.zeros(count), np.full((count, 2), 20.0)
+    )
+    return transforms, boxes
+
+
+def test_bounding_boxes_grow_with_rotation():
+    position = np.array([[100.0, 100.0]])
+    stretch = np.ones((1, 2))
+    size = np.array([[20.0, 10.0]])
+    upright = bounding_boxes(position, stretch, np.array([0.0]), size)
+    assert upright.tolist() == [[89, 94, 111, 106]]
+    turned = bounding_boxes(position, stretch, np.array([90.0]), size)
+    assert turned[0] == pytest.approx([94, 89, 106, 111])
+
+
+def test_first_frame_redraws_everything():
+    tracker = DamageTracker(640, 640)
+    dirty = tracker.update(*_frame([(32, 32), (352, 352)]))
+    assert dirty.tolist() == [True, True]
+    assert tracker.damage > 0
+
+
+def test_only_moved_objects_are_redrawn():
+    tracker = DamageTracker(640, 640)
+    tracker.update(*_frame([(32, 32), (352, 352)]))
+
+    dirty = tracker.update(*_frame([(32, 32), (352, 352)]))
+    assert dirty.tolist() == [False, False]
+    assert tracker.damage == 0
+
+    dirty = tracker.update(*_frame([(32, 32), (360, 352)]))
+    assert dirty.tolist() == [False, True]
+    # The old and the new box of the moved object fall into the same tile.
+    assert tracker.damage == pytest.approx(1 / (640 // TILE_SIZE) ** 2)
+
+
+def test_invalidate_redraws_everything():
+    tracker = DamageTracker(640, 640)
+    frame = _frame([(32, 32), (352, 352)])
+    tracker.update(*frame)
+    tracker.invalidate()
+    assert tracker.update(*frame).all()
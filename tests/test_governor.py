@@ -0,0 +1,47 @@
+from desktop_thingies.governor import Governor
+
+BUDGET = 0.008
+
+
+def test_sheds_iterations_before_substeps():
+    governor = Governor(min_iterations=4, max_iterations=10, max_substeps=4)
+    governor.substeps = 4
+    governor.update(BUDGET * 2, BUDGET, 4)
+    assert governor.iterations < 10
+    assert governor.substeps == 4
+
+    for _ in range(20):
+        governor.update(BUDGET * 2, BUDGET, 4)
+    assert governor.iterations == 4
+    assert governor.substeps < 4
+
+
+def test_recovers_once_steps_are_cheap_again():
+    governor = Governor(min_iterations=4, max_iterations=10, max_substeps=4)
+    for _ in range(20):
+        governor.update(BUDGET * 2, BUDGET, 1)
+    assert governor.iterations == 4
+
+    for _ in range(50):
+        governor.update(BUDGET * 0.1, BUDGET, 1)
+    assert governor.iterations == 10
+    assert governor.substeps == 1
+
+
+def test_adds_substeps_for_a_fling_right_away():
+    governor = Governor(min_iterations=4, max_iterations=10, max_substeps=4)
+    governor.update(BUDGET * 0.1, BUDGET, 1)
+    governor.update(BUDGET * 0.1, BUDGET, 3)
+    assert governor.substeps == 3
+
+    # And drops them as soon as they aren't needed.
+    governor.update(BUDGET * 0.1, BUDGET, 1)
+    assert governor.substeps == 1
+
+
+def test_set_bounds_clamps_the_current_settings():
+    governor = Governor(min_iterations=4, max_iterations=10, max_substeps=4)
+    governor.substeps = 4
+    governor.set_bounds(2, 6, 2)
+    assert governor.iterations == 6
+    assert governor.substeps == 2
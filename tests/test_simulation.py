@@ -0,0 +1,191 @@
+import math
+
+import pymunk
+import pytest
+
+from desktop_thingies.physics_object import Circle
+from desktop_thingies.simulation import (
+    AddObject,
+    Grab,
+    MoveMouse,
+    Release,
+    RemoveObject,
+    SetObjects,
+    Simulation,
+)
+
+STEP = 1 / 60
+
+
+def _old_velocity_callback(body, gravity, damping, dt):
+    """The per body velocity callback velocities were limited with before, run
+    once per step."""
+    pymunk.Body.update_velocity(body, gravity, damping, dt)
+    body.velocity *= 0.99
+    body.angular_velocity *= 0.99
+    if body.velocity.length > 500:
+        body.velocity *= 0.9
+    if body.velocity.length > 500 * 1.5:
+        body.velocity = body.velocity * 0.5
+    if abs(body.angular_velocity) > 15:
+        body.angular_velocity = body.angular_velocity * 0.8
+
+
+# Start velocity and angular velocity: slow, fast enough to be clamped, spinning.
+STARTS = [((30, -20), 1), ((700, 0), 0), ((-200, 100), 20)]
+
+
+def _reference(gravity, steps):
+    space = pymunk.Space()
+    space.gravity = gravity
+    bodies = []
+    for i, (velocity, angular_velocity) in enumerate(STARTS):
+        body = pymunk.Body(1, pymunk.moment_for_circle(1, 0, 1))
+        body.position = (1000 + i * 1000, 1000)
+        body.velocity = velocity
+        body.angular_velocity = angular_velocity
+        body.velocity_func = _old_velocity_callback
+        space.add(body, pymunk.Circle(body, 1))
+        bodies.append(body)
+    for _ in range(steps):
+        space.step(STEP)
+    return [(body.velocity, body.angular_velocity) for body in bodies]
+
+
+def _simulated(gravity, steps, substeps):
+    objects = [Circle(radius=10) for _ in STARTS]
+    simulation = Simulation(
+        width=100_000, height=100_000, gravity=gravity, physics_objects=objects
+    )
+    simulation.setup()
+    for i, (obj, (velocity, angular_velocity)) in enumerate(zip(objects, STARTS)):
+        obj._body.position = (1000 + i * 1000, 1000)
+        obj._body.velocity = velocity
+        obj._body.angular_velocity = angular_velocity
+    for _ in range(steps):
+        simulation.step(STEP, substeps)
+    return [(obj._body.velocity, obj._body.angular_velocity) for obj in objects]
+
+
+@pytest.mark.parametrize("substeps", [1, 4])
+@pytest.mark.parametrize("gravity", [(0, 0), (0, 50)])
+def test_damping_matches_velocity_callback(substeps, gravity):
+    steps = 90
+    expected = _reference(gravity, steps)
+    actual = _simulated(gravity, steps, substeps)
+    for (velocity, angular_velocity), (expected_velocity, expected_angular) in zip(
+        actual, expected
+    ):
+        assert velocity.x == pytest.approx(expected_velocity.x, rel=0.01, abs=0.5)
+        assert velocity.y == pytest.approx(expected_velocity.y, rel=0.01, abs=0.5)
+        assert angular_velocity == pytest.approx(expected_angular, rel=0.01, abs=0.01)
+
+
+def test_fling_distance_does_not_depend_on_substeps():
+    distances = []
+    for substeps in (1, 4):
+        obj = Circle(radius=5)
+        simulation = Simulation(
+            width=100_000, height=1000, gravity=(0, 0), physics_objects=[obj]
+        )
+        simulation.setup()
+        obj._body.position = (10, 5)
+        obj._body.velocity = (300, 0)
+        for _ in range(60):
+            simulation.step(STEP, substeps)
+        distances.append(obj._body.position.x - 10)
+    assert distances[0] == pytest.approx(distances[1], rel=0.01)
+    assert not math.isclose(distances[0], 0)
+
+
+def _resting_simulation(count=3):
+    objects = [Circle(radius=20) for _ in range(count)]
+    simulation = Simulation(
+        width=800, height=600, gravity=(0, 500), physics_objects=objects
+    )
+    simulation.setup()
+    return simulation, objects
+
+
+def test_step_publishes_a_new_state():
+    simulation, objects = _resting_simulation()
+    first = simulation.state
+    assert first.objects == tuple(objects)
+
+    simulation.step(STEP)
+    assert simulation.state is not first
+    assert simulation.sim_frame == 1
+    assert simulation.state.positions.shape == (len(objects), 2)
+
+
+def test_simulation_falls_asleep_and_stops_stepping():
+    simulation, objects = _resting_simulation()
+    for _ in range(60 * 20):
+        simulation.step(STEP)
+        if simulation.sim_sleep:
+            break
+    assert simulation.sim_sleep
+    assert simulation.state.sleeping.all()
+    assert simulation.state.awake_count() == 0
+
+    # A sleeping simulation doesn't step or publish.
+    frame, state = simulation.sim_frame, simulation.state
+    simulation.step(STEP)
+    assert simulation.sim_frame == frame
+    assert simulation.state is state
+
+    # Picking an object up wakes it.
+    simulation.send(Grab(objects[0]))
+    simulation.step(STEP)
+    assert not simulation.sim_sleep
+    assert simulation.sim_frame == frame + 1
+
+
+def test_commands_wait_for_the_next_step():
+    simulation, objects = _resting_simulation()
+    extra = Circle(radius=10)
+    simulation.send(RemoveObject(objects[0]))
+    simulation.send(AddObject(extra, (400, 300), 0))
+    assert simulation.has_pending
+    assert simulation.state.objects == tuple(objects)
+
+    simulation.step(STEP)
+    assert not simulation.has_pending
+    assert simulation.state.objects == (*objects[1:], extra)
+
+
+def test_commands_are_applied_in_order():
+    simulation, objects = _resting_simulation()
+    simulation.send(MoveMouse(100, 100))
+    simulation.send(Grab(objects[0]))
+    simulation.send(Release())
+    simulation.send(Grab(objects[1]))
+    simulation.step(STEP)
+    assert simulation.holding_body is objects[1]._body
+    assert simulation.mouse_position == (100, 100)
+
+
+def test_commands_for_removed_objects_are_ignored():
+    simulation, objects = _resting_simulation()
+    simulation.send(RemoveObject(objects[0]))
+    simulation.send(Grab(objects[0]))
+    simulation.send(RemoveObject(objects[0]))
+    simulation.step(STEP)
+    assert simulation.holding_body is None
+    assert simulation.state.objects == tuple(objects[1:])
+
+
+def test_set_objects_keeps_objects_with_the_same_settings():
+    simulation, objects = _resting_simulation(2)
+    simulation.step(STEP)
+    position = simulation.state.positions[0].copy()
+
+    replacement = Circle(radius=20)
+    other = Circle(radius=5)
+    simulation.send(SetObjects([replacement, other]))
+    simulation.step(STEP)
+    assert objects[0] in simulation.state.objects
+    assert objects[1] not in simulation.state.objects
+    assert other in simulation.state.objects
+    # The kept object carries on from where it was.
+    assert simulation.state.positions[0] == pytest.approx(position, abs=5)
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from desktop_thingies import snapshot
+from desktop_thingies.physics_object import Circle
+from desktop_thingies.simulation import Simulation
+
+STEP = 1 / 60
+
+
+def _simulation(objects, restore=None):
+    simulation = Simulation(
+        width=800,
+        height=600,
+        gravity=(0, 500),
+        physics_objects=objects,
+        restore=restore or {},
+    )
+    simulation.setup()
+    return simulation
+
+
+def test_round_trip_puts_bodies_back(tmp_path):
+    path = tmp_path / "DP-1.snapshot"
+    saved = _simulation([Circle(radius=20), Circle(radius=20), Circle(radius=30)])
+    for _ in range(30):
+        saved.step(STEP)
+    snapshot.save(path, saved.state, 800, 600)
+
+    restore = snapshot.load(path, 800, 600)
+    assert sum(len(bodies) for bodies in restore.values()) == 3
+
+    loaded = _simulation(
+        [Circle(radius=30), Circle(radius=20), Circle(radius=20)], restore
+    )
+    assert not any(restore.values())
+    # Positions are saved as 32 bit floats.
+    for radius in (20, 30):
+        expected = sorted(
+            saved.state.positions[i].tolist()
+            for i, obj in enumerate(saved.state.objects)
+            if obj.radius == radius
+        )
+        actual = sorted(
+            loaded.state.positions[i].tolist()
+            for i, obj in enumerate(loaded.state.objects)
+            if obj.radius == radius
+        )
+        assert np.array(actual) == pytest.approx(np.array(expected), abs=1e-3)
+
+
+def test_round_trip_keeps_sleeping_bodies_asleep(tmp_path):
+    path = tmp_path / "DP-1.snapshot"
+    saved = _simulation([Circle(radius=20) for _ in range(3)])
+    while not saved.sim_sleep:
+        saved.step(STEP)
+    snapshot.save(path, saved.state, 800, 600)
+
+    loaded = _simulation(
+        [Circle(radius=20) for _ in range(3)], snapshot.load(path, 800, 600)
+    )
+    assert loaded.state.sleeping.all()
+    assert loaded.sim_sleep
+
+
+def test_load_ignores_other_screen_sizes(tmp_path):
+    path = tmp_path / "DP-1.snapshot"
+    snapshot.save(path, _simulation([Circle(radius=20)]).state, 800, 600)
+    assert not snapshot.load(path, 1920, 1080)
+
+
+def test_load_ignores_missing_and_broken_files(tmp_path):
+    path = tmp_path / "DP-1.snapshot"
+    assert not snapshot.load(path, 800, 600)
+    path.write_bytes(b"")
+    assert not snapshot.load(path, 800, 600)
+    path.write_bytes(b"DTSS broken")
+    assert not snapshot.load(path, 800, 600)
@@ -0,0 +1,40 @@
+from desktop_thingies.startup import StartupProfile
+
+
+def test_report_waits_for_every_phase(capsys):
+    # The same order the client goes through with --profile-startup.
+    startup = StartupProfile()
+    with startup.phase("config"):
+        pass
+    with startup.phase("imports"):
+        pass
+    startup.mark("activate")
+    with startup.phase("window DP-1"):
+        pass
+    assert capsys.readouterr().err == ""
+
+    startup.wait_for("textures decoded", "first frame DP-1")
+    startup.mark("first frame DP-1")
+    assert capsys.readouterr().err == ""
+
+    startup.mark("textures decoded")
+    report = capsys.readouterr().err
+    for name in (
+        "config",
+        "imports",
+        "activate",
+        "window DP-1",
+        "first frame DP-1",
+        "textures decoded",
+    ):
+        assert name in report
+
+
+def test_report_when_marks_happened_before_waiting(capsys):
+    startup = StartupProfile()
+    startup.mark("textures decoded")
+    startup.wait_for("textures decoded")
+    assert "textures decoded" in capsys.readouterr().err
+
+    startup.mark("later")
+    assert capsys.readouterr().err == ""
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from desktop_thingies.constants import MAX_STEPS_PER_FRAME
+from desktop_thingies.physics_object import Circle
+from desktop_thingies.simulation import RemoveObject, SetObjects, Simulation
+from desktop_thingies.worker import MIN_CAPACITY, RemoteSimulation
+
+STEP = 1 / 60
+
+
+@pytest.fixture
+def remote():
+    objects = [Circle(radius=10) for _ in range(5)]
+    simulation = RemoteSimulation(
+        Simulation(width=800, height=600, gravity=(0, 500), physics_objects=objects)
+    )
+    simulation.setup()
+    yield simulation
+    simulation.close()
+
+
+def test_state_survives_a_full_frame_of_steps(remote):
+    remote.step(STEP)
+    state = remote.state
+    positions = state.positions.copy()
+    velocities = state.velocities.copy()
+
+    for _ in range(MAX_STEPS_PER_FRAME):
+        remote.step(STEP)
+    assert remote.state is not state
+    assert (remote.state.positions != positions).any()
+    # The ring didn't come back around to the slot `state` is read from.
+    assert (state.positions == positions).all()
+    assert (state.velocities == velocities).all()
+
+
+def test_ring_grows_for_more_bodies(remote):
+    remote.step(STEP)
+    objects = [Circle(radius=2) for _ in range(MIN_CAPACITY + 10)]
+    remote.send(SetObjects(objects))
+    remote.step(STEP)
+    remote.step(STEP)
+    assert len(remote.state.objects) == len(objects)
+    assert remote._ring.capacity >= len(objects)
+
+
+def test_removed_objects_are_forgotten(remote):
+    remote.step(STEP)
+    remote.send(RemoveObject(remote.state.objects[0]))
+    remote.step(STEP)
+    assert len(remote.state.objects) == 4
+    assert len(remote._objects) == 4
+
+
+def test_close_unlinks_the_ring(remote):
+    remote.step(STEP)
+    name = remote._ring.memory.name
+    remote.close()
+    assert not os.path.exists("/dev/shm/" + name.lstrip("/"))